@@ -0,0 +1,33 @@
+# measure encode/decode time and payload size for each available message codec
+import timeit
+from rhizo import wire
+
+
+iterations = 20000
+messages = {
+    'ping': {'type': 'ping', 'parameters': {}},
+    'update (10 values)': {
+        'type': 'update',
+        'parameters': dict([('$t', '2021-01-01T00:00:00.123456 Z')] + [('sensor_%d' % i, '%.2f' % (i * 1.5)) for i in range(10)]),
+        'folder': '/lab/controller',
+    },
+    'send_email': {
+        'type': 'send_email',
+        'parameters': {'email_addresses': 'someone@example.com', 'subject': 'system error', 'body': 'x' * 200},
+    },
+}
+
+
+print('%-10s %-20s %10s %12s %12s' % ('codec', 'message', 'bytes', 'encode (us)', 'decode (us)'))
+for name in sorted(wire.codecs):
+    try:
+        codec = wire.get_codec(name)
+    except ImportError:
+        print('%-10s (not installed)' % name)
+        continue
+    for (label, message) in messages.items():
+        data = codec.encode(message)
+        size = len(data) if codec.binary else len(data.encode())
+        encode_time = timeit.timeit(lambda: codec.encode(message), number=iterations) / iterations * 1e6
+        decode_time = timeit.timeit(lambda: codec.decode(data), number=iterations) / iterations * 1e6
+        print('%-10s %-20s %10d %12.2f %12.2f' % (name, label, size, encode_time, decode_time))
@@ -0,0 +1,65 @@
+# measure client message throughput and latency against an in-process loopback server (no network or real server needed)
+import os
+import sys
+import time
+import tempfile
+sys.argv = sys.argv[:1]  # the controller parses command-line options
+import gevent
+from rhizo.controller import Controller
+from rhizo.loopback import LoopbackServer, LoopbackTransport
+
+
+update_count = 20000
+round_trip_count = 1000
+
+
+# measure how quickly sequence updates are delivered to the server
+def measure_throughput(label, server, c):
+    path = c.path_on_server() + '/counter'
+    start_time = time.time()
+    for i in range(update_count):
+        c.sequences.update('counter', i)
+    queued_time = time.time()
+    while len(server.sequence_values.get(path, [])) < update_count:
+        gevent.sleep(0.01)
+    end_time = time.time()
+    print('%-24s %8.0f updates/sec (%.1f us per update call)' % (label, update_count / (end_time - start_time), (queued_time - start_time) / update_count * 1e6))
+
+
+# measure time from server sending a message to client handler receiving it
+def measure_latency(label, server, c):
+    latencies = []
+    c.messages.add_handler(lambda message_type, parameters: latencies.append(time.time() - parameters['t']), types=['echo'])
+    for i in range(round_trip_count):
+        server.send_message(c.path_on_server(), 'echo', {'t': time.time()})
+        gevent.sleep(0.001)
+    gevent.sleep(0.5)
+    latencies.sort()
+    print('%-24s median: %.1f us, p99: %.1f us' % (label, latencies[len(latencies) // 2] * 1e6, latencies[int(len(latencies) * 0.99)] * 1e6))
+
+
+# measure request/response round-trip time
+def measure_requests(label, server, c):
+    server.add_responder('echo_request', lambda parameters: ('echo_response', {}))
+    latencies = []
+    for i in range(round_trip_count):
+        start_time = time.time()
+        c.messages.request('echo_request', {}).get(timeout=5)
+        latencies.append(time.time() - start_time)
+    latencies.sort()
+    print('%-24s request median: %.1f us, p99: %.1f us' % (label, latencies[len(latencies) // 2] * 1e6, latencies[int(len(latencies) * 0.99)] * 1e6))
+
+
+configs = [
+    ('websocket', {}),
+    ('mqtt', {'enable_ws': False, 'mqtt_host': 'loopback'}),
+    ('mqtt (packed samples)', {'enable_ws': False, 'mqtt_host': 'loopback', 'mqtt_packed_samples': True, 'mqtt_pack_interval': 0.1}),
+]
+os.chdir(tempfile.mkdtemp())  # the controller writes logs to the current directory
+for (label, config) in configs:
+    server = LoopbackServer()
+    config.update({'server_name': 'loopback', 'secret_key': server.secret_key, 'server_log_level': 'error'})
+    c = Controller(config, transport=LoopbackTransport(server))
+    measure_throughput(label, server, c)
+    measure_latency(label, server, c)
+    measure_requests(label, server, c)
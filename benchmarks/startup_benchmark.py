@@ -0,0 +1,44 @@
+# measure the time to import rhizo.controller (in a fresh interpreter) and to construct a controller, with and without
+# fast_start, against a loopback server with simulated network latency; exits with an error if the cold start time
+# (import + fast_start construction) exceeds the target;
+# usage: python startup_benchmark.py [target in milliseconds]
+import os
+import sys
+import time
+import tempfile
+import subprocess
+
+
+target = float(sys.argv[1]) / 1000.0 if len(sys.argv) > 1 else 0.5
+import_runs = 5
+latency = 0.05  # simulated network latency (seconds)
+
+
+# import the controller module in a fresh interpreter and return the import time
+def measure_import():
+    code = 'import time; start = time.time(); import rhizo.controller; print(time.time() - start)'
+    return float(subprocess.check_output([sys.executable, '-c', code]).decode().strip())
+
+
+import_times = sorted(measure_import() for i in range(import_runs))
+import_time = import_times[import_runs // 2]
+print('import rhizo.controller: %.1f ms (median of %d)' % (import_time * 1000, import_runs))
+
+sys.argv = sys.argv[:1]  # the controller parses command-line options
+os.chdir(tempfile.mkdtemp())  # the controller writes logs to the current directory
+from rhizo.controller import Controller
+from rhizo.loopback import LoopbackServer, LoopbackTransport
+for fast_start in (False, True):
+    server = LoopbackServer()
+    config = {'server_name': 'loopback', 'secret_key': server.secret_key, 'server_log_level': 'error'}
+    start_time = time.time()
+    c = Controller(config, transport=LoopbackTransport(server, latency), fast_start=fast_start)
+    construct_time = time.time() - start_time
+    c.ready.wait(10)
+    ready_time = time.time() - start_time
+    print('construct controller (fast_start=%s): %.1f ms, ready after %.1f ms' % (fast_start, construct_time * 1000, ready_time * 1000))
+
+cold_start_time = import_time + construct_time
+print('cold start (import + fast_start construction): %.1f ms (target: %.1f ms)' % (cold_start_time * 1000, target * 1000))
+if cold_start_time > target:
+    sys.exit(1)
@@ -0,0 +1,24 @@
+import random
+
+
+# computes delays between reconnect attempts using exponential backoff with randomized jitter,
+# so that many clients disconnected at the same time (e.g. by a server restart) spread out their reconnects;
+# with jitter = 1 each delay is drawn uniformly from [0, backoff delay] ("full jitter"); with jitter = 0 there is no randomization
+class Backoff(object):
+
+    def __init__(self, base_delay=5.0, max_delay=300.0, factor=2.0, jitter=1.0):
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.factor = factor
+        self.jitter = jitter
+        self.attempts = 0
+
+    # get the delay before the next attempt (in seconds)
+    def next_delay(self):
+        delay = min(self.base_delay * self.factor ** self.attempts, self.max_delay)
+        self.attempts += 1
+        return delay * (1.0 - self.jitter * random.random())
+
+    # call after a successful connection
+    def reset(self):
+        self.attempts = 0
@@ -1,4 +1,5 @@
 import os
+from collections import namedtuple
 import yaml
 
 from . import util
@@ -50,6 +51,48 @@ class Config(dict):
         self[name] = value
 
 
+# an immutable snapshot of settings derived from the config; code that runs for every sequence update or message reads
+# these as plain attributes rather than looking them up in the config; the controller replaces the whole snapshot
+# (rather than modifying it) when the config is reloaded, so a reader always sees a consistent set of values
+Settings = namedtuple('Settings', [
+    'enable_server',
+    'mqtt_host',
+    'mqtt_packed_samples',  # true only if mqtt_host is also set
+    'mqtt_pack_interval',
+    'mqtt_pack_max_samples',
+    'enable_local_sequence_storage',
+    'ws_max_frame_size',
+    'reconnect_replay_rate',
+])
+
+
+# build a settings snapshot from a config
+def make_settings(config):
+    mqtt_host = config.get('mqtt_host')
+    return Settings(
+        enable_server=config.get('enable_server', True),
+        mqtt_host=mqtt_host,
+        mqtt_packed_samples=bool(mqtt_host and config.get('mqtt_packed_samples', False)),
+        mqtt_pack_interval=config.get('mqtt_pack_interval', 1.0),
+        mqtt_pack_max_samples=config.get('mqtt_pack_max_samples', 500),
+        enable_local_sequence_storage=config.get('enable_local_sequence_storage', False),
+        ws_max_frame_size=config.get('ws_max_frame_size', 65536),
+        reconnect_replay_rate=config.get('reconnect_replay_rate', 0),
+    )
+
+
+# get a dictionary of the top-level entries that were added, changed or removed (with value None) in new_config
+def diff_config(old_config, new_config):
+    changes = {}
+    for (key, value) in new_config.items():
+        if key not in old_config or old_config[key] != value:
+            changes[key] = value
+    for key in old_config:
+        if key not in new_config:
+            changes[key] = None
+    return changes
+
+
 def load_config(config_file_name, use_environ=True):
     """Load a YAML or JSON configuration file.
 
@@ -2,6 +2,8 @@
 import gevent
 from gevent import monkey
 monkey.patch_all()
+from gevent.event import Event, AsyncResult
+from gevent.queue import Queue, Full
 
 
 # standard python imports
@@ -13,10 +15,7 @@ import logging
 import logging.handlers
 import datetime
 from optparse import OptionParser
-
-
-# external imports
-import psutil
+from itertools import groupby
 
 
 # our own imports
@@ -24,6 +23,21 @@ from . import config
 from .resources import FileClient
 from .sequences import SequenceClient
 from .messages import MessageClient
+from .logfiles import QueuedFileHandler
+from .transports import NetworkTransport
+from .metrics import Registry, serve_metrics, publish_metrics
+from .tracing import Tracer
+from .profiling import Profiler
+from .notifications import ErrorNotifier, run_error_handler
+from .scheduler import Scheduler
+
+
+# config entries that are only used when the controller starts; changes to these are not applied when the config is reloaded
+RESTART_CONFIG_NAMES = (
+    'enable_server', 'enable_ws', 'mqtt_host', 'mqtt_port', 'mqtt_tls', 'message_codec', 'gateway_socket',
+    'metrics_port', 'enable_metrics', 'metrics_publish_interval', 'enable_tracing', 'trace_buffer_size', 'watchdog_threshold',
+    'log_queue', 'log_queue_size', 'log_fsync', 'log_file_per_run', 'max_log_file_size', 'shutdown_hooks', 'config_reload_interval',
+)
 
 
 # A Controller object contains and manages various communication and control threads.
@@ -31,8 +45,11 @@ class Controller(object):
 
     # ======== initialization ========
 
-    # prepare internal data
-    def __init__(self, configuration=None):
+    # prepare internal data; transport can be used to connect to something other than a real server (e.g. a LoopbackTransport);
+    # if fast_start is True (or the fast_start config setting is true), the constructor returns without waiting for the
+    # server connection; use the ready event to wait for it (e.g. controller.ready.wait(timeout));
+    # pool is set for controllers created by a ControllerPool (see pool.py), which share its transport and logging
+    def __init__(self, configuration=None, transport=None, fast_start=None, pool=None):
 
         # initialize member variables
         self.config = None  # publicly accessible
@@ -40,12 +57,19 @@ class Controller(object):
         self.BUILD = 'unknown'
         self._error_handlers = []
         self._path_on_server = None
-
-        # process command arguments
+        self._tasks = []  # periodic tasks added with schedule() (cancelled by close())
+        self._server_handler = None
+        self._close_report = None
+        self._config_file_times = None  # modification times of the config files when they were loaded
+        self.pool = pool
+        self.transport = transport  # set below (after loading the config) if not specified
+        self.ready = Event()  # set once connected to the message server (or immediately if the server connection is disabled)
+
+        # process command arguments (pooled controllers ignore them; the pool's script may have its own)
         parser = OptionParser()
         parser.add_option('-c', '--config-file-name', dest='config_file_name', default='config.yaml')
         parser.add_option('-v', '--verbose', dest='verbose', action='store_true', default=False)
-        (options, args) = parser.parse_args()
+        (options, args) = parser.parse_args([] if pool else None)
 
         # prep configuration object
         if configuration:
@@ -56,76 +80,118 @@ class Controller(object):
             self.load_config()
             if not self.config:
                 sys.exit(1)
+        self.settings = config.make_settings(self.config)  # replaced when the config is reloaded
+
+        # tracing of sequence updates, message sending, HTTP requests, and message handlers (see tracing.py)
+        self.tracer = Tracer(enabled=self.config.get('enable_tracing', False), capacity=self.config.get('trace_buffer_size', 10000))
 
-        # start logging
-        self.find_build_ref()
-        self.prep_logger(options.verbose or self.config.get('verbose', False))  # make verbose if in config or command-line options
-        self.show_config()
+        # connect via a local gateway process if configured (see gateway.py)
+        if not self.transport:
+            if self.config.get('gateway_socket'):
+                from .gateway import GatewayTransport
+                self.transport = GatewayTransport(self.config.gateway_socket)
+            else:
+                self.transport = NetworkTransport(tracer=self.tracer)
+
+        # start logging (pooled controllers use the pool's log files)
+        if pool:
+            self.log_file_handler = pool.log_file_handler
+        else:
+            self.find_build_ref()
+            self.prep_logger(options.verbose or self.config.get('verbose', False))  # make verbose if in config or command-line options
+            self.show_config()
+
+        # metrics about the client's own performance (see metrics.py)
+        metrics_port = self.config.get('metrics_port')
+        self.metrics = Registry(enabled=self.config.get('enable_metrics', False) or bool(metrics_port))
+
+        # runs periodic tasks (see schedule()); shared by pooled controllers
+        self.scheduler = pool.scheduler if pool else Scheduler(self.error, self.metrics)
 
         # initialize client API modules
-        self.files = FileClient(self.config, self)
+        self.files = FileClient(self.config, self, self.transport)
         self.resources = self.files  # temp alias for compatibility
         self.sequences = SequenceClient(self)
         self.sequence = self.sequences  # temp alias for compatibility
         self.messages = MessageClient(self)
+        if metrics_port:
+            serve_metrics(self.metrics, metrics_port)
 
-        # if server connection is enabled in config
-        if self.config.get('enable_server', True):
+        # combines and rate-limits error notifications
+        self.error_notifier = ErrorNotifier(self)
+
+        # CPU and heap profiling, started by messages from the server (see profiling.py)
+        self.profiler = Profiler(self)
 
-            # if no secret key in our config, request one
-            if not self.config.get('secret_key'):
-                self.request_key()
+        # detect greenlets that block the event loop (see watchdog.py)
+        self.watchdog = None
+        if self.config.get('watchdog_threshold'):
+            from .watchdog import BlockingWatchdog
+            self.watchdog = BlockingWatchdog(self, self.config.watchdog_threshold)
+            self.watchdog.start()
 
-            # enable logging to server
-            server_handler = ServerHandler(self)
-            server_handler.set_level_name(self.config.get('server_log_level', 'info'))
-            logging.getLogger().addHandler(server_handler)
+        # flush queued data when the process exits or is terminated (see close())
+        if self.config.get('shutdown_hooks', False) and not pool:
+            self.install_shutdown_hooks()
 
-            # monitor system status
-            gevent.spawn(self.system_monitor)
+        # watch the config file for changes
+        if self.config.get('config_reload_interval') and not configuration:
+            self.schedule(self.check_config_files, self.config.config_reload_interval)
 
-            # connect to message server
-            self.messages.connect()
-            last_message_time = time.time()
-            while not self.messages.connected():
-                gevent.sleep(0.1)
-                if time.time() > last_message_time + 5:
-                    logging.info('waiting for connection to message server')
-                    last_message_time = time.time()
+        # if server connection is enabled in config
+        if self.config.get('enable_server', True):
+            if fast_start is None:
+                fast_start = self.config.get('fast_start', False)
+            if not fast_start:
+                self.connect_to_server()
+            elif self.config.get('secret_key'):
+                self.connect_to_server(wait=False)  # doesn't block once we have a key
+            else:
+                gevent.spawn(self.connect_to_server)  # requesting a key requires polling the server
+        else:
+            self.ready.set()
+
+    # request a key (if needed), start server logging and system monitoring, and connect to the message server;
+    # if wait is True, waits until connected; otherwise the ready event is set once connected
+    def connect_to_server(self, wait=True):
+
+        # if no secret key in our config, request one
+        if not self.config.get('secret_key'):
+            self.request_key()
+
+        # enable logging to server and monitor system status; these aren't done for pooled controllers, since the log
+        # handlers are shared by all controllers in the process and the system status is the same for all of them
+        if not self.pool:
+            self._server_handler = ServerHandler(self)
+            logging.getLogger().addHandler(self._server_handler)
+            self.start_system_monitor()
+        if self.metrics.enabled and self.config.get('metrics_publish_interval'):
+            self.schedule(lambda: publish_metrics(self), self.config.metrics_publish_interval, jitter=1.0, delay=0, name='publish_metrics')
+
+        # connect to message server
+        self.messages.connect()
+        if wait:
+            self.wait_for_connection()
+        else:
+            gevent.spawn(self.wait_for_connection)
+
+    # wait until connected to the message server, then set the ready event
+    def wait_for_connection(self):
+        last_message_time = time.time()
+        while not self.messages.connected():
+            gevent.sleep(0.1)
+            if time.time() > last_message_time + 5:
+                logging.info('waiting for connection to message server')
+                last_message_time = time.time()
+        self.ready.set()
 
     # prepare file and console logging for the controller (using the standard python logging library)
     # default log level is INFO unless verbose (then it is DEBUG)
     def prep_logger(self, verbose):
-        log_path = 'logs'
-        if not os.path.isdir(log_path):
-            os.makedirs(log_path)
-            if not os.path.isdir(log_path):
-                print('unable to create log directory: %s' % log_path)
-                sys.exit(1)
-        formatter = logging.Formatter('%(asctime)s: %(levelname)s: %(message)s')
-        console_handler = logging.StreamHandler()
-        console_handler.setLevel(logging.DEBUG if verbose else logging.INFO)
-        console_handler.setFormatter(formatter)
-        if self.config.get('log_file_per_run', False):
-            time_str = datetime.datetime.now().strftime('%Y-%m-%d-%H%M%S')
-            file_handler = logging.FileHandler(log_path + '/' + time_str + '.txt')
-            file_handler.setLevel(5)  # used to log serial/etc. messages to disk
-            file_handler.setFormatter(formatter)
-        else:
-            max_log_file_size = self.config.get('max_log_file_size', 10000000)
-            file_handler = logging.handlers.RotatingFileHandler(log_path + '/client-log.txt', maxBytes=max_log_file_size, backupCount=10)
-            file_handler.setLevel(logging.DEBUG)
-            file_handler.setFormatter(formatter)
-        root = logging.getLogger()
-        root.addHandler(console_handler)
-        root.addHandler(file_handler)
-        root.setLevel(logging.DEBUG)
         version_build = self.VERSION
         if self.BUILD != 'unknown':
             version_build += ':' + self.BUILD
-        logging.info('--------------' + '-' * len(version_build))
-        logging.info('Rhizo Client v' + version_build)
-        logging.info('--------------' + '-' * len(version_build))
+        self.log_file_handler = prep_logger(self.config, verbose, version_build)
 
     # get build number from git refs
     # fix(soon): rework this to use the path of this file
@@ -142,31 +208,100 @@ class Controller(object):
 
     # load configuration files
     def load_config(self):
+        new_config = self.read_config()
+        if new_config:
+            self.config = new_config
+
+    # read the config file and the local config file (if any); returns None if the config file doesn't exist
+    def read_config(self):
 
         # make sure the config file exists
         config_file_name = self._config_relative_file_name
         if not os.access(config_file_name, os.F_OK):
             logging.error('unable to load config file: %s' % config_file_name)  # note: this won't be logged on startup, since the config is used to configure logger
-            return
+            return None
 
-        # load configuration
-        self.config = config.load_config(config_file_name)
+        # load configuration; the file times are read first (so a change made while loading is seen by the next check)
+        # but only recorded once loading succeeds (so a partly-written file is loaded again by the next check)
+        file_times = self.config_file_times()
+        new_config = config.load_config(config_file_name)
 
         # check for local config
-        config_dir = os.path.dirname(config_file_name)
-        local_config_file_name = (config_dir + '/' if config_dir else '') + 'local.yaml'
+        local_config_file_name = self.local_config_file_name()
         if os.access(local_config_file_name, os.F_OK):
             local_config = config.load_config(local_config_file_name)
-            self.config.update(local_config)
+            new_config.update(local_config)
+        self._config_file_times = file_times
+        return new_config
+
+    # get the name of the local config file (which overrides entries in the main config file)
+    def local_config_file_name(self):
+        config_dir = os.path.dirname(self._config_relative_file_name)
+        return (config_dir + '/' if config_dir else '') + 'local.yaml'
+
+    # get the modification times of the config file and local config file (None if a file doesn't exist)
+    def config_file_times(self):
+        times = []
+        for file_name in (self._config_relative_file_name, self.local_config_file_name()):
+            try:
+                times.append(os.path.getmtime(file_name))
+            except OSError:
+                times.append(None)
+        return times
+
+    # reload the config files and apply any changes to the running controller; returns a dictionary of applied changes
+    def reload_config(self):
+        new_config = self.read_config()
+        if not new_config:
+            return {}
+        changes = config.diff_config(self.config, new_config)
+        if 'secret_key' in changes and changes['secret_key'] is None:  # keep a key that we obtained from the server
+            del changes['secret_key']
+        return self.apply_config_changes(changes)
+
+    # apply a dictionary of changed config entries (None for removed entries) to the running controller: log levels,
+    # server settings (reconnecting as needed), log batching, sequence packing and message sending parameters;
+    # changes to entries in RESTART_CONFIG_NAMES are ignored (with a warning); returns a dictionary of applied changes
+    def apply_config_changes(self, changes):
+        changes = dict(changes)
+        for name in list(changes):
+            if name in RESTART_CONFIG_NAMES:
+                logging.warning('config change to %s will take effect after restart' % name)
+                del changes[name]
+        if not changes:
+            return changes
+        for (name, value) in changes.items():
+            if value is None:
+                self.config.pop(name, None)
+            else:
+                self.config[name] = value
+            logging.info('config changed: %s' % config_entry_text(name, value))
+        self.settings = config.make_settings(self.config)
+        if 'verbose' in changes and not self.pool:
+            for handler in logging.getLogger().handlers:
+                if type(handler) is logging.StreamHandler:  # the console handler (file handlers are subclasses)
+                    handler.setLevel(logging.DEBUG if changes['verbose'] else logging.INFO)
+        if self._server_handler:
+            self._server_handler.apply_config(self.config)
+        if any(name in changes for name in ('server_name', 'secret_key', 'secure_server', 'ssl_skip_verify')):
+            self.files.apply_config(self.config)
+            self._path_on_server = None
+        self.messages.apply_config(changes)
+        return changes
+
+    # reload the config if the config file (or local config file) has been modified (run periodically; see config_reload_interval)
+    def check_config_files(self):
+        if self.config_file_times() != self._config_file_times:
+            try:
+                self.reload_config()
+            except Exception as e:
+                logging.warning('unable to reload config: %s' % e)
 
     # show the current configuration
     def show_config(self):
         logging.info('loaded config: %s' % self._config_relative_file_name)
         for (k, v) in self.config.items():
-            if 'secret_key' in k:
-                logging.debug('%s: %s...%s' % (k, v[:3], v[-3:]))
-            else:
-                logging.debug('%s: %s' % (k, v))
+            logging.debug(config_entry_text(k, v))
 
     # ======== public API ========
 
@@ -181,30 +316,75 @@ class Controller(object):
     def add_error_handler(self, error_handler):
         self._error_handlers.append(error_handler)
 
-    # trigger the error handler(s)
+    # trigger the error handler(s); each handler runs on its own greenlet (with a timeout), and notifications to
+    # error recipients are combined and rate-limited by the error notifier (see notifications.py)
     def error(self, message=None, exception=None):
+        handler_timeout = self.config.get('error_handler_timeout', 10)
         for error_handler in self._error_handlers:
-            error_handler(message=message, exception=exception)
+            gevent.spawn(run_error_handler, error_handler, message, exception, handler_timeout)
         if message:
             logging.error(message)
         if exception:
             logging.error(str(exception))
-        error_recipients = self.config.get('error_recipients', [])
-        if error_recipients:
-            subject = self.config.get('error_subject', 'system error')
-            body = self.config.get('error_body', '').strip()
-            if body:
-                body += ' '
-            if message:
-                body += message
-            if exception:
-                body += '\n' + str(exception)
-            for recipient in error_recipients:
-                recipient = str(recipient)  # in case someone enters a phone number without quotes and it comes in as an integer
-                if '@' in recipient:
-                    self.messages.send_email(recipient, subject, body)
-                else:
-                    self.messages.send_sms(recipient, subject + ': ' + body)
+        if self.config.get('error_recipients'):
+            self.error_notifier.report(message, exception)
+
+    # call a function every interval seconds (on its own greenlet); runs are kept on a fixed timetable (they don't drift
+    # by the time the function takes) and a run is skipped if the previous one is still going; the first run is after
+    # delay seconds (default: one interval) plus a random offset of up to jitter (0 to 1) times the interval, which
+    # spreads out periodic uploads from controllers that start at the same time; returns a ScheduledTask (with cancel()
+    # and stats()); per-task statistics are available from controller.scheduler.stats()
+    def schedule(self, function, interval, jitter=0.0, delay=None, name=None):
+        task = self.scheduler.schedule(function, interval, jitter=jitter, delay=delay, name=name)
+        self._tasks.append(task)
+        return task
+
+    # stop background tasks, send queued data (log lines, error notifications, packed samples, queued messages,
+    # pending MQTT publishes) and disconnect, waiting up to timeout seconds (default from the shutdown_timeout config
+    # setting); closes local log and sequence files; returns a dictionary of counts of data that couldn't be sent/written;
+    # it is safe to call this more than once
+    def close(self, timeout=None):
+        if self._close_report is not None:
+            return self._close_report
+        if timeout is None:
+            timeout = self.config.get('shutdown_timeout', 10)
+        end_time = time.time() + timeout
+        for task in self._tasks:
+            task.cancel()
+            task.kill()
+        if not self.pool:
+            self.scheduler.stop()
+        if self.watchdog:
+            self.watchdog.stop()
+        self.error_notifier.flush()
+        if self._server_handler:
+            logging.getLogger().removeHandler(self._server_handler)
+            self._server_handler.close()  # sends any queued log lines
+        self.sequences.close()
+        report = self.messages.close(max(end_time - time.time(), 0))
+        if not self.pool:  # pooled controllers share the pool's log file and connections
+            if hasattr(self.log_file_handler, 'pending'):  # a QueuedFileHandler
+                logging.getLogger().removeHandler(self.log_file_handler)
+                self.log_file_handler.close(max(end_time - time.time(), 0.1))
+                report['log_lines'] = self.log_file_handler.pending()
+            connection_pool = getattr(self.transport, 'connection_pool', None)
+            if connection_pool:
+                connection_pool.close()
+        self._close_report = report
+        return report
+
+    # close the controller (see close()) at exit and when the process receives SIGTERM
+    def install_shutdown_hooks(self):
+        import atexit
+        import signal
+        atexit.register(self.close)
+        main_greenlet = gevent.get_hub().parent
+
+        def shutdown():
+            self.close()
+            main_greenlet.throw(SystemExit(0))  # exit normally (running other exit handlers)
+
+        gevent.signal_handler(signal.SIGTERM, lambda: gevent.spawn(shutdown))
 
     # ======== deprecated public API ========
 
@@ -246,18 +426,15 @@ class Controller(object):
 
     # ======== misc. internal functions ========
 
-    # a greenlet that monitors system status (disk and CPU usage)
-    def system_monitor(self):
-        gevent.sleep(15)  # do a short sleep on startup
-        while True:
-            processor_usage = psutil.cpu_percent()
-            disk_usage = psutil.disk_usage('/').percent
-            status_folder = self.path_on_server() + '/status'
-            seq_values = {status_folder + '/processor_usage': processor_usage, status_folder + '/disk_usage': disk_usage}
-            self.sequences.update_multiple(seq_values)
-            if processor_usage > 80 or disk_usage > 80:
-                logging.info('processor usage: %.1f%%, disk usage: %.1f%%' % (processor_usage, disk_usage))
-            gevent.sleep(30 * 60)  # sleep for 30 minutes
+    # start monitoring system status (CPU, disk, and other metrics listed in the system_metrics config entry)
+    def start_system_monitor(self):
+        try:
+            from .system_metrics import SystemMonitor  # imported here to keep startup fast (uses psutil)
+            self.system_metrics = SystemMonitor(self)
+        except ImportError as e:
+            logging.warning('system monitoring not available: %s' % e)
+            return
+        self.system_metrics.start()
 
     # request a PIN and key from the server;
     # this should run before any other greenlets are running
@@ -272,17 +449,20 @@ class Controller(object):
         logging.info('your PIN is: %d' % pin)
         logging.info('waiting for PIN to be entered on server')
 
-        # check on PIN
-        start_time = time.time()
-        while True:
-            gevent.sleep(5)  # check every ~5 seconds
-            params = {'pin_code': pin_code}
-            response = json.loads(self.files.send_request_to_server('GET', '/api/v1/pins/%d' % pin, params))
+        # check on PIN every ~5 seconds
+        result = AsyncResult()
+
+        def check_pin():
+            response = json.loads(self.files.send_request_to_server('GET', '/api/v1/pins/%d' % pin, {'pin_code': pin_code}))
             if 'secret_key' in response:
-                break
-            if time.time() - start_time > 5 * 60:
-                logging.info('timeout waiting for key')
-                sys.exit(1)
+                result.set(response)
+
+        task = self.schedule(check_pin, 5, name='check_pin')
+        response = result.wait(5 * 60)
+        task.cancel()
+        if not response:
+            logging.info('timeout waiting for key')
+            sys.exit(1)
 
         # display name, key prefix, key suffix
         secret_key = response['secret_key']
@@ -314,7 +494,60 @@ class Controller(object):
         self.files._secret_key = secret_key
 
 
-# a custom log handler for sending logged messages to server (in a log sequence)
+# prepare file and console logging (using the standard python logging library); returns the file handler;
+# default log level is INFO unless verbose (then it is DEBUG); used by Controller and ControllerPool
+def prep_logger(config, verbose, version_build=None):
+    log_path = 'logs'
+    if not os.path.isdir(log_path):
+        os.makedirs(log_path)
+        if not os.path.isdir(log_path):
+            print('unable to create log directory: %s' % log_path)
+            sys.exit(1)
+    formatter = logging.Formatter('%(asctime)s: %(levelname)s: %(message)s')
+    console_handler = logging.StreamHandler()
+    console_handler.setLevel(logging.DEBUG if verbose else logging.INFO)
+    console_handler.setFormatter(formatter)
+    queued = config.get('log_queue', True)  # if enabled, write log files from a separate thread
+    fsync = config.get('log_fsync', 'never')
+    max_queued_lines = config.get('log_queue_size', 10000)
+    compress = config.get('log_compress_rotated', True)
+    if config.get('log_file_per_run', False):
+        time_str = datetime.datetime.now().strftime('%Y-%m-%d-%H%M%S')
+        if queued:
+            file_handler = QueuedFileHandler(log_path + '/' + time_str + '.txt', fsync=fsync, max_queued_lines=max_queued_lines)
+        else:
+            file_handler = logging.FileHandler(log_path + '/' + time_str + '.txt')
+        file_handler.setLevel(5)  # used to log serial/etc. messages to disk
+        file_handler.setFormatter(formatter)
+    else:
+        max_log_file_size = config.get('max_log_file_size', 10000000)
+        if queued:
+            file_handler = QueuedFileHandler(log_path + '/client-log.txt', max_bytes=max_log_file_size, backup_count=10, fsync=fsync, compress=compress, max_queued_lines=max_queued_lines)
+        else:
+            file_handler = logging.handlers.RotatingFileHandler(log_path + '/client-log.txt', maxBytes=max_log_file_size, backupCount=10)
+        file_handler.setLevel(logging.DEBUG)
+        file_handler.setFormatter(formatter)
+    root = logging.getLogger()
+    root.addHandler(console_handler)
+    root.addHandler(file_handler)
+    root.setLevel(logging.DEBUG)
+    if version_build:
+        logging.info('--------------' + '-' * len(version_build))
+        logging.info('Rhizo Client v' + version_build)
+        logging.info('--------------' + '-' * len(version_build))
+    return file_handler
+
+
+# get a config entry as text for logging (hiding most of any secret key)
+def config_entry_text(name, value):
+    if 'secret_key' in name and value:
+        return '%s: %s...%s' % (name, value[:3], value[-3:])
+    return '%s: %s' % (name, value)
+
+
+# a custom log handler for sending logged messages to server (in a log sequence);
+# log lines are queued and sent in batches (one multi-line sequence update per batch) by a background greenlet,
+# so logging doesn't block the caller; lines beyond the rate limit (or queue size) are dropped and summarized
 class ServerHandler(logging.Handler):
 
     # initialize the object
@@ -322,7 +555,17 @@ class ServerHandler(logging.Handler):
         super(ServerHandler, self).__init__()
         self.controller = controller
         self.setFormatter(logging.Formatter('%(levelname)s: %(message)s'))
-        self.inside_handler = False
+        self.apply_config(controller.config)
+        self._queue = Queue(maxsize=controller.config.get('server_log_queue_size', 1000))
+        self.drop_count = 0  # total lines dropped
+        self._pending_drop_count = 0  # lines dropped since the last batch was sent
+        self._greenlet = gevent.spawn(self.sender)
+
+    # set the log level and batching parameters from the config (also used when the config is reloaded)
+    def apply_config(self, config):
+        self.set_level_name(config.get('server_log_level', 'info'))
+        self._interval = config.get('server_log_interval', 1.0)  # seconds between batches
+        self._max_lines = max(1, int(config.get('server_log_rate', 20) * self._interval))  # max lines per batch
 
     # set logging level by name
     def set_level_name(self, name):
@@ -336,11 +579,59 @@ class ServerHandler(logging.Handler):
         elif name == 'error':
             self.setLevel(logging.ERROR)
 
-    # handle a log message; send it to server as a log sequence value
+    # handle a log message; queue it to be sent to server as part of a log sequence value
     def emit(self, record):
-        if self.inside_handler:  # if update_sequence does any logging, let's skip it
+        if gevent.getcurrent() is self._greenlet:  # if sending the log lines does any logging, let's skip it
             return
-        self.inside_handler = True
-        message = self.format(record)
-        self.controller.sequences.update('log', message)
-        self.inside_handler = False
+        try:
+            self._queue.put_nowait(self.format(record))
+        except Full:
+            self.drop_count += 1
+            self._pending_drop_count += 1
+
+    # send any queued log lines now
+    def flush(self):
+        if not self._queue.empty() or self._pending_drop_count:
+            self.send_batch()
+
+    # stop the sender greenlet and send any queued log lines
+    def close(self):
+        self._greenlet.kill(block=False)
+        self.flush()
+        super(ServerHandler, self).close()
+
+    # runs as a greenlet that sends queued log lines to the server in batches
+    def sender(self):
+        while True:
+            self._queue.peek()  # wait for a log line
+            gevent.sleep(self._interval)  # allow more lines to accumulate
+            try:
+                self.send_batch()
+            except Exception as e:
+                print('error sending log lines to server: %s' % e)
+
+    # send up to the rate limit of queued log lines as a single sequence update; the rest are dropped
+    def send_batch(self):
+        lines = []
+        while not self._queue.empty():
+            line = self._queue.get_nowait()
+            if len(lines) < self._max_lines:
+                lines.append(line)
+            else:
+                self.drop_count += 1
+                self._pending_drop_count += 1
+        lines = collapse_repeated_lines(lines)
+        if self._pending_drop_count:
+            lines.append('(%d log lines dropped)' % self._pending_drop_count)
+            self._pending_drop_count = 0
+        if lines:
+            self.controller.sequences.update('log', '\n'.join(lines))
+
+
+# replace runs of identical lines with a single line and a repeat count
+def collapse_repeated_lines(lines):
+    collapsed = []
+    for (line, group) in groupby(lines):
+        count = len(list(group))
+        collapsed.append(line if count == 1 else '%s (repeated %d times)' % (line, count))
+    return collapsed
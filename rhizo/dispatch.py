@@ -0,0 +1,104 @@
+import time
+import logging
+import gevent
+from gevent.queue import Queue, Full, Empty
+from .tracing import NULL_TRACER
+
+
+# overflow policies for handler queues
+DROP_OLDEST = 'drop_oldest'
+DROP_NEWEST = 'drop_newest'
+BLOCK = 'block'
+
+
+# runs a message handler for incoming messages; by default the handler is called inline (in the greenlet/thread that
+# received the message); if workers > 0, messages are placed in a bounded queue and handled by a pool of worker
+# greenlets (optionally handing each call to a native thread so that CPU-heavy or blocking handlers don't stall the hub)
+class HandlerRunner(object):
+
+    def __init__(self, handler, workers=0, queue_size=100, overflow=DROP_OLDEST, use_threads=False, tracer=None):
+        assert overflow in (DROP_OLDEST, DROP_NEWEST, BLOCK)
+        self.handler = handler
+        self._tracer = tracer or NULL_TRACER
+        self.name = getattr(handler, '__name__', handler.__class__.__name__)
+        self._call = handler.handle_message if hasattr(handler, 'handle_message') else handler
+        self._overflow = overflow
+        self._queue = None
+        self._thread_pool = None
+
+        # stats
+        self.call_count = 0
+        self.error_count = 0
+        self.drop_count = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+
+        # start workers
+        if workers:
+            self._queue = Queue(maxsize=queue_size)
+            if use_threads:
+                from gevent.threadpool import ThreadPool  # imported here since thread pools are rarely used
+                self._thread_pool = ThreadPool(workers)
+            for i in range(workers):
+                gevent.spawn(self.worker)
+
+    # pass a message to the handler (or queue it for the workers)
+    def dispatch(self, message_type, parameters):
+        if self._queue is None:
+            self.run(message_type, parameters)
+        elif self._overflow == BLOCK:
+            self._queue.put((message_type, parameters))
+        else:
+            try:
+                self._queue.put_nowait((message_type, parameters))
+            except Full:
+                self.drop_count += 1
+                if self._overflow == DROP_OLDEST:
+                    try:
+                        self._queue.get_nowait()
+                    except Empty:
+                        pass
+                    self._queue.put_nowait((message_type, parameters))
+
+    # call the handler, recording timing stats
+    def run(self, message_type, parameters):
+        start_time = time.time()
+        try:
+            with self._tracer.span('handler', 'messages', handler=self.name, message_type=message_type):
+                self._call(message_type, parameters)
+        except Exception:
+            self.error_count += 1
+            raise
+        finally:
+            elapsed = time.time() - start_time
+            self.call_count += 1
+            self.total_time += elapsed
+            if elapsed > self.max_time:
+                self.max_time = elapsed
+
+    # runs as a greenlet that handles queued messages
+    def worker(self):
+        while True:
+            (message_type, parameters) = self._queue.get()
+            try:
+                if self._thread_pool:
+                    self._thread_pool.apply(self.run, (message_type, parameters))
+                else:
+                    self.run(message_type, parameters)
+            except Exception:
+                logging.exception('error in message handler %s' % self.name)
+
+    # number of messages waiting to be handled
+    def queue_depth(self):
+        return self._queue.qsize() if self._queue is not None else 0
+
+    # a dictionary of handler statistics (times in seconds)
+    def stats(self):
+        return {
+            'calls': self.call_count,
+            'errors': self.error_count,
+            'dropped': self.drop_count,
+            'queued': self.queue_depth(),
+            'mean_time': self.total_time / self.call_count if self.call_count else 0.0,
+            'max_time': self.max_time,
+        }
@@ -0,0 +1,457 @@
+import os
+import json
+import time
+import base64
+import socket
+import logging
+from collections import OrderedDict
+from optparse import OptionParser
+import gevent
+from gevent.event import AsyncResult
+from gevent.lock import Semaphore
+from gevent.queue import Queue
+from .keepalive import LinkMonitor
+from .transports import NetworkTransport
+
+
+DEFAULT_SOCKET_PATH = '/tmp/rhizo-gateway.sock'
+
+
+# The gateway is a local process that controllers on the same host connect to over a Unix domain socket (using a
+# GatewayTransport); it forwards their resource API requests and websocket messages to the server. Identical GET
+# requests (same path, parameters and credentials) are served from a short-lived cache, and concurrent identical
+# requests share a single upstream request. Controllers using the same secret key share one upstream websocket
+# connection; their outgoing frames are combined (up to max_frame_size bytes per frame) and incoming messages are sent
+# to all of them. Client pings are forwarded over the upstream connection, so the clients' round-trip times and dead
+# link detection cover the path to the server.
+#
+# The protocol between the gateway and its clients is newline-delimited JSON. The first line sent by the client
+# is a request: {"op": "http", ...} (answered with one response line), or {"op": "ws", "url": ..., "headers": ...}
+# (answered with {"ok": true} or {"error": ...}, followed by data lines in both directions).
+class GatewayServer(object):
+
+    def __init__(self, socket_path=DEFAULT_SOCKET_PATH, transport=None, cache_ttl=1.0, cache_size=1000, max_frame_size=65536):
+        self.socket_path = socket_path
+        self.transport = transport or NetworkTransport(max_idle_connections=10)
+        self.cache_ttl = cache_ttl
+        self.cache_size = cache_size
+        self.max_frame_size = max_frame_size  # limit for combined text frames (as with the ws_max_frame_size controller setting)
+        self.request_count = 0
+        self.upstream_request_count = 0
+        self.cache_hit_count = 0
+        self._cache = OrderedDict()  # (expire time, response) by request key
+        self._in_flight = {}  # AsyncResult by request key
+        self._upstreams = {}  # UpstreamConnection by (url, Authorization header)
+        self._server = None
+
+    # start listening on the Unix socket (without blocking)
+    def start(self):
+        from gevent.server import StreamServer
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(self.socket_path)
+        listener.listen(128)
+        self._server = StreamServer(listener, self.handle_connection)
+        self._server.start()
+
+    def serve_forever(self):
+        self.start()
+        self._server.serve_forever()
+
+    def stop(self):
+        if self._server:
+            self._server.stop()
+        for upstream in list(self._upstreams.values()):
+            upstream.close()
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+
+    # get a dictionary of gateway statistics
+    def stats(self):
+        return {
+            'requests': self.request_count,
+            'upstream_requests': self.upstream_request_count,
+            'cache_hits': self.cache_hit_count,
+            'upstream_connections': len(self._upstreams),
+            'web_sockets': sum(len(upstream.sessions) for upstream in self._upstreams.values()),
+        }
+
+    # handle a connection from a client
+    def handle_connection(self, sock, address):
+        session = GatewaySession(sock)
+        try:
+            request = session.read_line()
+            if request and request['op'] == 'http':
+                session.write_line(self.handle_request(request))
+            elif request and request['op'] == 'ws':
+                self.handle_web_socket(session, request)
+        except Exception as e:
+            logging.warning('gateway: error handling connection: %s' % e)
+        finally:
+            session.close()
+
+    # ======== resource API requests ========
+
+    # forward an HTTP request to the server (or use a cached response); returns a response structure
+    def handle_request(self, request):
+        self.request_count += 1
+        method = request['method']
+        key = (request['server'], method, request['path'], json.dumps(request['params'], sort_keys=True),
+               request.get('secure', True), request.get('accept_type'), request.get('basic_auth'))  # includes credentials
+        if method != 'GET':
+            self._cache.clear()  # be conservative: any modification may affect any cached response
+            return self.send_upstream(request)
+        cached = self._cache.get(key)
+        if cached and cached[0] > time.time():
+            self.cache_hit_count += 1
+            return cached[1]
+        in_flight = self._in_flight.get(key)
+        if in_flight:  # an identical request is already being sent; wait for its response
+            self.cache_hit_count += 1
+            return in_flight.get()
+        in_flight = AsyncResult()
+        self._in_flight[key] = in_flight
+        try:
+            response = self.send_upstream(request)
+            if response['status'] == 200:
+                self._cache[key] = (time.time() + self.cache_ttl, response)
+                if len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+            in_flight.set(response)
+        except Exception as e:
+            in_flight.set_exception(e)
+            raise
+        finally:
+            del self._in_flight[key]
+        return response
+
+    # send a request to the server; returns a response structure
+    def send_upstream(self, request):
+        self.upstream_request_count += 1
+        (status, reason, data) = self.transport.send_request(request['server'], request['method'], request['path'], decode_params(request['params']),
+                                                             request.get('secure', True), request.get('accept_type', 'text/plain'),
+                                                             request.get('basic_auth'), request.get('ssl_skip_verify', False))
+        return {'status': status, 'reason': reason, 'data': base64.b64encode(data).decode()}
+
+    # ======== websocket connections ========
+
+    # relay messages between a client and the upstream connection for its credentials
+    def handle_web_socket(self, session, request):
+        headers = [tuple(header) for header in request.get('headers') or []]
+        key = (request['url'], dict(headers).get('Authorization'))
+        upstream = self._upstreams.get(key)
+        if not upstream:
+            try:
+                upstream = UpstreamConnection(self, key, request['url'], headers)
+            except Exception as e:
+                session.write_line({'error': str(e)})
+                return
+            self._upstreams[key] = upstream
+        session.write_line({'ok': True})
+        upstream.sessions.add(session)
+        try:
+            while True:
+                try:
+                    line = session.read_line()
+                except socket.error:  # closed by the upstream connection
+                    line = None
+                if line is None:
+                    break
+                if 'ping' in line:
+                    upstream.forward_ping(session, line['ping'])
+                elif line.get('binary'):
+                    upstream.queue_frame(base64.b64decode(line['data']), True)
+                else:
+                    upstream.queue_frame(line['data'], False)
+        finally:
+            upstream.sessions.discard(session)
+
+
+# a client connection to the gateway (on the gateway side)
+class GatewaySession(object):
+
+    def __init__(self, sock):
+        self._sock = sock
+        self._file = sock.makefile('rb')
+        self._lock = Semaphore()
+
+    # read a JSON line; returns None if the connection is closed
+    def read_line(self):
+        line = self._file.readline()
+        return json.loads(line.decode()) if line else None
+
+    def write_line(self, message):
+        with self._lock:
+            self._sock.sendall((json.dumps(message) + '\n').encode())
+
+    def close(self):
+        try:
+            self._sock.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+        self._sock.close()
+
+
+# a websocket connection from the gateway to the server, shared by all clients using the same credentials
+class UpstreamConnection(object):
+
+    def __init__(self, gateway, key, url, headers):
+        self.gateway = gateway
+        self.key = key
+        self.sessions = set()
+        self.link = LinkMonitor()
+        self._frames = Queue()
+        self._forwarded_pings = {}  # (session, send time) by ping payload, for pings forwarded from clients
+        self._ws = gateway.transport.web_socket(url, headers)
+        self._ws.link_monitor = self  # see pong_received
+        self._ws.connect()
+        self._closed = False
+        self._greenlets = [gevent.spawn(self.listener), gevent.spawn(self.sender), gevent.spawn(self.pinger)]
+
+    # queue a frame from a client to be sent to the server
+    def queue_frame(self, frame, binary):
+        self._frames.put((frame, binary))
+
+    # send a client's ping to the server; the pong is passed back to the client (see pong_received)
+    def forward_ping(self, session, payload):
+        self._forwarded_pings[payload] = (session, time.time())
+        try:
+            self._ws.ping(payload)
+        except Exception:
+            self.close()
+
+    # called by the websocket client when a pong arrives: passes it to the client that sent the ping, or to our own
+    # link monitor if it answers one of the gateway's pings
+    def pong_received(self, payload):
+        if isinstance(payload, bytes):
+            payload = payload.decode()
+        forwarded = self._forwarded_pings.pop(payload, None)
+        if forwarded:
+            try:
+                forwarded[0].write_line({'pong': payload})
+            except socket.error:
+                self.sessions.discard(forwarded[0])
+        else:
+            self.link.pong_received(payload)
+
+    # receive messages from the server and pass them to all clients
+    def listener(self):
+        while True:
+            try:
+                message = self._ws.receive()
+            except Exception:
+                message = None
+            if not message:
+                break
+            binary = getattr(message, 'is_binary', False)
+            data = message.data
+            if binary:
+                line = {'data': base64.b64encode(data).decode(), 'binary': True}
+            else:
+                line = {'data': data.decode() if isinstance(data, bytes) else data}
+            for session in list(self.sessions):
+                try:
+                    session.write_line(line)
+                except socket.error:
+                    self.sessions.discard(session)
+        self.close()
+
+    # send queued frames to the server; text frames (newline-terminated messages) queued by multiple clients are combined,
+    # up to the gateway's max_frame_size (a frame that is already over the limit is sent by itself)
+    def sender(self):
+        max_frame_size = self.gateway.max_frame_size
+        while True:
+            (frame, binary) = self._frames.get()
+            try:
+                if not binary:
+                    frames = [frame]
+                    frame_size = len(frame)
+                    while not self._frames.empty():
+                        (next_frame, next_binary) = self._frames.peek()
+                        if next_binary or frame_size + len(next_frame) > max_frame_size:
+                            break
+                        frames.append(self._frames.get()[0])
+                        frame_size += len(next_frame)
+                    frame = ''.join(frames)
+                self._ws.send(frame, binary=binary)
+            except Exception:
+                self.close()
+                break
+
+    # check that the server connection is alive; also discards forwarded pings that were never answered
+    def pinger(self):
+        while True:
+            gevent.sleep(1)
+            now = time.time()
+            for (payload, (session, send_time)) in list(self._forwarded_pings.items()):
+                if now - send_time > self.link.timeout:  # the client will have given up on it
+                    del self._forwarded_pings[payload]
+            if self.link.is_dead(now):
+                logging.warning('gateway: upstream connection timed out')
+                self.close()
+                break
+            if now - self.link.ping_time() > self.link.interval:
+                self._ws.ping(self.link.ping_sent(now))
+
+    # close the upstream connection and the connections of its clients (which will then reconnect)
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        if self.gateway._upstreams.get(self.key) is self:
+            del self.gateway._upstreams[self.key]
+        try:
+            self._ws.terminate()
+        except Exception:
+            pass
+        for session in list(self.sessions):
+            session.close()
+        current = gevent.getcurrent()
+        gevent.killall([greenlet for greenlet in self._greenlets if greenlet is not current], block=False)
+
+
+# a transport that connects to the server through a local gateway process
+class GatewayTransport(object):
+
+    def __init__(self, socket_path=DEFAULT_SOCKET_PATH):
+        self.socket_path = socket_path
+
+    # send an HTTP request via the gateway; returns response tuple: (response status, response reason, response data)
+    def send_request(self, server, method, path, params, secure=True, accept_type='text/plain', basic_auth=None, ssl_skip_verify=False):
+        request = {
+            'op': 'http',
+            'server': server,
+            'method': method,
+            'path': path,
+            'params': encode_params(params),
+            'secure': secure,
+            'accept_type': accept_type,
+            'basic_auth': basic_auth,
+            'ssl_skip_verify': ssl_skip_verify,
+        }
+        sock = open_gateway_socket(self.socket_path)
+        try:
+            sock.sendall((json.dumps(request) + '\n').encode())
+            line = sock.makefile('rb').readline()
+        finally:
+            sock.close()
+        if not line:
+            raise IOError('no response from gateway')
+        response = json.loads(line.decode())
+        return (response['status'], response['reason'], base64.b64decode(response['data']))
+
+    def web_socket(self, url, headers=None):
+        return GatewayWebSocket(self.socket_path, url, headers)
+
+    # the gateway doesn't relay MQTT connections, so MQTT clients connect directly to the broker
+    def mqtt_client(self):
+        return NetworkTransport().mqtt_client()
+
+
+# a websocket connection via the gateway (implements the subset of the ws4py client API used by MessageClient)
+class GatewayWebSocket(object):
+    link_monitor = None
+
+    def __init__(self, socket_path, url, headers=None):
+        self._socket_path = socket_path
+        self._url = url
+        self._headers = headers or []
+        self._sock = None
+        self._file = None
+        self._lock = Semaphore()
+        self.terminated = False
+
+    def connect(self):
+        self._sock = open_gateway_socket(self._socket_path)
+        self._file = self._sock.makefile('rb')
+        self.write_line({'op': 'ws', 'url': self._url, 'headers': self._headers})
+        line = self._file.readline()
+        response = json.loads(line.decode()) if line else {'error': 'no response from gateway'}
+        if 'error' in response:
+            self.terminate()
+            raise IOError(response['error'])
+
+    def send(self, payload, binary=False):
+        if self.terminated:
+            raise AttributeError('websocket closed')  # the client treats this as a disconnect
+        if binary:
+            self.write_line({'data': base64.b64encode(payload).decode(), 'binary': True})
+        else:
+            self.write_line({'data': payload})
+
+    # returns the next message from the server (str or bytes), or None if disconnected
+    def receive(self):
+        while True:
+            line = self._file.readline() if not self.terminated else None
+            if not line:
+                self.terminated = True
+                return None
+            message = json.loads(line.decode())
+            if 'pong' in message:
+                if self.link_monitor:
+                    self.link_monitor.pong_received(message['pong'])
+            elif message.get('binary'):
+                return base64.b64decode(message['data'])
+            else:
+                return message['data']
+
+    def ping(self, payload):
+        self.write_line({'ping': payload})
+
+    def close(self, code=1000, reason=''):
+        self.terminate()
+
+    def terminate(self):
+        if not self.terminated and self._sock:
+            self.terminated = True
+            try:
+                self._sock.shutdown(socket.SHUT_RDWR)  # unblocks receive()
+            except socket.error:
+                pass
+            self._sock.close()
+
+    def write_line(self, message):
+        with self._lock:
+            self._sock.sendall((json.dumps(message) + '\n').encode())
+
+
+# prepare request parameters to be sent as JSON (bytes values are base64-encoded)
+def encode_params(params):
+    encoded = {}
+    for name, value in params.items():
+        encoded[name] = {'$bytes': base64.b64encode(value).decode()} if isinstance(value, bytes) else value
+    return encoded
+
+
+def decode_params(params):
+    decoded = {}
+    for name, value in params.items():
+        decoded[name] = base64.b64decode(value['$bytes']) if isinstance(value, dict) and '$bytes' in value else value
+    return decoded
+
+
+# open a connection to a gateway
+def open_gateway_socket(socket_path):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.connect(socket_path)
+    return sock
+
+
+# run a gateway; usage: python -m rhizo.gateway [--socket /tmp/rhizo-gateway.sock]
+def main():
+    from gevent import monkey
+    monkey.patch_all()
+    parser = OptionParser()
+    parser.add_option('-s', '--socket', dest='socket_path', default=DEFAULT_SOCKET_PATH)
+    parser.add_option('-t', '--cache-ttl', dest='cache_ttl', type='float', default=1.0)
+    parser.add_option('-f', '--max-frame-size', dest='max_frame_size', type='int', default=65536)
+    (options, args) = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s: %(levelname)s: %(message)s')
+    gateway = GatewayServer(options.socket_path, cache_ttl=options.cache_ttl, max_frame_size=options.max_frame_size)
+    logging.info('gateway listening on %s' % options.socket_path)
+    gateway.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
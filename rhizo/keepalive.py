@@ -0,0 +1,106 @@
+import time
+from .metrics import Histogram
+
+
+# tracks round-trip times for a connection using timestamped pings and matching pongs;
+# chooses the next ping interval (short while the link is new or degraded, backing off to max_interval while it is healthy)
+# and reports the link as dead if a ping goes unanswered for longer than the timeout
+class LinkMonitor(object):
+
+    def __init__(self, min_interval=5.0, max_interval=45.0, timeout=15.0):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.timeout = timeout
+        self.interval = min_interval
+        self.rtt_histogram = Histogram()
+        self.jitter_histogram = Histogram()
+        self.last_rtt = None
+        self.mean_rtt = None  # exponentially weighted moving average
+        self.min_rtt = None
+        self.max_rtt = None
+        self.jitter = 0.0  # smoothed jitter, computed as in RFC 3550
+        self.ping_count = 0
+        self.pong_count = 0
+        self.timeout_count = 0
+        self._outstanding = {}  # send time by ping payload
+        self._timed_out = set()  # payloads of outstanding pings that have been counted as timeouts
+        self._last_ping_time = 0
+
+    # reset the outstanding pings (e.g. when reconnecting) and go back to the minimum ping interval
+    def reset(self):
+        self._outstanding = {}
+        self._timed_out = set()
+        self.interval = self.min_interval
+
+    # record that a ping is being sent; returns the payload to send with it
+    def ping_sent(self, now=None):
+        now = now or time.time()
+        payload = '%.6f' % now
+        self._outstanding[payload] = now
+        self._last_ping_time = now
+        self.ping_count += 1
+        return payload
+
+    # the time the last ping was sent
+    def ping_time(self):
+        return self._last_ping_time
+
+    # record a pong; returns the round-trip time or None if the payload doesn't match an outstanding ping
+    def pong_received(self, payload, now=None):
+        if isinstance(payload, bytes):
+            payload = payload.decode()
+        sent_time = self._outstanding.pop(payload, None)
+        self._timed_out.discard(payload)
+        if sent_time is None:
+            return None
+        self.pong_count += 1
+        rtt = (now or time.time()) - sent_time
+        self.record_rtt(rtt)
+        return rtt
+
+    # add a round-trip time measurement (can also be used for RTTs measured by other means, e.g. MQTT acknowledgements)
+    def record_rtt(self, rtt):
+        degraded = False
+        if self.last_rtt is not None:
+            delta = abs(rtt - self.last_rtt)
+            self.jitter += (delta - self.jitter) / 16.0
+            self.jitter_histogram.observe(delta)
+            degraded = rtt > 2 * self.mean_rtt + 0.05
+        self.rtt_histogram.observe(rtt)
+        self.mean_rtt = rtt if self.mean_rtt is None else self.mean_rtt + (rtt - self.mean_rtt) / 8.0
+        self.min_rtt = rtt if self.min_rtt is None else min(self.min_rtt, rtt)
+        self.max_rtt = rtt if self.max_rtt is None else max(self.max_rtt, rtt)
+        self.last_rtt = rtt
+        if degraded:
+            self.interval = self.min_interval
+        else:
+            self.interval = min(self.interval * 2, self.max_interval)
+
+    # returns True if a ping has gone unanswered for longer than the timeout (each timed-out ping is counted once,
+    # however many times this is called)
+    def is_dead(self, now=None):
+        now = now or time.time()
+        dead = False
+        for (payload, sent_time) in self._outstanding.items():
+            if now - sent_time > self.timeout:
+                if payload not in self._timed_out:
+                    self._timed_out.add(payload)
+                    self.timeout_count += 1
+                dead = True
+        return dead
+
+    # get a dictionary of link statistics (times in seconds)
+    def stats(self):
+        return {
+            'pings': self.ping_count,
+            'pongs': self.pong_count,
+            'timeouts': self.timeout_count,
+            'interval': self.interval,
+            'last_rtt': self.last_rtt,
+            'mean_rtt': self.mean_rtt,
+            'min_rtt': self.min_rtt,
+            'max_rtt': self.max_rtt,
+            'jitter': self.jitter,
+            'rtt_histogram': self.rtt_histogram.as_dict(),
+            'jitter_histogram': self.jitter_histogram.as_dict(),
+        }
@@ -0,0 +1,131 @@
+import os
+import sys
+import gzip
+import time
+import shutil
+import logging
+from collections import deque
+from gevent import monkey
+
+
+# native (unpatched) functions for use in the writer thread, which runs outside the gevent hub
+if sys.version_info[0] >= 3:
+    start_native_thread = monkey.get_original('_thread', 'start_new_thread')
+else:
+    start_native_thread = monkey.get_original('thread', 'start_new_thread')
+native_sleep = monkey.get_original('time', 'sleep')
+
+
+# a log handler that writes to a file from a dedicated native thread; emit() only formats the record and appends it
+# to a queue, so logging calls don't wait on disk I/O; the writer thread writes queued lines in batches, optionally
+# calls fsync, rotates the file when it exceeds max_bytes (if max_bytes > 0), and gzips rotated files;
+# fsync can be 'never' (the default; just flush), 'batch' (after each batch), or a number of seconds between fsync calls;
+# at most max_queued_lines lines are kept waiting to be written (extra lines are dropped and counted); write errors
+# (e.g. a full disk) are reported on stderr and counted, and the writer continues with the next batch
+class QueuedFileHandler(logging.Handler):
+
+    def __init__(self, file_name, max_bytes=0, backup_count=10, fsync='never', compress=True, flush_interval=0.2, max_queued_lines=10000):
+        super(QueuedFileHandler, self).__init__()
+        self.file_name = file_name
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.fsync = fsync if fsync in ('never', 'batch') else float(fsync)  # e.g. '5' from a config file
+        self.compress = compress
+        self.flush_interval = flush_interval
+        self.max_queued_lines = max_queued_lines
+        self.write_count = 0  # number of batches written
+        self.error_count = 0  # number of batches that couldn't be written (or rotated)
+        self.drop_count = 0  # number of lines dropped because the queue was full
+        self._lines = deque()  # deque append/popleft are thread-safe
+        self._file = open(file_name, 'a')
+        self._last_fsync_time = time.time()
+        self._closing = False
+        self._closed = False
+        start_native_thread(self.writer, ())
+
+    # queue a log record to be written
+    def emit(self, record):
+        if len(self._lines) >= self.max_queued_lines:  # e.g. if writes are failing or the disk can't keep up
+            self.drop_count += 1
+            return
+        try:
+            self._lines.append(self.format(record) + '\n')
+        except Exception:
+            self.handleError(record)
+
+    # number of lines waiting to be written
+    def pending(self):
+        return len(self._lines)
+
+    # stop the writer thread after it writes all queued lines; waits up to timeout seconds
+    def close(self, timeout=5):
+        if not self._closing:
+            self._closing = True
+            end_time = time.time() + timeout
+            while not self._closed and time.time() < end_time:
+                time.sleep(0.01)  # if called from a greenlet, this yields to the hub (when monkey-patched)
+        super(QueuedFileHandler, self).close()
+
+    # runs in a native thread; writes queued lines to the file
+    def writer(self):
+        while True:
+            closing = self._closing
+            if self._lines:
+                try:
+                    self.write_batch()
+                except Exception as e:
+                    self.write_error(e)
+            elif closing:
+                break
+            else:
+                native_sleep(self.flush_interval)
+        try:
+            self._file.close()
+        except Exception as e:
+            self.write_error(e)
+        self._closed = True
+
+    # report an error writing (or rotating) the file on stderr (we can't use logging here, since this is a log handler);
+    # if the file was closed (e.g. a failed rotation), try to reopen it so later batches can be written
+    def write_error(self, exception):
+        self.error_count += 1
+        try:
+            sys.stderr.write('error writing log file %s: %s\n' % (self.file_name, exception))
+            if self._file.closed:
+                self._file = open(self.file_name, 'a')
+        except Exception:
+            pass
+
+    # write all queued lines to the file
+    def write_batch(self):
+        lines = []
+        try:
+            while True:
+                lines.append(self._lines.popleft())
+        except IndexError:
+            pass
+        self._file.write(''.join(lines))
+        self._file.flush()
+        self.write_count += 1
+        if self.fsync == 'batch' or (self.fsync != 'never' and time.time() - self._last_fsync_time > self.fsync):
+            os.fsync(self._file.fileno())
+            self._last_fsync_time = time.time()
+        if self.max_bytes and self._file.tell() > self.max_bytes:
+            self.rotate()
+
+    # move the current file to file_name.1 (and older files to .2, .3, etc.), compressing the rotated file
+    def rotate(self):
+        self._file.close()
+        suffix = '.gz' if self.compress else ''
+        for i in range(self.backup_count - 1, 0, -1):
+            source = '%s.%d%s' % (self.file_name, i, suffix)
+            if os.path.exists(source):
+                os.rename(source, '%s.%d%s' % (self.file_name, i + 1, suffix))
+        rotated_name = self.file_name + '.1'
+        os.rename(self.file_name, rotated_name)
+        self._file = open(self.file_name, 'a')  # reopen first so that writing can continue while compressing
+        if self.compress:
+            with open(rotated_name, 'rb') as input_file:
+                with gzip.open(rotated_name + '.gz', 'wb') as output_file:
+                    shutil.copyfileobj(input_file, output_file)
+            os.remove(rotated_name)
@@ -0,0 +1,495 @@
+import json
+import base64
+import datetime
+from optparse import OptionParser
+import gevent
+from gevent.queue import Queue
+from ws4py.websocket import WebSocket
+from . import packing
+from .util import parse_json_datetime
+from .transports import MQTT_ERR_SUCCESS, MQTT_ERR_NO_CONN
+try:
+    from urlparse import parse_qsl
+except ImportError:
+    from urllib.parse import parse_qsl
+
+
+# resource types (as used by the server)
+FOLDER = 10
+CONTROLLER_FOLDER = 12
+FILE = 20
+SEQUENCE = 21
+
+
+# an in-memory stand-in for rhizo-server; implements the parts of the resource API, websocket protocol,
+# and MQTT topics used by the client, so that the client can be tested and benchmarked without a real server;
+# connect a controller to it using a LoopbackTransport:
+#
+#     server = LoopbackServer()
+#     c = Controller({'server_name': 'loopback', 'secret_key': server.secret_key}, transport=LoopbackTransport(server))
+class LoopbackServer(object):
+
+    def __init__(self, controller_path='/loopback/controller', secret_key='loopback-key'):
+        self.secret_key = secret_key
+        self.resources = {}  # resource records by path
+        self.sequence_values = {}  # list of (timestamp, value) tuples by sequence path
+        self.message_log = []  # list of (folder path, message type, parameters) tuples for messages received from clients
+        self.request_count = 0
+        self.message_count = 0
+        self._keys = {}  # controller path by secret key
+        self._next_id = 1
+        self._web_sockets = []
+        self._mqtt_clients = []
+        self._responders = {}  # functions that generate responses to request messages, by message type
+        self.add_controller(controller_path, secret_key)
+
+    # ======== setup ========
+
+    # add a controller folder (and any parent folders) with the given key
+    def add_controller(self, path, secret_key):
+        self.create_resource(path, CONTROLLER_FOLDER)
+        self._keys[secret_key] = path
+
+    # create a resource (and any missing parent folders); returns the resource record
+    def create_resource(self, path, resource_type, data=None, system_attributes=None):
+        parent_path = path.rsplit('/', 1)[0]
+        if parent_path and parent_path not in self.resources:
+            self.create_resource(parent_path, FOLDER)
+        resource = self.resources.get(path)
+        if not resource:
+            resource = {
+                'id': self._next_id,
+                'name': path.rsplit('/', 1)[1],
+                'path': path,
+                'type': resource_type,
+                'data': data,
+                'lastRevisionId': 1 if data is not None else None,
+                'system_attributes': system_attributes or {},
+            }
+            self.resources[path] = resource
+            self._next_id += 1
+        return resource
+
+    # ======== server-side API (for tests and benchmarks) ========
+
+    # send a message to all websocket/MQTT connections subscribed to the given folder
+    def send_message(self, folder, message_type, parameters):
+        message_struct = {'type': message_type, 'parameters': parameters, 'folder': folder}
+        for ws in list(self._web_sockets):
+            if ws.subscribed(folder):
+                ws.deliver(json.dumps(message_struct))
+        for client in list(self._mqtt_clients):
+            if client.subscribed(folder):
+                client.deliver(folder.lstrip('/'), json.dumps({message_type: parameters}).encode())
+
+    # add a function that responds to request messages of the given type; the function is called with the request
+    # parameters and returns (response message type, response parameters)
+    def add_responder(self, message_type, responder):
+        self._responders[message_type] = responder
+
+    # get the most recent value of a sequence (or None if no values)
+    def sequence_value(self, path):
+        values = self.sequence_values.get(path)
+        return values[-1][1] if values else None
+
+    # ======== HTTP/REST API ========
+
+    # handle a resource API request; params is a dictionary; returns (status, reason, data)
+    def handle_request(self, method, path, params, basic_auth):
+        self.request_count += 1
+        controller_path = self.authenticate(basic_auth)
+        if not controller_path:
+            return (401, 'Unauthorized', b'')
+        try:
+            data = self.handle_authenticated_request(method, path, params, controller_path)
+        except LookupError:
+            return (404, 'Not Found', b'')
+        except (ValueError, KeyError):
+            return (400, 'Bad Request', b'')
+        if not isinstance(data, bytes):
+            data = json.dumps(data).encode()
+        return (200, 'OK', data)
+
+    # get the controller path associated with an HTTP basic auth string (or None if not valid)
+    def authenticate(self, basic_auth):
+        if not basic_auth:
+            return None
+        password = base64.b64decode(basic_auth).decode().split(':', 1)[1]
+        return self._keys.get(password)
+
+    def handle_authenticated_request(self, method, path, params, controller_path):
+        prefix = '/api/v1/resources'
+        if path == '/api/v1/messages' and method == 'POST':
+            self.handle_message(params['folder_path'], params['type'], json.loads(params['parameters']))
+            return {'status': 'ok'}
+        if not path.startswith(prefix):
+            raise LookupError(path)
+        resource_path = path[len(prefix):]
+        if resource_path.startswith('/self'):
+            resource_path = controller_path + resource_path[5:]
+        if method == 'POST' and not resource_path:
+            return self.post_resource(params)
+        if method == 'PUT' and not resource_path:
+            timestamp = parse_json_datetime(params['timestamp'])
+            for (seq_path, value) in json.loads(params['values']).items():
+                self.update_sequence(seq_path, value, timestamp)
+            return {'status': 'ok'}
+        resource = self.resources.get(resource_path)
+        if not resource:
+            raise LookupError(resource_path)
+        if method == 'GET':
+            if 'meta' in params:
+                return self.resource_info(resource, params.get('include_path'))
+            if 'extended' in params:  # list folder contents
+                return [self.resource_info(r) for r in self.resources.values() if r['path'].rsplit('/', 1)[0] == resource_path]
+            return resource['data'] or b''
+        elif method == 'PUT':
+            if 'parent' in params:
+                del self.resources[resource_path]
+                resource['path'] = params['parent'] + '/' + resource['name']
+                self.resources[resource['path']] = resource
+            elif resource['type'] == SEQUENCE:
+                self.update_sequence(resource_path, base64.b64decode(params['data']).decode(), datetime.datetime.utcnow())
+            else:
+                resource['data'] = base64.b64decode(params['data'])
+                resource['lastRevisionId'] = (resource['lastRevisionId'] or 0) + 1
+            return {'status': 'ok'}
+        elif method == 'DELETE':
+            del self.resources[resource_path]
+            return {'status': 'ok'}
+        raise ValueError(method)
+
+    def post_resource(self, params):
+        path = params['path'] + '/' + params['name']
+        data = base64.b64decode(params['data']) if 'data' in params else None
+        system_attributes = json.loads(params['system_attributes']) if 'system_attributes' in params else None
+        resource = self.create_resource(path, int(params['type']), data, system_attributes)
+        return {'status': 'ok', 'id': resource['id']}
+
+    def resource_info(self, resource, include_path=False):
+        info = {key: resource[key] for key in ('id', 'name', 'type', 'lastRevisionId', 'system_attributes')}
+        if include_path:
+            info['path'] = resource['path']
+        return info
+
+    # ======== messages ========
+
+    # handle a message received from a client
+    def handle_message(self, folder, message_type, parameters, sender=None):
+        self.message_count += 1
+        self.message_log.append((folder, message_type, parameters))
+        if message_type == 'update_sequence':
+            seq_path = parameters['sequence']
+            if not seq_path.startswith('/'):
+                seq_path = folder + '/' + seq_path
+            self.update_sequence(seq_path, parameters['value'], datetime.datetime.utcnow())
+        elif message_type == 'update':
+            timestamp = parse_json_datetime(parameters['$t']) if '$t' in parameters else datetime.datetime.utcnow()
+            for (name, value) in parameters.items():
+                if name != '$t':
+                    self.update_sequence(folder + '/' + name, value, timestamp)
+        elif message_type in self._responders and 'request_id' in parameters:
+            (response_type, response_parameters) = self._responders[message_type](parameters)
+            response_parameters = dict(response_parameters, response_to=parameters['request_id'])
+            gevent.spawn(self.send_message, folder, response_type, response_parameters)
+        elif message_type not in ('ping', 'subscribe', 'connect'):
+            for ws in list(self._web_sockets):
+                if ws is not sender and ws.subscribed(folder):
+                    ws.deliver(json.dumps({'type': message_type, 'parameters': parameters, 'folder': folder}))
+
+    # store a sequence value (creating the sequence if needed)
+    def update_sequence(self, path, value, timestamp):
+        resource = self.resources.get(path)
+        if not resource:
+            resource = self.create_resource(path, SEQUENCE)
+        resource['data'] = str(value).encode()
+        self.sequence_values.setdefault(path, []).append((timestamp, value))
+        (folder, name) = path.rsplit('/', 1)
+        self.send_message(folder, 'sequence_update', {'name': name, 'value': value, 'timestamp': timestamp.isoformat() + ' Z'})
+
+    # handle an MQTT publish from a client
+    def handle_publish(self, topic, payload, sender):
+        folder = '/' + topic
+        if packing.is_packed(payload):
+            for (name, timestamp, value) in packing.unpack_samples(payload):
+                self.update_sequence(folder + '/' + name, value, timestamp)
+            return
+        payload = payload.decode() if isinstance(payload, bytes) else payload
+        if payload.startswith('{'):
+            for (message_type, parameters) in json.loads(payload).items():
+                self.handle_message(folder, message_type, parameters, sender)
+        elif payload.startswith('s,'):
+            (name, timestamp, value) = payload[2:].split(',', 2)
+            self.update_sequence(folder + '/' + name, value, parse_json_datetime(timestamp))
+
+
+# a transport that connects a client to a LoopbackServer in the same process
+class LoopbackTransport(object):
+
+    # latency (in seconds) is added to each HTTP request and websocket connection to simulate a network
+    def __init__(self, server, latency=0):
+        self.server = server
+        self.latency = latency
+
+    def send_request(self, server, method, path, params, secure=True, accept_type='text/plain', basic_auth=None, ssl_skip_verify=False):
+        gevent.sleep(self.latency)  # yield, as a network request would
+        return self.server.handle_request(method, path, params, basic_auth)
+
+    def web_socket(self, url, headers=None):
+        return LoopbackWebSocket(self.server, headers, latency=self.latency)
+
+    def mqtt_client(self):
+        return LoopbackMqttClient(self.server)
+
+
+# a received websocket message (mimicking ws4py message objects)
+class LoopbackMessage(object):
+
+    def __init__(self, data):
+        self.data = data
+        self.is_binary = isinstance(data, bytes)
+
+    def __str__(self):
+        return self.data if not self.is_binary else self.data.decode()
+
+
+# a pong control frame (mimicking ws4py)
+class LoopbackPong(object):
+
+    def __init__(self, data):
+        self.data = data
+
+
+# a websocket connection to a LoopbackServer (mimicking ws4py's gevent WebSocketClient)
+class LoopbackWebSocket(object):
+    link_monitor = None
+
+    def __init__(self, server, headers=None, on_deliver=None, latency=0):
+        self._server = server
+        self._latency = latency
+        self._headers = dict(headers or [])
+        self._on_deliver = on_deliver  # if specified, messages from the server are passed to this function instead of being queued
+        self._messages = Queue()
+        self._subscriptions = []  # list of (folder path, include_children) tuples
+        self._controller_path = None
+        self.terminated = False
+
+    def connect(self):
+        gevent.sleep(self._latency)
+        self._controller_path = self._server.authenticate(self._headers.get('Authorization', '').replace('Basic ', ''))
+        self._server._web_sockets.append(self)
+
+    def send(self, payload, binary=False):
+        if self.terminated:
+            raise AttributeError('websocket closed')  # the client treats this as a disconnect
+        if binary:
+            raise ValueError('the loopback server does not support binary websocket frames')
+        for line in payload.split('\n'):
+            if line:
+                message_struct = json.loads(line)
+                message_type = message_struct['type']
+                parameters = message_struct['parameters']
+                folder = message_struct.get('folder', self._controller_path)
+                if message_type == 'subscribe':
+                    for subscription in parameters['subscriptions']:
+                        path = self._controller_path if subscription['folder'] == 'self' else subscription['folder']
+                        self._subscriptions.append((path, subscription.get('include_children', False)))
+                self._server.handle_message(folder, message_type, parameters, self)
+
+    def receive(self, block=True):
+        if self.terminated and self._messages.empty():
+            return None
+        message = self._messages.get(block=block)
+        return None if message is StopIteration else LoopbackMessage(message)
+
+    def ping(self, message):
+        if self.link_monitor:
+            gevent.spawn(self.ponged, LoopbackPong(message.encode()))
+
+    def ponged(self, pong):
+        if self.link_monitor:
+            self.link_monitor.pong_received(pong.data)
+
+    def close(self, code=1000, reason=''):
+        self.terminate()
+
+    def terminate(self):
+        if not self.terminated:
+            self.terminated = True
+            if self in self._server._web_sockets:
+                self._server._web_sockets.remove(self)
+            self._messages.put(StopIteration)
+
+    # returns True if this connection is subscribed to messages for the given folder
+    def subscribed(self, folder):
+        for (path, include_children) in self._subscriptions:
+            if folder == path or (include_children and folder.startswith(path + '/')):
+                return True
+        return False
+
+    # called by the server to send a message to the client
+    def deliver(self, message):
+        if self._on_deliver:
+            self._on_deliver(message)
+        else:
+            self._messages.put(message)
+
+
+# an MQTT message (mimicking paho-mqtt MQTTMessage)
+class LoopbackMqttMessage(object):
+
+    def __init__(self, topic, payload):
+        self.topic = topic
+        self.payload = payload
+
+
+# the result of an MQTT publish (mimicking paho-mqtt MQTTMessageInfo)
+class LoopbackMessageInfo(object):
+
+    def __init__(self, rc, mid):
+        self.rc = rc
+        self.mid = mid
+
+
+# an MQTT client connected to a LoopbackServer (mimicking the parts of the paho-mqtt Client API used by MessageClient)
+class LoopbackMqttClient(object):
+
+    def __init__(self, server):
+        self._server = server
+        self._password = None
+        self._topics = []
+        self._next_mid = 1
+        self._connected = False
+        self.on_connect = None
+        self.on_disconnect = None
+        self.on_message = None
+        self.on_publish = None
+
+    def username_pw_set(self, username, password=None):
+        self._password = password
+
+    def tls_set(self, *args, **kwargs):
+        pass
+
+    def max_inflight_messages_set(self, inflight):
+        pass
+
+    def max_queued_messages_set(self, queue_size):
+        pass
+
+    def reconnect_delay_set(self, min_delay=1, max_delay=120):
+        pass
+
+    def connect(self, host, port=1883, keepalive=60):
+        pass
+
+    def connect_async(self, host, port=1883, keepalive=60):
+        pass
+
+    def loop_start(self):
+        gevent.spawn(self._connect)
+
+    def loop_stop(self):
+        pass
+
+    def disconnect(self):
+        self._connected = False
+        if self in self._server._mqtt_clients:
+            self._server._mqtt_clients.remove(self)
+        if self.on_disconnect:
+            self.on_disconnect(self, None, 0)
+
+    def _connect(self):
+        rc = 0 if self._password in self._server._keys else 5  # 5: not authorized
+        if not rc:
+            self._connected = True
+            self._server._mqtt_clients.append(self)
+        if self.on_connect:
+            self.on_connect(self, None, {}, rc)
+
+    def subscribe(self, topic, qos=0):
+        self._topics.append(topic)
+        return (MQTT_ERR_SUCCESS, self._next_mid)
+
+    def unsubscribe(self, topic):
+        if topic in self._topics:
+            self._topics.remove(topic)
+        return (MQTT_ERR_SUCCESS, self._next_mid)
+
+    def publish(self, topic, payload=None, qos=0, retain=False):
+        mid = self._next_mid
+        self._next_mid += 1
+        if not self._connected:
+            return LoopbackMessageInfo(MQTT_ERR_NO_CONN, mid)
+        if isinstance(payload, str):
+            payload = payload.encode()
+        self._server.handle_publish(topic, payload, self)
+        if self.on_publish:
+            gevent.spawn(self.on_publish, self, None, mid)
+        return LoopbackMessageInfo(MQTT_ERR_SUCCESS, mid)
+
+    # returns True if this client is subscribed to the topic for the given folder
+    def subscribed(self, folder):
+        return folder.lstrip('/') in self._topics
+
+    # called by the server to send a message to the client
+    def deliver(self, topic, payload):
+        if self.on_message:
+            self.on_message(self, None, LoopbackMqttMessage(topic, payload))
+
+
+# ======== network stand-in server ========
+
+
+# the server side of a websocket connection to a LoopbackServer running as a network server
+class LoopbackServerWebSocket(WebSocket):
+    loopback_server = None  # set by make_wsgi_app
+
+    def opened(self):
+        headers = [('Authorization', self.environ.get('HTTP_AUTHORIZATION', ''))]
+        self.connection = LoopbackWebSocket(self.loopback_server, headers, on_deliver=self.send)
+        self.connection.connect()
+
+    def received_message(self, message):
+        self.connection.send(str(message))
+
+    def closed(self, code, reason=None):
+        self.connection.terminate()
+
+
+# create a WSGI application that serves the resource API and websocket protocol using a LoopbackServer
+def make_wsgi_app(server):
+    from ws4py.server.wsgiutils import WebSocketWSGIApplication
+    handler_class = type('LoopbackServerWebSocketHandler', (LoopbackServerWebSocket,), {'loopback_server': server})
+    web_socket_app = WebSocketWSGIApplication(protocols=['http-only'], handler_cls=handler_class)
+
+    def app(environ, start_response):
+        path = environ['PATH_INFO']
+        if path == '/api/v1/websocket':
+            return web_socket_app(environ, start_response)
+        method = environ['REQUEST_METHOD']
+        params = dict(parse_qsl(environ.get('QUERY_STRING', '')))
+        params.update(parse_qsl(environ['wsgi.input'].read(int(environ.get('CONTENT_LENGTH') or 0)).decode()))  # the client sends params in the body for all methods
+        basic_auth = environ.get('HTTP_AUTHORIZATION', '').replace('Basic ', '')
+        (status, reason, data) = server.handle_request(method, path, params, basic_auth)
+        start_response('%d %s' % (status, reason), [('Content-Type', 'text/plain'), ('Content-Length', str(len(data)))])
+        return [data]
+
+    return app
+
+
+# run a LoopbackServer as a local network server (resource API and websocket protocol; MQTT is only available in-process);
+# usage: python -m rhizo.loopback [--port 5000]
+def main():
+    from ws4py.server.geventserver import WSGIServer
+    parser = OptionParser()
+    parser.add_option('-p', '--port', dest='port', type='int', default=5000)
+    parser.add_option('-k', '--secret-key', dest='secret_key', default='loopback-key')
+    (options, args) = parser.parse_args()
+    server = LoopbackServer(secret_key=options.secret_key)
+    print('loopback server listening on localhost:%d; use secret_key: %s' % (options.port, server.secret_key))
+    WSGIServer(('localhost', options.port), make_wsgi_app(server)).serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,14 +1,59 @@
+import os
 import sys
-import json
+import time
+import random
 import socket
 import base64
 import logging
-import datetime
 import traceback
 import gevent
-import paho.mqtt.client as mqtt
+from gevent.event import AsyncResult, Event
 from . import util
-from ws4py.client.geventclient import WebSocketClient
+from . import wire
+from . import packing
+from .dispatch import HandlerRunner, DROP_OLDEST
+from .keepalive import LinkMonitor
+from .backoff import Backoff
+from .transports import MQTT_ERR_SUCCESS, MQTT_ERR_NO_CONN
+from .shaping import OutgoingLanes, CONTROL, ALERTS, TELEMETRY, BULK
+from .sequences import UPDATE_MESSAGE_TYPES
+from .metrics import NULL_REGISTRY
+from .tracing import NULL_TRACER
+
+
+# message classes used to choose the outgoing priority lane (see shaping.py) and delivery options (e.g. MQTT QoS)
+# for outgoing messages; message types not listed here are treated as telemetry; callers can also send messages in the bulk class
+message_classes = {
+    'ping': CONTROL,
+    'subscribe': CONTROL,
+    'connect': CONTROL,
+    'config': CONTROL,
+    'send_email': ALERTS,
+    'send_text_message': ALERTS,
+}
+
+
+# get the message class for a message type
+def classify_message(message_type):
+    return message_classes.get(message_type, TELEMETRY)
+
+
+# an exception type for MQTT publishes that could not be queued or sent
+class PublishError(Exception):
+    def __init__(self, rc):
+        self.rc = rc
+    def __str__(self):
+        import paho.mqtt.client as mqtt
+        return 'MQTT publish error: %s' % mqtt.error_string(self.rc)
+
+
+# an exception type for requests that don't receive a response within their timeout
+class RequestTimeout(Exception):
+    def __init__(self, message_type, timeout):
+        self.message_type = message_type
+        self.timeout = timeout
+    def __str__(self):
+        return 'no response to %s request within %.1f seconds' % (self.message_type, self.timeout)
 
 
 # provides an interface to the rhizo-server message server
@@ -17,18 +62,71 @@ class MessageClient(object):
     def __init__(self, controller):
         self._controller = controller
         self._web_socket = None
-        self._outgoing_messages = []
-        self._message_handlers = []  # user-defined message handlers
+        metrics = getattr(controller, 'metrics', NULL_REGISTRY)  # metrics and tracing are no-ops unless enabled in the controller config
+        use_mqtt = 'mqtt_host' in controller.config
+        self._outgoing = OutgoingLanes(metrics=None if use_mqtt else metrics)  # queued websocket messages, by priority
+        self._outgoing_event = Event()  # set when messages are added to the websocket queue (wakes web_socket_sender)
+        self._mqtt_outgoing = OutgoingLanes(metrics=metrics if use_mqtt else None)  # queued MQTT publishes, by priority
+        self._mqtt_event = Event()  # set when publishes are added to the MQTT queue (wakes mqtt_sender)
+        self._message_handlers = []  # user-defined message handlers that receive all message types
+        self._handler_routes = {}  # user-defined message handlers by message type
+        self._handler_count = 0  # number of handlers added (used to give handlers unique names)
         self._client = None
         self._client_connected = False
+        self.codec = wire.get_codec(controller.config.get('message_codec', 'json'))  # see wire.py
+        self._text_codec = self.codec if not self.codec.binary else wire.JsonCodec()  # used for incoming text messages
+        self._mqtt_qos = {}  # QoS by message class
+        self._pending_publishes = {}  # AsyncResult by MQTT message ID, for publishes that haven't completed
+        self._completed_mids = set()  # MQTT message IDs completed before their results were registered
+        self._pending_requests = {}  # (AsyncResult, timeout greenlet) by request ID, for requests awaiting a response
+        self._request_prefix = base64.b32encode(os.urandom(5)).decode().lower()  # makes request IDs unique across clients
+        self._request_count = 0
+        self._tracer = getattr(controller, 'tracer', NULL_TRACER)
+        self._greenlets = []  # websocket greenlets (killed by close())
+        self._ping_task = None
+        self._last_ping_message_time = None
+
+        # round-trip time monitoring for each connection
+        config = controller.config
+        keepalive_args = (config.get('keepalive_min_interval', 5), config.get('keepalive_max_interval', 45), config.get('keepalive_timeout', 15))
+        self.web_socket_link = LinkMonitor(*keepalive_args)
+        self.mqtt_link = LinkMonitor(*keepalive_args)  # RTTs measured from QoS 1/2 acknowledgements
+
+        # outgoing rate limits
+        self.set_rate_limits(config)
+
+        # reconnect scheduling
+        self._reconnect_backoff = Backoff(config.get('reconnect_base_delay', 5), config.get('reconnect_max_delay', 300), jitter=config.get('reconnect_jitter', 1.0))
+        self._connect_attempted = False
+        self._replay_remaining = 0  # number of queued messages to send at the replay rate after reconnecting
+
+        # publish stats
+        self.publish_count = 0
+        self.publish_bytes = 0
+        self.publish_complete_count = 0
+        self.publish_error_count = 0
+
+        # metrics
+        self._sent_messages = metrics.counter('rhizo_ws_messages_sent_total', 'messages sent over the websocket connection')
+        self._sent_bytes = metrics.counter('rhizo_ws_bytes_sent_total', 'bytes sent over the websocket connection')
+        self._received_messages = metrics.counter('rhizo_messages_received_total', 'messages received from the server')
+        self._connections = metrics.counter('rhizo_ws_connections_total', 'websocket connections opened (including reconnects)')
+        metrics.gauge('rhizo_ws_queue_length', 'messages waiting to be sent (over the websocket or MQTT connection)', lambda: len(self._outgoing) + len(self._mqtt_outgoing))
+        metrics.counter('rhizo_mqtt_publishes_total', 'MQTT messages published', lambda: self.publish_count)
+        metrics.counter('rhizo_mqtt_bytes_sent_total', 'MQTT payload bytes published', lambda: self.publish_bytes)
+        metrics.counter('rhizo_mqtt_publishes_completed_total', 'MQTT publishes completed', lambda: self.publish_complete_count)
+        metrics.counter('rhizo_mqtt_publish_errors_total', 'MQTT publishes that failed', lambda: self.publish_error_count)
+        metrics.gauge('rhizo_mqtt_pending_publishes', 'MQTT publishes waiting for completion', lambda: len(self._pending_publishes))
+        metrics.add('rhizo_ws_rtt_seconds', self.web_socket_link.rtt_histogram, 'websocket ping round-trip time')
+        metrics.add('rhizo_mqtt_rtt_seconds', self.mqtt_link.rtt_histogram, 'MQTT QoS 1/2 acknowledgement round-trip time')
 
     def connect(self):
 
         # old websocket connection
         if self._controller.config.get('enable_ws', True):
-            gevent.spawn(self.web_socket_listener)
-            gevent.spawn(self.web_socket_sender)
-            gevent.spawn(self.ping_web_socket)
+            self._greenlets = [gevent.spawn(self.web_socket_listener), gevent.spawn(self.web_socket_sender)]
+            self._last_ping_message_time = time.time()
+            self._ping_task = self._controller.schedule(self.ping_web_socket, 1, name='ping_web_socket')
 
         # MQTT connection
         if 'mqtt_host' in self._controller.config:
@@ -37,6 +135,7 @@ class MessageClient(object):
             mqtt_tls = self._controller.config.get('mqtt_tls', True)
             mqtt_username = self._controller.config.get('mqtt_username', 'key')
             mqtt_password = self._controller.config.get('mqtt_password', self._controller.config.secret_key)
+            self._mqtt_qos = self._controller.config.get('mqtt_qos', {})
 
             # run this on connect/reconnect to MQTT server/broker
             def on_connect(client, userdata, flags, rc):
@@ -48,6 +147,8 @@ class MessageClient(object):
                 topic = self._controller.path_on_server().lstrip('/')  # don't use leading slash for MQTT topics
                 self._client.subscribe(topic)
                 logging.info('subscribed to %s' % topic)
+                for folder in self._controller.sequences.subscribed_folders():  # renew sequence subscriptions
+                    self._client.subscribe(folder.lstrip('/'))
 
             # run this on disconnect from MQTT server/broker
             def on_disconnect(client, userdata, rc):
@@ -55,34 +156,73 @@ class MessageClient(object):
 
             # run this on incoming MQTT message
             def on_message(client, userdata, msg):
-                # print('MQTT recv: %s, %s' % (msg.topic, msg.payload.decode()))
-                self.process_incoming_message(msg.payload.decode())
+                # print('MQTT recv: %s, %s' % (msg.topic, msg.payload))
+                if packing.is_packed(msg.payload):  # sequence values from another controller
+                    self._controller.sequences.receive_packed_samples('/' + msg.topic, msg.payload)
+                else:
+                    self.process_incoming_message(msg.payload, folder='/' + msg.topic)
 
-            self._client = mqtt.Client(transport='websockets')
+            # run this when a publish has been sent (QoS 0) or acknowledged (QoS 1 or 2)
+            def on_publish(client, userdata, mid):
+                self.publish_complete(mid)
+
+            self._client = self._controller.transport.mqtt_client()
             self._client.on_connect = on_connect
             self._client.on_disconnect = on_disconnect
             self._client.on_message = on_message
+            self._client.on_publish = on_publish
             self._client.username_pw_set(mqtt_username, mqtt_password)
+            self._client.max_inflight_messages_set(self._controller.config.get('mqtt_max_inflight_messages', 20))
+            self._client.max_queued_messages_set(self._controller.config.get('mqtt_max_queued_messages', 0))
+            reconnect_delay = self._controller.config.get('reconnect_base_delay', 5) * (1.0 + random.random())  # randomize per client so a fleet doesn't reconnect in sync
+            self._client.reconnect_delay_set(reconnect_delay, self._controller.config.get('reconnect_max_delay', 300))
             if mqtt_tls:
                 self._client.tls_set()  # enable SSL
-            self._client.connect(mqtt_host, mqtt_port)
+            self._client.connect_async(mqtt_host, mqtt_port, keepalive=self._controller.config.get('mqtt_keepalive', 60))  # connects in the network loop
             self._client.loop_start()
+            self._greenlets.append(gevent.spawn(self.mqtt_sender))
+
+    # wait up to timeout seconds for queued websocket messages and pending MQTT publishes to be sent, then disconnect;
+    # returns a dictionary with the number of messages and publishes that were not sent
+    def close(self, timeout=10):
+        end_time = time.time() + timeout
+        while (self._greenlets and (self._outgoing or self._mqtt_outgoing)) or self._pending_publishes:
+            if time.time() >= end_time:
+                break
+            gevent.sleep(0.05)
+        gevent.killall(self._greenlets)
+        self._greenlets = []
+        if self._ping_task:
+            self._ping_task.cancel()
+        if self._web_socket:
+            try:
+                self._web_socket.close()
+            except Exception:
+                pass
+            self._web_socket = None
+        if self._client:
+            self._client.disconnect()
+            self._client.loop_stop()
+            self._client_connected = False
+        unsent = {'messages': len(self._outgoing) + len(self._mqtt_outgoing), 'publishes': len(self._pending_publishes)}
+        if unsent['messages'] or unsent['publishes']:
+            logging.warning('closed message connection with %d queued messages and %d pending publishes' % (unsent['messages'], unsent['publishes']))
+        return unsent
 
     # returns True if connected to MQTT or websocket server
     def connected(self):
         return (self._web_socket is not None) or (self._client and self._client_connected)
 
-    # send a generic message to the server
-    def send(self, message_type, parameters, channel=None, folder=None, prepend=False):
+    # send a generic message to the server; when using MQTT, returns an AsyncResult that is set when the publish completes
+    def send(self, message_type, parameters, channel=None, folder=None, prepend=False, message_class=None):
         if self._client:  # MQTT messages
             if folder:
                 path = folder
             else:
                 path = self._controller.path_on_server()
             topic = path.lstrip('/')  # rhizo paths start with slash (to distinguish absolute vs relative paths) while MQTT topics don't
-            message = json.dumps({message_type: parameters})
-            self._client.publish(topic, message)
-            # print('MQTT send: %s, %s' % (topic, message))
+            message = self.codec.encode({message_type: parameters})
+            return self.publish(topic, message, message_class or classify_message(message_type))
         else:  # old-style websocket messages
             message_struct = {
                 'type': message_type,
@@ -92,17 +232,87 @@ class MessageClient(object):
                 message_struct['folder'] = folder
             if channel:
                 message_struct['channel'] = channel
-            self.send_message_struct_to_server(message_struct, prepend)
+            self.send_message_struct_to_server(message_struct, prepend, message_class=message_class or classify_message(message_type))
 
-    def send_simple(self, path, message):
+    # send a pre-formatted message (string or bytes) to an MQTT topic; other objects are encoded using the message codec;
+    # returns an AsyncResult that is set when the publish completes
+    def send_simple(self, path, message, message_class=TELEMETRY):
         if self._client:
+            if not isinstance(message, (str, bytes)):
+                message = self.codec.encode(message)
             topic = path.lstrip('/')  # rhizo paths start with slash (to distinguish absolute vs relative paths) while MQTT topics don't
-            self._client.publish(topic, message)
-            # print('MQTT send: %s, %s' % (topic, message))
+            return self.publish(topic, message, message_class)
+
+    # get MQTT publish counters
+    def publish_stats(self):
+        return {
+            'published': self.publish_count,
+            'published_bytes': self.publish_bytes,
+            'completed': self.publish_complete_count,
+            'errors': self.publish_error_count,
+            'in_flight': len(self._pending_publishes),
+        }
+
+    # subscribe to messages for the given folders (used for sequence subscriptions; see SequenceClient.subscribe);
+    # if not currently connected, the subscriptions are sent when we connect
+    def subscribe_folders(self, folders):
+        if self._client:
+            if self._client_connected:
+                for folder in folders:
+                    self._client.subscribe(folder.lstrip('/'))  # don't use leading slash for MQTT topics
+        elif self._web_socket:
+            self.send('subscribe', {'subscriptions': [{'folder': folder, 'message_type': 'sequence_update'} for folder in folders]})
+
+    # stop receiving messages for the given folders (used when no subscribed sequences remain in them); the websocket
+    # protocol doesn't have an unsubscribe message, so websocket subscriptions last until we reconnect (the values are ignored)
+    def unsubscribe_folders(self, folders):
+        if self._client and self._client_connected:
+            own_topic = self._controller.path_on_server().lstrip('/')
+            for folder in folders:
+                topic = folder.lstrip('/')
+                if topic != own_topic:  # we still need messages intended for this controller
+                    self._client.unsubscribe(topic)
+
+    # returns True if a message in the given folder is intended for this controller (rather than received for a sequence
+    # subscription); messages without a folder are intended for this controller
+    def is_own_folder(self, folder):
+        if folder is None:
+            return True
+        path = self._controller.path_on_server()
+        return folder == path or (self._controller.config.get('subscribe_children', False) and folder.startswith(path + '/'))
+
+    # get throughput and queue wait statistics for each outgoing priority lane (of the MQTT queue if using MQTT)
+    def lane_stats(self):
+        return (self._mqtt_outgoing if self._client else self._outgoing).stats()
+
+    # set the outgoing message rate limits from the config (also used when the config is reloaded)
+    def set_rate_limits(self, config):
+        for lanes in (self._outgoing, self._mqtt_outgoing):
+            lanes.set_rates(config.get('message_rate', 0), config.get('message_burst'), config.get('bulk_message_rate', 0))
+
+    # get round-trip time statistics (and histograms) for the websocket and MQTT connections
+    def link_stats(self):
+        return {
+            'websocket': self.web_socket_link.stats(),
+            'mqtt': self.mqtt_link.stats(),
+        }
+
+    # send a request message and return an AsyncResult that will be set to the parameters of the response message;
+    # the request parameters get a request_id entry and the response is identified by a matching response_to entry,
+    # so many requests can be in progress at once; if there is no response within the timeout, the result is set to a RequestTimeout
+    def request(self, message_type, parameters, timeout=30, folder=None):
+        self._request_count += 1
+        request_id = '%s-%d' % (self._request_prefix, self._request_count)
+        parameters = dict(parameters, request_id=request_id)
+        result = AsyncResult()
+        timer = gevent.spawn_later(timeout, self.expire_request, request_id, RequestTimeout(message_type, timeout))
+        self._pending_requests[request_id] = (result, timer)
+        self.send(message_type, parameters, folder=folder, message_class=CONTROL)
+        return result
 
     # send an email (to up to five addresses)
     def send_email(self, email_addresses, subject, body):
-        self.send('send_email', {
+        return self.send('send_email', {
             'email_addresses': email_addresses,
             'subject': subject,
             'body': body,
@@ -110,17 +320,96 @@ class MessageClient(object):
 
     # send a text message (to up to five phone numbers)
     def send_sms(self, phone_numbers, message):
-        self.send('send_text_message', {
+        return self.send('send_text_message', {
             'phone_numbers': phone_numbers,
             'message': message,
         })
 
-    # add a custom handler for messages from server
-    def add_handler(self, message_handler):
-        self._message_handlers.append(message_handler)
+    # add a custom handler for messages from server; if types is specified, the handler only receives messages of
+    # those types; if workers > 0, the handler runs in a pool of greenlets (or threads if use_threads is True) fed by a
+    # bounded queue, with overflow set to 'drop_oldest', 'drop_newest', or 'block'; if another handler has the same name
+    # (e.g. lambdas), the handler's name (used for stats and tracing) gets a registration index suffix (e.g. '<lambda>#2')
+    def add_handler(self, message_handler, types=None, workers=0, queue_size=100, overflow=DROP_OLDEST, use_threads=False):
+        runner = HandlerRunner(message_handler, workers, queue_size, overflow, use_threads, self._tracer)
+        self._handler_count += 1
+        if runner.name in self.handler_stats():
+            runner.name = '%s#%d' % (runner.name, self._handler_count)
+        if types:
+            for message_type in types:
+                self._handler_routes.setdefault(message_type, []).append(runner)
+        else:
+            self._message_handlers.append(runner)
+        return runner
+
+    # get a dictionary of stats for each message handler, keyed by handler name
+    def handler_stats(self):
+        runners = list(self._message_handlers)
+        for route_runners in self._handler_routes.values():
+            runners += [runner for runner in route_runners if runner not in runners]
+        return {runner.name: runner.stats() for runner in runners}
 
     # ======== internal functions ========
 
+    # publish an MQTT message using the QoS configured for the message class; the message is published right away if
+    # nothing is queued and the rate limit allows; otherwise it is queued in the message class's lane (see mqtt_sender);
+    # returns an AsyncResult that is set to True when the publish completes (or set to a PublishError if it fails);
+    # note: QoS 0 messages complete when sent; QoS 1 and 2 messages complete when acknowledged by the broker
+    def publish(self, topic, message, message_class):
+        result = AsyncResult()
+        if not self._mqtt_outgoing and self._mqtt_outgoing.ready(message_class):
+            self.publish_now(topic, message, message_class, result)
+            self._mqtt_outgoing.record(message_class, len(message))
+        else:
+            self._mqtt_outgoing.put((topic, message, result), message_class)
+            self._mqtt_event.set()
+        return result
+
+    # runs as a greenlet that publishes queued MQTT messages (highest priority first) as the rate limits allow
+    def mqtt_sender(self):
+        while True:
+            self._mqtt_event.clear()
+            wait_time = self._mqtt_outgoing.wait_time() if self._mqtt_outgoing else 1
+            if wait_time:
+                self._mqtt_event.wait(wait_time)  # wakes early if a message is queued (it may be a control message)
+                continue
+            entries = self._mqtt_outgoing.take()
+            for (lane, queued_time, (topic, message, result)) in entries:
+                self.publish_now(topic, message, lane.name, result)
+            self._mqtt_outgoing.remove(entries, [len(message) for (lane, queued_time, (topic, message, result)) in entries])
+
+    # publish an MQTT message and set up tracking of its completion (using the given AsyncResult)
+    def publish_now(self, topic, message, message_class, result):
+        qos = self._mqtt_qos.get(message_class, 0)
+        with self._tracer.span('mqtt.publish', 'messages', topic=topic, size=len(message)):
+            info = self._client.publish(topic, message, qos=qos)
+        # print('MQTT send: %s, %s' % (topic, message))
+        self.publish_count += 1
+        self.publish_bytes += len(message)
+        if info.rc == MQTT_ERR_SUCCESS or (info.rc == MQTT_ERR_NO_CONN and qos > 0):  # QoS 1/2 messages are queued while disconnected
+            if info.mid in self._completed_mids:
+                self._completed_mids.remove(info.mid)
+                self.publish_complete_count += 1
+                result.set(True)
+            else:
+                self._pending_publishes[info.mid] = (result, time.time() if qos else None)
+        else:
+            self.publish_error_count += 1
+            result.set_exception(PublishError(info.rc))
+
+    # called by the MQTT client when a publish completes
+    def publish_complete(self, mid):
+        pending = self._pending_publishes.pop(mid, None)
+        if pending:
+            (result, publish_time) = pending
+            if publish_time:  # acknowledged by broker
+                now = time.time()
+                self.mqtt_link.record_rtt(now - publish_time)
+                self._tracer.record('mqtt.ack', publish_time, now, 'messages')
+            self.publish_complete_count += 1
+            result.set(True)
+        else:
+            self._completed_mids.add(mid)
+
     # initiate a websocket connection with the server
     def connect_web_socket(self):
         config = self._controller.config
@@ -136,7 +425,9 @@ class MessageClient(object):
             user_name = self._controller.VERSION + '.' + self._controller.BUILD  # send client version as user name
             password = config.secret_key  # send secret key as password
             headers = [('Authorization', 'Basic %s' % base64.b64encode(('%s:%s' % (user_name, password)).encode()).decode())]
-        ws = WebSocketClient(protocol + '://' + config.server_name + '/api/v1/websocket', protocols=['http-only'], headers=headers)
+        ws = self._controller.transport.web_socket(protocol + '://' + config.server_name + '/api/v1/websocket', headers)
+        ws.link_monitor = self.web_socket_link
+        self.web_socket_link.reset()
         try:
             ws.connect()
             logging.debug('opened websocket connection to server')
@@ -146,47 +437,86 @@ class MessageClient(object):
             ws = None
         return ws
 
-    # handle an incoming message from the websocket
-    def process_incoming_message(self, message):
-        message_type = None
-        parameters = None
+    # decode an incoming binary frame (which may contain several messages) using the message codec;
+    # returns a list of message structures (empty if the frame doesn't consist of message structures)
+    def decode_binary_messages(self, data):
+        try:
+            message_structs = self.codec.decode_all(data)
+        except Exception:
+            return []
+        return message_structs if all(isinstance(message_struct, dict) for message_struct in message_structs) else []
+
+    # handle an incoming message (or frame of binary messages) from the websocket or MQTT connection
+    def process_incoming_message(self, message, folder=None):
+        if getattr(message, 'is_binary', False):  # binary websocket message
+            message = message.data
+        if isinstance(message, bytes):
+            if self.codec.binary and message[:1] != b'{':
+                message_structs = self.decode_binary_messages(message)
+                if message_structs:
+                    for message_struct in message_structs:
+                        self.process_message_struct(message_struct, folder)
+                    return
+            message = message.decode()
         message = str(message)  # shouldn't be needed, but we'll be removing all this code soon, so we can leave it
         if message[0] == '{':
-            message_struct = json.loads(message)
-            if 'type' in message_struct:
-                message_type = message_struct['type']
-                parameters = message_struct['parameters']
-            else:
-                for k, v in message_struct.items():
-                    message_type = k
-                    parameters = v
-                    break
+            self.process_message_struct(self._text_codec.decode(message), folder)
         else:
             message_type, parameters = message.split(',', 1)  # note: in this case, parameters is a string not dictionary
-        if message_type:
+            self.handle_message(message_type, parameters, folder)
+
+    # handle an incoming message structure: either {type, parameters, [folder]} or {message_type: parameters}
+    def process_message_struct(self, message_struct, folder=None):
+        if 'type' in message_struct:
+            message_type = message_struct['type']
+            parameters = message_struct['parameters']
+            folder = message_struct.get('folder', folder)
+        else:
+            message_type = None
+            parameters = None
+            for k, v in message_struct.items():
+                message_type = k
+                parameters = v
+                break
+        self.handle_message(message_type, parameters, folder)
+
+    # handle an incoming message: pass it to the built-in handlers or user-defined handlers
+    def handle_message(self, message_type, parameters, folder=None):
+        self._received_messages.inc()
+        if message_type and not self.is_own_folder(folder):  # only sequence values are used from other folders
+            if message_type in UPDATE_MESSAGE_TYPES:
+                self._controller.sequences.receive_message(message_type, parameters, folder)
+        elif message_type:
             response_message = None
-            if message_type == 'get_config' or message_type == 'getConfig':
-                response_message = self.config_message(parameters['names'].split(','))
+            options = parameters if isinstance(parameters, dict) else {}  # for built-in messages; missing or malformed parameters are treated as empty
+            if message_type in UPDATE_MESSAGE_TYPES and folder:  # update the local copies of subscribed sequences
+                self._controller.sequences.receive_message(message_type, parameters, folder)
+            if isinstance(parameters, dict) and parameters.get('response_to') in self._pending_requests:
+                (result, timer) = self._pending_requests.pop(parameters['response_to'])
+                timer.kill(block=False)  # so that busy callers don't accumulate timers
+                result.set(parameters)
+            elif message_type == 'get_config' or message_type == 'getConfig':
+                response_message = self.config_message([name for name in str(options.get('names', '')).split(',') if name], options.get('request_id'))
             elif message_type == 'set_config' or message_type == 'setConfig':
-                self.set_config(parameters)
+                self.set_config(options)
+            elif message_type == 'profile_start':
+                self._controller.profiler.start(options.get('duration', 30), options.get('request_id'))
+            elif message_type == 'profile_stop':
+                gevent.spawn(self._controller.profiler.stop)  # uploads the results
+            elif message_type == 'heap_snapshot':
+                self._controller.profiler.heap_snapshot(options.get('duration', 10), options.get('frames', 1), request_id=options.get('request_id'))
             else:
-                message_used = False
-                if not message_used and self._message_handlers:
-                    for handler in self._message_handlers:
-                        if hasattr(handler, 'handle_message'):
-                            handler.handle_message(message_type, parameters)
-                        else:
-                            handler(message_type, parameters)
+                for runner in self._handler_routes.get(message_type, ()):
+                    runner.dispatch(message_type, parameters)
+                for runner in self._message_handlers:
+                    runner.dispatch(message_type, parameters)
             if response_message:
-                self.send_message_struct_to_server(response_message)
+                self.send(response_message['type'], response_message['parameters'])
 
-    # send a websocket message to the server
-    def send_message_struct_to_server(self, message_struct, prepend=False, timestamp=None):
-        timestamp = datetime.datetime.utcnow()
-        if prepend:
-            self._outgoing_messages = [(timestamp, message_struct)] + self._outgoing_messages
-        else:
-            self._outgoing_messages.append((timestamp, message_struct))
+    # queue a websocket message to be sent to the server (in the lane for the given message class)
+    def send_message_struct_to_server(self, message_struct, prepend=False, message_class=TELEMETRY):
+        self._outgoing.put(message_struct, message_class, prepend)
+        self._outgoing_event.set()
 
     # send a websocket message to the server subscribing to messages intended for this controller
     # note: these messages are prepended to the queue, so that we're authenticated for everything else in the queue
@@ -204,19 +534,28 @@ class MessageClient(object):
                     'folder': 'self',
                     'include_children': config.get('subscribe_children', False),
                 }
-            ]
+            ] + [{'folder': folder, 'message_type': 'sequence_update'} for folder in self._controller.sequences.subscribed_folders()]
         }, prepend=True)
         if config.get('old_auth', False):
             self.send('connect', params, prepend=True)  # add to queue after subscribe so send before; fix(soon): revisit this
         logging.info('controller connected/re-connected')
 
     # get a configuration setting as a message
-    def config_message(self, names):
+    def config_message(self, names, request_id=None):
+        parameters = {name: self._controller.config.get(name, '') for name in names}
+        if request_id:
+            parameters['response_to'] = request_id
         return {
             'type': 'config',
-            'parameters': {name: self._controller.config.get(name, '') for name in names},
+            'parameters': parameters,
         }
 
+    # fail a request that hasn't received a response
+    def expire_request(self, request_id, exception):
+        pending = self._pending_requests.pop(request_id, None)
+        if pending:
+            pending[0].set_exception(exception)
+
     # update the config file using a dictionary of config entries
     # fix(soon): this is out of date (doesn't fit current config file format); rework it or remove it
     def set_config(self, params):
@@ -234,8 +573,32 @@ class MessageClient(object):
         for line in output_lines:
             output_file.write(line)
         output_file.close()
-        self._controller.load_config()
-        self._controller.show_config()
+        self._controller.reload_config()
+
+    # apply changed config entries (see Controller.apply_config_changes); reconnects if the server or key changed
+    def apply_config(self, changes):
+        config = self._controller.config
+        if any(name.startswith('reconnect_') and name != 'reconnect_replay_rate' for name in changes):
+            self._reconnect_backoff = Backoff(config.get('reconnect_base_delay', 5), config.get('reconnect_max_delay', 300), jitter=config.get('reconnect_jitter', 1.0))
+        if 'mqtt_qos' in changes:
+            self._mqtt_qos = config.get('mqtt_qos', {})
+        if any(name in changes for name in ('message_rate', 'message_burst', 'bulk_message_rate')):
+            self.set_rate_limits(config)
+        if any(name in changes for name in ('server_name', 'secret_key', 'secure_server', 'ssl_skip_verify', 'mqtt_username', 'mqtt_password')):
+            self.reconnect()
+
+    # reconnect using the current config; for MQTT, the new credentials are used the next time the client reconnects
+    def reconnect(self):
+        if self._client:
+            config = self._controller.config
+            self._client.username_pw_set(config.get('mqtt_username', 'key'), config.get('mqtt_password', config.get('secret_key')))
+        elif self._web_socket:
+            web_socket = self._web_socket
+            self._web_socket = None  # the sender will reconnect
+            try:
+                web_socket.close()
+            except Exception:
+                pass
 
     # runs as a greenlet that maintains a websocket connection with the server
     def web_socket_listener(self):
@@ -244,15 +607,15 @@ class MessageClient(object):
                 if self._web_socket:
                     try:
                         message = self._web_socket.receive()
-                    except:
+                    except Exception:  # (not a bare except, so that close() can kill this greenlet)
                         message = None
                     if message:
                         self.process_incoming_message(message)
                     else:
                         logging.warning('disconnected (on received); reconnecting...')
-                        self._web_socket = None
-                        gevent.sleep(10)  # avoid fast reconnects
-                gevent.sleep(0.1)
+                        self._web_socket = None  # the sender will reconnect (with backoff)
+                else:
+                    gevent.sleep(0.1)  # wait for the sender to connect
             except Exception as e:
                 self._controller.error('error in web socket message listener/handler', exception = e)
                 exc_type, exc_value, exc_traceback = sys.exc_info()
@@ -264,34 +627,115 @@ class MessageClient(object):
     # runs as a greenlet that sends queued messages to the server
     def web_socket_sender(self):
         while True:
+            replay_rate = self._controller.settings.reconnect_replay_rate  # messages per second; 0 for no limit
             if self._web_socket:
-                while self._outgoing_messages:
+                while self._outgoing and self._web_socket:  # check the socket each time, in case we closed it in another greenlet
                     try:
-                        if self._web_socket:  # check again, in case we closed the socket in another thread
-                            (timestamp, message_struct) = self._outgoing_messages[0]
-                            if timestamp > datetime.datetime.utcnow() - datetime.timedelta(minutes=5):  # discard (don't send) messages older than 5 minutes
-                                self._web_socket.send(json.dumps(message_struct, separators=(',', ':')) + '\n')
-                            self._outgoing_messages = self._outgoing_messages[1:]  # remove from queue after send
+                        wait_time = self._outgoing.wait_time()
+                        if wait_time:  # rate limited
+                            self._outgoing_event.clear()
+                            self._outgoing_event.wait(wait_time)  # wakes early if a message is queued (it may be a control message)
+                            continue
+                        replaying = self._replay_remaining > 0
+                        with self._tracer.span('ws.encode', 'messages') as span:
+                            (frame, entries, sizes) = self.build_frame(max(1, int(replay_rate / 10)) if replaying else None)
+                            span.args['count'] = len(entries)
+                        if frame:
+                            with self._tracer.span('ws.send', 'messages', size=len(frame)):
+                                self._web_socket.send(frame, binary=self.codec.binary)
+                            self._sent_bytes.inc(len(frame))
+                        self._sent_messages.inc(len(entries))
+                        if self._tracer.enabled:
+                            self.trace_queue_residency(entries)
+                        self._outgoing.remove(entries, sizes)  # remove from queue after send
+                        if replaying:  # drain the backlog gradually after a reconnect
+                            self._replay_remaining -= len(entries)
+                            gevent.sleep(float(len(entries)) / replay_rate)
                     except (AttributeError, socket.error):
                         logging.debug('disconnected (on send); reconnecting...')
                         self._web_socket = None
                         break
-                gevent.sleep(0.1)
+                self._outgoing_event.clear()
+                if not self._outgoing:
+                    self._outgoing_event.wait(1)  # wake up when a message is queued (or periodically, in case we've disconnected)
             else:  # connect if not already connected
+                if self._connect_attempted:
+                    with self._tracer.span('ws.reconnect_wait', 'messages'):
+                        gevent.sleep(self._reconnect_backoff.next_delay())  # exponential backoff with jitter so that controllers don't all reconnect at once
+                self._connect_attempted = True
                 try:
-                    self._web_socket = self.connect_web_socket()
+                    with self._tracer.span('ws.connect', 'messages'):
+                        self._web_socket = self.connect_web_socket()
                     if self._web_socket:
+                        self._connections.inc()
+                        self._reconnect_backoff.reset()
+                        if replay_rate:
+                            self._replay_remaining = len(self._outgoing)
                         self.send_init_socket_messages()
-                    else:
-                        gevent.sleep(10)
                 except Exception as e:
                     logging.debug(str(e))
                     logging.warning('error connecting; will try again')
-                    gevent.sleep(10)  # let's not try to reconnect too often
 
-    # runs as a greenlet that maintains a periodically pings the web server to keep the websocket connection alive
+    # record tracing spans for the time the given queue entries spent in the queue (called after they are sent)
+    def trace_queue_residency(self, entries):
+        now = time.time()
+        for (lane, queued_time, message_struct) in entries:
+            self._tracer.record('ws.queued', queued_time, now, 'messages', {'type': message_struct.get('type'), 'lane': lane.name})
+
+    # pack as many queued messages (highest priority first, as allowed by the rate limits) as will fit within the frame
+    # size limit into a single newline-delimited frame; returns the frame (None if all messages were stale), the queue
+    # entries it covers, and the size of each entry (None for stale messages, which are discarded)
+    def build_frame(self, max_count=None):
+        max_frame_size = self._controller.settings.ws_max_frame_size
+        min_time = time.time() - 5 * 60
+        binary = self.codec.binary
+        pieces = []
+        frame_size = 0
+        entries = []
+        sizes = []
+        for entry in self._outgoing.take(max_count):
+            (lane, queued_time, message_struct) = entry
+            if queued_time > min_time:  # discard (don't send) messages older than 5 minutes
+                piece = self.codec.encode(message_struct)
+                if binary:
+                    size = len(piece)
+                else:
+                    piece += '\n'  # text messages are newline-delimited; binary messages are self-delimiting
+                    size = len(piece.encode('utf-8'))  # the frame limit is in bytes (text may contain non-ASCII characters)
+                if pieces and frame_size + size > max_frame_size:  # always send at least one message, even if it is over the limit
+                    break
+                pieces.append(piece)
+                frame_size += size
+                sizes.append(size)
+            else:
+                sizes.append(None)
+            entries.append(entry)
+        if not pieces:
+            return (None, entries, sizes)
+        return ((b'' if binary else '').join(pieces), entries, sizes)
+
+    # runs every second (as a scheduled task) to keep the websocket connection alive;
+    # sends timestamped ping frames at an adaptive interval to measure round-trip time and closes the connection
+    # if a ping isn't answered within the keepalive timeout (so that the sender will reconnect)
     def ping_web_socket(self):
-        while True:
-            gevent.sleep(45)
-            if self._web_socket:
-                self.send('ping', {})
+        link = self.web_socket_link
+        ws = self._web_socket
+        if not ws:
+            return
+        now = time.time()
+        if link.is_dead(now):
+            logging.warning('no response to websocket ping in %.1f seconds; reconnecting...' % link.timeout)
+            self._web_socket = None
+            try:
+                ws.terminate()  # unblocks the listener
+            except Exception as e:
+                logging.debug(str(e))
+            return
+        if now - link.ping_time() >= link.interval:
+            try:
+                ws.ping(link.ping_sent(now))
+            except (AttributeError, socket.error):
+                pass  # the sender/listener will handle the disconnect
+        if now - self._last_ping_message_time >= 45:  # the server also expects a periodic ping message
+            self.send('ping', {})
+            self._last_ping_message_time = now
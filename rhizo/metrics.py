@@ -0,0 +1,177 @@
+import bisect
+import logging
+
+
+# default histogram bucket upper bounds (in seconds) for round-trip times and request durations
+RTT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+# a value that only increases (e.g. a number of requests)
+class Counter(object):
+    kind = 'counter'
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+
+# a value that can go up or down (e.g. a queue length)
+class Gauge(object):
+    kind = 'gauge'
+
+    def __init__(self):
+        self.value = 0
+
+    def set(self, value):
+        self.value = value
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def dec(self, amount=1):
+        self.value -= amount
+
+
+# a counter or gauge whose value is obtained by calling a function (used for values the client already tracks,
+# so that collecting them doesn't add any work to the code being measured)
+class FunctionMetric(object):
+
+    def __init__(self, kind, function):
+        self.kind = kind
+        self._function = function
+
+    @property
+    def value(self):
+        return self._function()
+
+
+# a histogram with fixed bucket upper bounds; the last count is for values above the last bound
+class Histogram(object):
+    kind = 'histogram'
+
+    def __init__(self, buckets=RTT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def as_dict(self):
+        bounds = [str(bound) for bound in self.buckets] + ['inf']
+        return dict(zip(bounds, self.counts))
+
+
+# a metric that does nothing; returned by a disabled registry
+class NullMetric(object):
+    kind = None
+    value = 0
+
+    def inc(self, amount=1):
+        pass
+
+    def dec(self, amount=1):
+        pass
+
+    def set(self, value):
+        pass
+
+    def observe(self, value):
+        pass
+
+
+NULL_METRIC = NullMetric()
+
+
+# a set of named metrics; if not enabled, the registry hands out a shared no-op metric, so instrumented code
+# costs only a method call when metrics are disabled
+class Registry(object):
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self._metrics = {}  # metric objects by name
+        self._help = {}  # help text by metric name
+
+    def counter(self, name, help='', function=None):
+        return self.add(name, FunctionMetric('counter', function) if function else Counter(), help)
+
+    def gauge(self, name, help='', function=None):
+        return self.add(name, FunctionMetric('gauge', function) if function else Gauge(), help)
+
+    def histogram(self, name, help='', buckets=RTT_BUCKETS):
+        return self.add(name, Histogram(buckets), help)
+
+    # add a metric object (e.g. an existing Histogram) to the registry; returns the metric (or a no-op metric if disabled)
+    def add(self, name, metric, help=''):
+        if not self.enabled:
+            return NULL_METRIC
+        if name in self._metrics:  # e.g. if a client is re-created; keep the existing metric
+            return self._metrics[name]
+        self._metrics[name] = metric
+        self._help[name] = help
+        return metric
+
+    def get(self, name):
+        return self._metrics.get(name)
+
+    # get a dictionary of current counter and gauge values and histogram counts/sums
+    def snapshot(self):
+        values = {}
+        for name, metric in self._metrics.items():
+            if metric.kind == 'histogram':
+                values[name + '_count'] = metric.count
+                values[name + '_sum'] = metric.sum
+            else:
+                values[name] = metric.value
+        return values
+
+    # get the metrics in the Prometheus text exposition format
+    def render(self):
+        lines = []
+        for name in sorted(self._metrics):
+            metric = self._metrics[name]
+            if self._help[name]:
+                lines.append('# HELP %s %s' % (name, self._help[name]))
+            lines.append('# TYPE %s %s' % (name, metric.kind))
+            if metric.kind == 'histogram':
+                total = 0
+                for bound, count in zip(metric.buckets, metric.counts):
+                    total += count
+                    lines.append('%s_bucket{le="%s"} %d' % (name, bound, total))
+                lines.append('%s_bucket{le="+Inf"} %d' % (name, metric.count))
+                lines.append('%s_sum %s' % (name, metric.sum))
+                lines.append('%s_count %d' % (name, metric.count))
+            else:
+                lines.append('%s %s' % (name, metric.value))
+        return '\n'.join(lines) + '\n'
+
+
+# a registry for clients that aren't part of a controller
+NULL_REGISTRY = Registry(enabled=False)
+
+
+# serve a registry's metrics as text (e.g. for Prometheus) on a local HTTP port; returns the (started) server
+def serve_metrics(registry, port, host='127.0.0.1'):
+    from gevent.pywsgi import WSGIServer
+
+    def app(environ, start_response):
+        data = registry.render().encode()
+        start_response('200 OK', [('Content-Type', 'text/plain; version=0.0.4'), ('Content-Length', str(len(data)))])
+        return [data]
+
+    server = WSGIServer((host, port), app, log=None)
+    server.start()
+    logging.info('serving metrics on http://%s:%d/metrics' % (host, server.server_port))
+    return server
+
+
+# send metric values as sequences in the controller's status folder (scheduled by the controller; see metrics_publish_interval)
+def publish_metrics(controller):
+    status_folder = controller.path_on_server() + '/status'
+    values = dict((status_folder + '/' + name, value) for name, value in controller.metrics.snapshot().items())
+    controller.sequences.update_multiple(values)
@@ -0,0 +1,97 @@
+import time
+import logging
+from collections import OrderedDict
+import gevent
+from gevent.event import Event
+
+
+# collects errors reported by Controller.error and sends them to the configured error recipients (by email or SMS)
+# from a background greenlet; the first error after a quiet period is sent right away, then errors are collected for
+# the notification interval and sent as a single digest (at most one per interval per recipient); repeated errors
+# (same message and exception type) are counted rather than listed again
+class ErrorNotifier(object):
+
+    def __init__(self, controller):
+        self._controller = controller
+        self.interval = controller.config.get('error_notification_interval', 300)  # seconds
+        self.notification_count = 0
+        self._pending = OrderedDict()  # error info dictionaries by (message, exception type)
+        self._event = Event()  # set when an error is added
+        self._greenlet = None
+
+    # add an error to be sent in the next notification
+    def report(self, message=None, exception=None):
+        key = (message, type(exception).__name__ if exception else None)
+        error = self._pending.get(key)
+        now = time.time()
+        if error:
+            error['count'] += 1
+            error['last_time'] = now
+            error['exception'] = exception
+        else:
+            self._pending[key] = {'message': message, 'exception': exception, 'count': 1, 'first_time': now, 'last_time': now}
+        if not self._greenlet:
+            self._greenlet = gevent.spawn(self.sender)
+        self._event.set()
+
+    # number of distinct errors waiting to be sent
+    def pending(self):
+        return len(self._pending)
+
+    # runs as a greenlet that sends notifications, waiting at least the notification interval between them
+    def sender(self):
+        while True:
+            self._event.wait()
+            self._event.clear()
+            if self._pending:
+                self.send_notification()
+                gevent.sleep(self.interval)  # errors reported during this time go in the next notification
+
+    # send the pending errors to each recipient
+    def send_notification(self):
+        errors = list(self._pending.values())
+        self._pending = OrderedDict()
+        config = self._controller.config
+        subject = config.get('error_subject', 'system error')
+        if len(errors) > 1 or errors[0]['count'] > 1:
+            subject += ' (%d errors)' % sum(error['count'] for error in errors)
+        body = config.get('error_body', '').strip()
+        if body:
+            body += ' '
+        body += '\n\n'.join(self.describe(error) for error in errors)
+        short_body = self.describe(errors[0])
+        if len(errors) > 1:
+            short_body += ' (and %d other errors)' % (len(errors) - 1)
+        for recipient in config.get('error_recipients', []):
+            recipient = str(recipient)  # in case someone enters a phone number without quotes and it comes in as an integer
+            if '@' in recipient:
+                self._controller.messages.send_email(recipient, subject, body)
+            else:
+                self._controller.messages.send_sms(recipient, subject + ': ' + short_body)
+        self.notification_count += 1
+
+    # send any pending errors now (e.g. when shutting down)
+    def flush(self):
+        if self._pending:
+            self.send_notification()
+
+    # get a description of an error (with its count, if repeated)
+    def describe(self, error):
+        text = error['message'] or ''
+        if error['exception']:
+            text += '\n' + str(error['exception'])
+        if error['count'] > 1:
+            text += '\n(%d times; last at %s)' % (error['count'], time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(error['last_time'])))
+        return text.strip()
+
+
+# call a user-defined error handler, giving up if it takes longer than timeout seconds
+# (used to run handlers on their own greenlets so that they don't delay the caller)
+def run_error_handler(error_handler, message, exception, timeout):
+    try:
+        with gevent.Timeout(timeout):
+            error_handler(message=message, exception=exception)
+    except gevent.Timeout:
+        logging.warning('error handler %s timed out' % getattr(error_handler, '__name__', error_handler))
+    except Exception as e:
+        logging.warning('error in error handler: %s' % e)
@@ -0,0 +1,157 @@
+import struct
+import datetime
+
+
+# the packed sample format stores many sequence values for a single folder in one compact binary payload:
+#
+#   magic (2 bytes: 'RS'), format version (1 byte)
+#   base timestamp (8 bytes: signed little-endian microseconds since the unix epoch, UTC; negative before 1970)
+#   name count (varint), then each name (varint length, UTF-8 bytes)
+#   sample count (varint), then each sample:
+#       name index (varint), timestamp delta from previous sample in microseconds (zigzag varint), value type (1 byte), value
+#
+# value types: float32 (4 bytes), float64 (8 bytes), integer (zigzag varint), text (varint length, UTF-8 bytes);
+# floats are stored as float32 when that doesn't lose precision
+
+
+MAGIC = b'RS'
+VERSION = 1
+FLOAT32 = 0
+FLOAT64 = 1
+INTEGER = 2
+TEXT = 3
+EPOCH = datetime.datetime(1970, 1, 1)
+
+
+# returns True if the given payload is in the packed sample format
+def is_packed(data):
+    return isinstance(data, bytes) and data[:2] == MAGIC
+
+
+# pack a list of (sequence name, timestamp, value) tuples into a binary payload;
+# names should be relative to the folder/topic the payload is sent to; timestamps are naive UTC datetimes
+def pack_samples(samples):
+    names = {}
+    name_list = []
+    for (name, timestamp, value) in samples:
+        if name not in names:
+            names[name] = len(name_list)
+            name_list.append(name)
+    base_time = to_microseconds(samples[0][1]) if samples else 0
+    out = bytearray(MAGIC)
+    out.append(VERSION)
+    out += struct.pack('<q', base_time)
+    write_varint(out, len(name_list))
+    for name in name_list:
+        write_text(out, name)
+    write_varint(out, len(samples))
+    last_time = base_time
+    for (name, timestamp, value) in samples:
+        write_varint(out, names[name])
+        sample_time = to_microseconds(timestamp)
+        write_varint(out, zigzag(sample_time - last_time))
+        last_time = sample_time
+        if isinstance(value, bool):
+            value = int(value)
+        if isinstance(value, int):
+            out.append(INTEGER)
+            write_varint(out, zigzag(value))
+        elif isinstance(value, float):
+            try:
+                packed = struct.pack('<f', value)
+            except OverflowError:  # outside the float32 range
+                packed = None
+            if packed and struct.unpack('<f', packed)[0] == value:
+                out.append(FLOAT32)
+                out += packed
+            else:
+                out.append(FLOAT64)
+                out += struct.pack('<d', value)
+        else:
+            out.append(TEXT)
+            write_text(out, str(value))
+    return bytes(out)
+
+
+# unpack a binary payload into a list of (sequence name, timestamp, value) tuples
+def unpack_samples(data):
+    if not is_packed(data):
+        raise ValueError('not a packed sample payload')
+    data = bytearray(data)
+    if data[2] != VERSION:
+        raise ValueError('unsupported packed sample version: %d' % data[2])
+    last_time = struct.unpack_from('<q', data, 3)[0]
+    pos = 11
+    (name_count, pos) = read_varint(data, pos)
+    name_list = []
+    for i in range(name_count):
+        (name, pos) = read_text(data, pos)
+        name_list.append(name)
+    (sample_count, pos) = read_varint(data, pos)
+    samples = []
+    for i in range(sample_count):
+        (name_index, pos) = read_varint(data, pos)
+        (delta, pos) = read_varint(data, pos)
+        last_time += unzigzag(delta)
+        value_type = data[pos]
+        pos += 1
+        if value_type == FLOAT32:
+            value = struct.unpack_from('<f', data, pos)[0]
+            pos += 4
+        elif value_type == FLOAT64:
+            value = struct.unpack_from('<d', data, pos)[0]
+            pos += 8
+        elif value_type == INTEGER:
+            (value, pos) = read_varint(data, pos)
+            value = unzigzag(value)
+        elif value_type == TEXT:
+            (value, pos) = read_text(data, pos)
+        else:
+            raise ValueError('unknown packed value type: %d' % value_type)
+        samples.append((name_list[name_index], EPOCH + datetime.timedelta(microseconds=last_time), value))
+    return samples
+
+
+# ======== encoding helpers ========
+
+def to_microseconds(timestamp):
+    delta = timestamp - EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+
+
+def zigzag(n):
+    return n * 2 if n >= 0 else -n * 2 - 1
+
+
+def unzigzag(n):
+    return n // 2 if not n & 1 else -(n // 2) - 1
+
+
+def write_varint(out, n):
+    while n > 0x7f:
+        out.append((n & 0x7f) | 0x80)
+        n >>= 7
+    out.append(n)
+
+
+def read_varint(data, pos):
+    n = 0
+    shift = 0
+    while True:
+        b = data[pos]
+        pos += 1
+        n |= (b & 0x7f) << shift
+        if not b & 0x80:
+            return (n, pos)
+        shift += 7
+
+
+def write_text(out, text):
+    encoded = text.encode('utf-8')
+    write_varint(out, len(encoded))
+    out += encoded
+
+
+def read_text(data, pos):
+    (length, pos) = read_varint(data, pos)
+    return (bytes(data[pos:pos + length]).decode('utf-8'), pos + length)
@@ -0,0 +1,58 @@
+import time
+import logging
+from . import config
+from .controller import Controller, prep_logger
+from .transports import NetworkTransport
+from .scheduler import Scheduler
+
+
+# runs many controllers (each with its own secret key and folder on the server) in a single process;
+# the controllers share one gevent event loop, one transport (with a pool of keep-alive HTTP connections) and one
+# set of log handlers; each controller still has its own websocket/MQTT connection, since the server authenticates
+# message connections per controller; usage:
+#
+#     pool = ControllerPool({'server_name': 'example.com'})
+#     for key in secret_keys:
+#         pool.add({'secret_key': key})
+#     pool.wait_ready(timeout=60)
+class ControllerPool(object):
+
+    # base_configuration holds config entries shared by all controllers (e.g. server_name);
+    # transport defaults to a NetworkTransport that keeps up to max_idle_connections HTTP connections open
+    def __init__(self, base_configuration=None, transport=None, max_idle_connections=10, verbose=False):
+        self.config = config.Config(base_configuration or {})
+        self.transport = transport or NetworkTransport(max_idle_connections)
+        self.controllers = []
+        self.scheduler = Scheduler()  # runs periodic tasks for all of the controllers
+        self.log_file_handler = prep_logger(self.config, verbose or self.config.get('verbose', False))
+
+    # create a controller with the given config entries (combined with the base configuration);
+    # by default this returns without waiting for the controller to connect (see wait_ready)
+    def add(self, configuration, fast_start=True):
+        controller_config = dict(self.config)
+        controller_config.update(configuration)
+        controller = Controller(controller_config, transport=self.transport, fast_start=fast_start, pool=self)
+        self.controllers.append(controller)
+        return controller
+
+    # wait until all controllers are connected to the message server; returns the number of connected controllers
+    def wait_ready(self, timeout=None):
+        end_time = time.time() + timeout if timeout is not None else None
+        for controller in self.controllers:
+            controller.ready.wait(None if end_time is None else max(end_time - time.time(), 0))
+        ready_count = len([c for c in self.controllers if c.ready.is_set()])
+        if ready_count < len(self.controllers):
+            logging.warning('%d of %d pooled controllers connected' % (ready_count, len(self.controllers)))
+        return ready_count
+
+    # get a dictionary of pool statistics
+    def stats(self):
+        stats = {
+            'controllers': len(self.controllers),
+            'ready': len([c for c in self.controllers if c.ready.is_set()]),
+        }
+        connection_pool = getattr(self.transport, 'connection_pool', None)
+        if connection_pool:
+            stats['http_connections_created'] = connection_pool.created_count
+            stats['http_connections_reused'] = connection_pool.reused_count
+        return stats
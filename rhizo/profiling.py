@@ -0,0 +1,118 @@
+import time
+import marshal
+import logging
+import gevent
+
+
+# collects text written by pstats (which writes str on Python 2, so io.StringIO can't be used there)
+class TextBuffer(object):
+
+    def __init__(self):
+        self._parts = []
+
+    def write(self, text):
+        self._parts.append(text)
+
+    def getvalue(self):
+        return ''.join(self._parts)
+
+
+# runs CPU profiles (cProfile) and heap snapshots (tracemalloc) in a running controller for a bounded duration,
+# then uploads the results as files in the controller's folder on the server; started by the built-in profile_start,
+# profile_stop and heap_snapshot messages (see MessageClient.process_incoming_message) or by calling the methods directly;
+# note that cProfile measures the hub's thread, so time spent in other greenlets (and waiting) is included in the results
+class Profiler(object):
+
+    def __init__(self, controller):
+        self._controller = controller
+        self.max_duration = controller.config.get('profile_max_duration', 300)  # seconds
+        self._profile = None
+        self._profile_start_time = None
+        self._stop_greenlet = None
+        self._request_id = None
+        self._heap_greenlet = None
+
+    # start a CPU profile; it is stopped (and the results uploaded) after the given number of seconds or by calling stop()
+    def start(self, duration=30, request_id=None):
+        import cProfile
+        if self._profile:
+            logging.warning('profile already running')
+            return False
+        duration = min(float(duration), self.max_duration)
+        self._profile = cProfile.Profile()
+        self._profile_start_time = time.time()
+        self._request_id = request_id
+        self._profile.enable()
+        self._stop_greenlet = gevent.spawn_later(duration, self.stop)
+        logging.info('started CPU profile for %.1f seconds' % duration)
+        return True
+
+    # stop the current CPU profile and upload the results (a text summary and a pstats file); returns the summary path
+    def stop(self, limit=50):
+        import pstats
+        if not self._profile:
+            return None
+        self._profile.disable()
+        profile = self._profile
+        self._profile = None
+        if self._stop_greenlet and self._stop_greenlet is not gevent.getcurrent():
+            self._stop_greenlet.kill(block=False)
+        self._stop_greenlet = None
+        summary = TextBuffer()
+        summary.write('CPU profile: %.1f seconds\n\n' % (time.time() - self._profile_start_time))
+        stats = pstats.Stats(profile, stream=summary)
+        stats.sort_stats('cumulative').print_stats(limit)
+        profile.create_stats()
+        base_path = self.result_path('profile')
+        self._controller.files.write(base_path + '.prof', marshal.dumps(profile.stats))  # can be loaded with pstats
+        self._controller.files.write(base_path + '.txt', summary.getvalue())
+        self.send_result('cpu', base_path + '.txt', self._request_id)
+        return base_path + '.txt'
+
+    # record memory allocations for the given number of seconds (or use the current allocations if tracemalloc is
+    # already tracing), then upload the top allocation sites by size; frames is the traceback depth recorded per allocation
+    def heap_snapshot(self, duration=10, frames=1, limit=50, request_id=None):
+        try:
+            import tracemalloc
+        except ImportError:
+            logging.warning('heap snapshots require Python 3.4 or later')
+            return False
+        if self._heap_greenlet:
+            logging.warning('heap snapshot already running')
+            return False
+        self._heap_greenlet = gevent.spawn(self.take_heap_snapshot, min(float(duration), self.max_duration), min(int(frames), 25), limit, request_id)
+        return True
+
+    def take_heap_snapshot(self, duration, frames, limit, request_id):
+        import tracemalloc
+        try:
+            started = not tracemalloc.is_tracing()
+            if started:
+                tracemalloc.start(frames)
+                gevent.sleep(duration)
+            snapshot = tracemalloc.take_snapshot()
+            if started:
+                tracemalloc.stop()
+            total_size = sum(stat.size for stat in snapshot.statistics('filename'))
+            lines = ['heap snapshot: %.1f KB traced' % (total_size / 1024.0), '']
+            for stat in snapshot.statistics('traceback' if frames > 1 else 'lineno')[:limit]:
+                lines.append(str(stat))
+                if frames > 1:
+                    lines += ['    ' + line for line in stat.traceback.format()]
+            path = self.result_path('heap') + '.txt'
+            self._controller.files.write(path, '\n'.join(lines) + '\n')
+            self.send_result('heap', path, request_id)
+        finally:
+            self._heap_greenlet = None
+
+    # get a server path (without extension) for a result file
+    def result_path(self, prefix):
+        return '%s/%s-%s' % (self._controller.path_on_server(), prefix, time.strftime('%Y%m%d-%H%M%S'))
+
+    # let the server (and anyone who requested the profile) know that a result has been uploaded
+    def send_result(self, kind, path, request_id=None):
+        parameters = {'kind': kind, 'path': path}
+        if request_id:
+            parameters['response_to'] = request_id
+        self._controller.messages.send('profile_result', parameters)
+        logging.info('uploaded %s profile: %s' % (kind, path))
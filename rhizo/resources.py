@@ -1,15 +1,13 @@
 import os
+import time
 import gevent
 import base64
 import json
-import ssl
-import urllib
-try:
-    from httplib import HTTPConnection, HTTPSConnection
-except ModuleNotFoundError:
-    from http.client import HTTPConnection, HTTPSConnection
 import logging
 from io import StringIO
+from .transports import NetworkTransport, send_request  # send_request is imported here for backward compatibility
+from .metrics import NULL_REGISTRY
+from .tracing import NULL_TRACER
 
 
 # an exception type for API errors
@@ -56,8 +54,30 @@ class WriteFileWrapper(object):
 # the FileClient class is used to access the resource API provided by the server
 class FileClient(object):
 
-    # store information from configuration file
-    def __init__(self, config, controller = None):
+    # store information from configuration file; transport defaults to a NetworkTransport
+    def __init__(self, config, controller = None, transport = None):
+        self.apply_config(config)
+        self._enable_cache = config.get('enable_cache', False)
+        self._controller = controller
+        self._transport = transport or NetworkTransport()
+
+        # metrics (these are no-ops unless metrics are enabled in the controller config)
+        metrics = getattr(controller, 'metrics', NULL_REGISTRY)
+        self._request_counter = metrics.counter('rhizo_http_requests_total', 'resource API requests')
+        self._retry_counter = metrics.counter('rhizo_http_retries_total', 'resource API request retries')
+        self._error_counter = metrics.counter('rhizo_http_errors_total', 'resource API requests that failed')
+        self._request_time = metrics.histogram('rhizo_http_request_seconds', 'resource API request time (including retries)')
+        self._tracer = getattr(controller, 'tracer', NULL_TRACER)
+
+        # some aliases for compatibility
+        self.list_files = self.list
+        self.file_exists = self.exists
+        self.file_info = self.info
+        self.read_file = self.read
+        self.write_file = self.write
+
+    # set the server name, secret key and connection options from the config (also used when the config is reloaded)
+    def apply_config(self, config):
         if 'secret_key' in config:
             self._secret_key = config.secret_key
         else:
@@ -74,15 +94,6 @@ class FileClient(object):
         else:
             host_name = config.server_name.split(':')[0]
             self._secure_server = host_name != 'localhost' and host_name != '127.0.0.1'
-        self._enable_cache = config.get('enable_cache', False)
-        self._controller = controller
-
-        # some aliases for compatibility
-        self.list_files = self.list
-        self.file_exists = self.exists
-        self.file_info = self.info
-        self.read_file = self.read
-        self.write_file = self.write
 
     # get a list of files from the server;
     # each item in the list is a dictionary with the resource name and other meta-data
@@ -224,6 +235,8 @@ class FileClient(object):
             params = {}
         accept_type = 'application/octet-stream' if accept_binary else 'text/plain'
         retry_count = 0
+        start_time = time.time()
+        self._request_counter.inc()
 
         # prepare authentication
         if self._controller:  # fix(later): revisit this: can we still get a version/build if using stand-alone resource client?
@@ -238,12 +251,13 @@ class FileClient(object):
             try:
 
                 # if the request is valid, we can go ahead and return the data
-                (status, reason, data) = send_request(self._server_name, method, path, params, self._secure_server, accept_type, basic_auth, self._ssl_skip_verify)
+                (status, reason, data) = self._transport.send_request(self._server_name, method, path, params, self._secure_server, accept_type, basic_auth, self._ssl_skip_verify)
                 if status == 200:
                     break
                 err_text = '%d %s' % (status, reason)
             except Exception as e:  # fix(clean): the goal here is to catch errors in conn.getresponse() or response.read(); maybe we should move send_request code into this function and just try those two lines
                 if retry_count > 100:  # if we've already retried many times, give up
+                    self._error_counter.inc()
                     raise e
                 logging.debug('exception: %s' % e)
                 err_text = str(e)
@@ -251,43 +265,22 @@ class FileClient(object):
 
             # if there's a problem with the request (e.g. 400/403/404) or we've already retried many times, raise an error
             if status and (status < 500 or retry_count > 100):
+                self._error_counter.inc()
                 raise ApiError(status, reason, data)
 
             # try again in 10 seconds
             logging.info('retrying %s %s; error: %s' % (method, path, err_text))
             gevent.sleep(10)
             retry_count += 1
+            self._retry_counter.inc()
 
         # if request was successful (status 200), return the data
+        end_time = time.time()
+        self._request_time.observe(end_time - start_time)
+        self._tracer.record('http.request', start_time, end_time, 'http', {'method': method, 'path': path, 'retries': retry_count})
         return data
 
 
 # temporary alias for backward compatibility
 ResourceClient = FileClient
 
-
-# send an HTTP request to a server;
-# returns response tuple: (response status, response reason, response data)
-def send_request(server, method, path, params, secure = True, accept_type = 'text/plain', basic_auth = None, ssl_skip_verify = False):
-    headers = {
-        'Content-type': 'application/x-www-form-urlencoded',
-        'Accept': accept_type,
-    }
-    if basic_auth:
-        headers['Authorization'] = 'Basic %s' % basic_auth
-    try:
-        params = urllib.urlencode(params)
-    except:  # python 3
-        params = urllib.parse.urlencode(params)
-    if secure:
-        if ssl_skip_verify:
-            conn = HTTPSConnection(server, context=ssl._create_unverified_context())
-        else:
-            conn = HTTPSConnection(server)
-    else:
-        conn = HTTPConnection(server)
-    conn.request(method, path, params, headers)
-    response = conn.getresponse()
-    data = response.read()
-    conn.close()
-    return (response.status, response.reason, data)
@@ -0,0 +1,146 @@
+import time
+import heapq
+import random
+import logging
+import itertools
+import gevent
+from gevent.event import Event
+
+
+# a function that a Scheduler calls periodically; runs are scheduled at fixed multiples of the interval from the first
+# run (so they don't drift by the time spent running the function); if a run is still going when the next one is due,
+# the next one is skipped (and counted) rather than letting runs pile up
+class ScheduledTask(object):
+
+    def __init__(self, function, interval, name, error_handler):
+        self.function = function
+        self.interval = interval  # seconds
+        self.name = name
+        self.next_time = None  # when the next run is due (seconds since the epoch)
+        self.cancelled = False
+        self.run_count = 0
+        self.error_count = 0
+        self.overrun_count = 0  # runs that took longer than the interval
+        self.skip_count = 0  # runs skipped because the previous run hadn't finished (or the scheduler was blocked)
+        self.total_time = 0.0  # seconds spent running the function
+        self.max_time = 0.0
+        self.max_lateness = 0.0  # largest delay between when a run was due and when it started
+        self._error_handler = error_handler
+        self._greenlet = None
+        self._start_time = None
+
+    # stop running the task (a run in progress is allowed to finish)
+    def cancel(self):
+        self.cancelled = True
+
+    def running(self):
+        return self._greenlet is not None and not self._greenlet.dead
+
+    # start a run on its own greenlet (so a slow task doesn't delay the others)
+    def start(self, due_time):
+        if self.running():
+            self.skip_count += 1
+            logging.warning('scheduled task %s is still running after %.1f seconds; skipping this run' % (self.name, time.time() - self._start_time))
+            return
+        self._greenlet = gevent.spawn(self.run, due_time)
+
+    def run(self, due_time):
+        self._start_time = time.time()
+        self.max_lateness = max(self.max_lateness, self._start_time - due_time)
+        try:
+            self.function()
+        except Exception as e:
+            self.error_count += 1
+            self._error_handler('error in scheduled task %s' % self.name, e)
+        duration = time.time() - self._start_time
+        self.run_count += 1
+        self.total_time += duration
+        self.max_time = max(self.max_time, duration)
+        if duration > self.interval:
+            self.overrun_count += 1
+
+    # kill a run in progress
+    def kill(self):
+        if self._greenlet:
+            self._greenlet.kill(block=False)
+
+    def stats(self):
+        return {
+            'interval': self.interval,
+            'runs': self.run_count,
+            'errors': self.error_count,
+            'overruns': self.overrun_count,
+            'skipped': self.skip_count,
+            'mean_time': self.total_time / self.run_count if self.run_count else 0.0,
+            'max_time': self.max_time,
+            'max_lateness': self.max_lateness,
+        }
+
+
+# runs periodic tasks from a single greenlet using a heap of next run times; use Controller.schedule to add tasks;
+# a task's first run can be offset by a random fraction of its interval (jitter), so that controllers that start at
+# the same time (e.g. after a fleet-wide restart or power outage) spread out their periodic uploads
+class Scheduler(object):
+
+    def __init__(self, error_handler=None, metrics=None):
+        self._heap = []  # (next run time, sequence number, task) tuples
+        self._sequence = itertools.count()  # breaks ties between tasks due at the same time
+        self._wakeup = Event()  # set when a task is added (so the scheduler can recompute its sleep time)
+        self._greenlet = None
+        self._random = random.Random()
+        self._error_handler = error_handler or (lambda message, exception: logging.warning('%s: %s' % (message, exception)))
+        self.tasks = []
+        if metrics:
+            metrics.counter('rhizo_scheduler_runs_total', 'scheduled task runs', lambda: sum(t.run_count for t in self.tasks))
+            metrics.counter('rhizo_scheduler_overruns_total', 'scheduled task runs that took longer than their interval', lambda: sum(t.overrun_count for t in self.tasks))
+            metrics.counter('rhizo_scheduler_skipped_total', 'scheduled task runs skipped because the previous run was still going', lambda: sum(t.skip_count for t in self.tasks))
+
+    # call a function every interval seconds; the first call is after delay seconds (default: one interval) plus a random
+    # offset of up to jitter times the interval (jitter is a fraction from 0 to 1); note that the jitter is added to the
+    # delay, so use delay=0 with jitter=1.0 to make the first call within one interval; returns a ScheduledTask
+    def schedule(self, function, interval, jitter=0.0, delay=None, name=None):
+        task = ScheduledTask(function, interval, name or getattr(function, '__name__', 'task'), self._error_handler)
+        task.next_time = time.time() + (interval if delay is None else delay) + self._random.uniform(0, jitter * interval)
+        self.tasks.append(task)
+        heapq.heappush(self._heap, (task.next_time, next(self._sequence), task))
+        if not self._greenlet:
+            self._greenlet = gevent.spawn(self.run)
+        self._wakeup.set()
+        return task
+
+    # runs as a greenlet that starts each task when it is due
+    def run(self):
+        while True:
+            if not self._heap:
+                self._wakeup.clear()
+                self._wakeup.wait()
+                continue
+            (due_time, sequence, task) = self._heap[0]
+            now = time.time()
+            if due_time > now:
+                self._wakeup.clear()
+                self._wakeup.wait(due_time - now)  # returns early if a task is added
+                continue
+            heapq.heappop(self._heap)
+            if task.cancelled:
+                self.tasks.remove(task)
+                continue
+            task.start(due_time)
+            task.next_time = due_time + task.interval
+            if task.next_time <= now:  # we're more than an interval behind (e.g. the event loop was blocked); skip missed runs
+                missed = int((now - task.next_time) / task.interval) + 1
+                task.skip_count += missed
+                task.next_time += missed * task.interval
+            heapq.heappush(self._heap, (task.next_time, next(self._sequence), task))
+
+    # get a dictionary of task statistics by task name
+    def stats(self):
+        return dict((task.name, task.stats()) for task in self.tasks)
+
+    # stop the scheduler and any task runs in progress
+    def stop(self):
+        if self._greenlet:
+            self._greenlet.kill(block=False)
+            self._greenlet = None
+        for task in self.tasks:
+            task.kill()
@@ -1,14 +1,24 @@
+import os
 import json
+import time
 import logging
 import datetime
 import gevent
-from collections import defaultdict
+from collections import defaultdict, deque
 from itertools import groupby
+from . import packing
+from .util import parse_json_datetime
+from .metrics import NULL_REGISTRY
+from .tracing import NULL_TRACER
 
 
 data_types = {'numeric': 1, 'text': 2, 'image': 3}
 
 
+# incoming message types that carry sequence values (see SequenceClient.receive_message)
+UPDATE_MESSAGE_TYPES = ('sequence_update', 'update', 's')
+
+
 class SequenceClient(object):
 
     def __init__(self, controller):
@@ -17,6 +27,19 @@ class SequenceClient(object):
         self._timestamps = {}
         self._exists_on_server = defaultdict(bool)
         self._local_seq_files = {}
+        self._pending_samples = {}  # samples waiting to be sent in packed MQTT messages, by folder path
+        self._flush_greenlet = None
+        self._subscriptions = {}  # cache key (the path passed to subscribe) by absolute path of each subscribed sequence
+        self._subscribed_folders = set()
+        self._history = {}  # recent (timestamp, value) tuples by cache key, for sequences subscribed with history
+
+        # metrics (these are no-ops unless metrics are enabled in the controller config)
+        metrics = getattr(controller, 'metrics', NULL_REGISTRY)
+        self._tracer = getattr(controller, 'tracer', NULL_TRACER)
+        self._update_counter = metrics.counter('rhizo_sequence_updates_total', 'sequence values sent (by update or update_multiple)')
+        self._received_counter = metrics.counter('rhizo_sequence_values_received_total', 'values received for subscribed sequences')
+        metrics.gauge('rhizo_packed_samples_pending', 'sequence values waiting to be sent in packed MQTT messages',
+                      lambda: sum(len(samples) for samples in self._pending_samples.values()))
 
     # fix(soon): merge with update() function below
     def update_value(self, relative_sequence_path, value, timestamp=None):
@@ -54,55 +77,161 @@ class SequenceClient(object):
                 c.files.send_request_to_server('POST', '/api/v1/resources', sequence_info)
             self._exists_on_server[seq_path] = True
 
+    # get the latest value of a sequence: one set with update_value or, for a subscribed sequence (see subscribe),
+    # the latest value received from the server (None if no value has been received yet)
     def value(self, relative_sequence_path):
         return self._values.get(relative_sequence_path)
 
+    # get the timestamp (UTC) of the latest value of a sequence (if known)
+    def timestamp(self, relative_sequence_path):
+        return self._timestamps.get(relative_sequence_path)
+
+    # get a list of recent (timestamp, value) tuples for a sequence subscribed with history > 0 (oldest first)
+    def history(self, relative_sequence_path):
+        return list(self._history.get(relative_sequence_path, ()))
+
+    # keep local copies of the latest values of the given sequences (paths relative to this controller or absolute),
+    # updated by messages from the server, so that value() doesn't need a server request; if history is greater than zero,
+    # the most recent history values of each sequence are also kept (see history()); subscriptions are per folder and
+    # are renewed when the message connection reconnects
+    def subscribe(self, sequence_paths, history=0):
+        if isinstance(sequence_paths, str):
+            sequence_paths = [sequence_paths]
+        new_folders = set()
+        for path in sequence_paths:
+            full_path = path if path.startswith('/') else self._controller.path_on_server() + '/' + path
+            self._subscriptions[full_path] = path
+            if history:
+                self._history[path] = deque(self._history.get(path, ()), maxlen=history)
+            folder = full_path.rsplit('/', 1)[0]
+            if folder not in self._subscribed_folders:
+                self._subscribed_folders.add(folder)
+                new_folders.add(folder)
+        if new_folders:
+            self._controller.messages.subscribe_folders(sorted(new_folders))
+
+    # stop updating local copies of the given sequences (and discard the local copies); folders that no longer contain
+    # any subscribed sequences are unsubscribed
+    def unsubscribe(self, sequence_paths):
+        if isinstance(sequence_paths, str):
+            sequence_paths = [sequence_paths]
+        for path in sequence_paths:
+            full_path = path if path.startswith('/') else self._controller.path_on_server() + '/' + path
+            key = self._subscriptions.pop(full_path, None)
+            if key is not None:
+                self._values.pop(key, None)
+                self._timestamps.pop(key, None)
+                self._history.pop(key, None)
+        used_folders = set(full_path.rsplit('/', 1)[0] for full_path in self._subscriptions)
+        unused_folders = self._subscribed_folders - used_folders
+        if unused_folders:
+            self._subscribed_folders = used_folders
+            self._controller.messages.unsubscribe_folders(sorted(unused_folders))
+
+    # get the folders containing subscribed sequences
+    def subscribed_folders(self):
+        return sorted(self._subscribed_folders)
+
+    # store a value received for a sequence (ignored if we're not subscribed to the sequence); returns True if stored
+    def receive_value(self, full_path, value, timestamp=None):
+        key = self._subscriptions.get(full_path)
+        if key is None:
+            return False
+        if isinstance(timestamp, str) and timestamp.endswith('Z'):
+            timestamp = parse_json_datetime(timestamp)
+        self._values[key] = value
+        self._timestamps[key] = timestamp
+        history = self._history.get(key)
+        if history is not None:
+            history.append((timestamp, value))
+        self._received_counter.inc()
+        return True
+
+    # handle an incoming message (one of UPDATE_MESSAGE_TYPES) with values for sequences in the given folder:
+    # sequence_update messages (sent by the server to folder subscribers), multi-sequence update messages,
+    # and simple "s,<name>,<timestamp>,<value>" messages (sent by other controllers over MQTT)
+    def receive_message(self, message_type, parameters, folder):
+        if message_type == 'sequence_update':
+            full_path = parameters.get('path') or folder + '/' + parameters['name']
+            self.receive_value(full_path, parameters.get('value'), parameters.get('timestamp'))
+        elif message_type == 'update':
+            timestamp = parameters.get('$t')
+            for (name, value) in parameters.items():
+                if name != '$t':
+                    self.receive_value(folder + '/' + name, value, timestamp)
+        elif message_type == 's':
+            (name, timestamp, value) = parameters.split(',', 2)
+            self.receive_value(folder + '/' + name, value, timestamp)
+
+    # handle an incoming packed MQTT message with values for sequences in the given folder
+    def receive_packed_samples(self, folder, data):
+        for (name, timestamp, value) in packing.unpack_samples(data):
+            self.receive_value(folder + '/' + name, value, timestamp)
+
     # send a new sequence value to the server
     def update(self, sequence_name, value, use_websocket=True):
-        if self._controller.config.get('enable_server', True):
-            if sequence_name.startswith('/'):
-                full_path = sequence_name
-            else:
-                full_path = self._controller.path_on_server() + '/' + sequence_name
-            if use_websocket:
-                if self._controller.config.get('mqtt_host'):
-                    timestamp = datetime.datetime.utcnow()
-                    (path, rel_name) = full_path.rsplit('/', 1)
-                    message = 's,%s,%s Z,%s' % (rel_name, timestamp.isoformat(), value)
-                    self._controller.messages.send_simple(path, message)  # expects absolute path
+        self._update_counter.inc()
+        settings = self._controller.settings
+        with self._tracer.span('sequence.update', 'sequences', sequence=sequence_name):
+            if settings.enable_server:
+                if sequence_name.startswith('/'):
+                    full_path = sequence_name
                 else:
-                    self._controller.messages.send('update_sequence', {'sequence': sequence_name, 'value': value})
-            else:  # note that this case currently requires an absolute path on the server
-                value = str(value)  # write_file currently expects string values
-                i = 0
-                while True:  # repeat until verified that value is written; note: this isn't really needed since lower level code will retry if error
-                    self._controller.files.write_file(full_path, value)
-                    server_value = self._controller.files.read_file(full_path).decode()
-                    if value == server_value:
-                        break
-                    i += 1
-                    if i == 10:
-                        logging.warning('unable to verify sequence update; retrying...')
-                    gevent.sleep(0.5)
-        if self._controller.config.get('enable_local_sequence_storage', False):
-            self.store_local_sequence_value(sequence_name, value)
+                    full_path = self._controller.path_on_server() + '/' + sequence_name
+                if use_websocket:
+                    if settings.mqtt_host:
+                        timestamp = datetime.datetime.utcnow()
+                        (path, rel_name) = full_path.rsplit('/', 1)
+                        if settings.mqtt_packed_samples:
+                            self.queue_packed_sample(path, rel_name, timestamp, value)
+                        elif self._controller.messages.codec.binary:  # binary codecs don't use the simple text format; send a multi-sequence update message
+                            message = {'update': {'$t': timestamp.isoformat() + ' Z', rel_name: value}}
+                            self._controller.messages.send_simple(path, message)  # expects absolute path
+                        else:
+                            message = 's,%s,%s Z,%s' % (rel_name, timestamp.isoformat(), value)
+                            self._controller.messages.send_simple(path, message)  # expects absolute path
+                    else:
+                        self._controller.messages.send('update_sequence', {'sequence': sequence_name, 'value': value})
+                else:  # note that this case currently requires an absolute path on the server
+                    value = str(value)  # write_file currently expects string values
+                    i = 0
+                    while True:  # repeat until verified that value is written; note: this isn't really needed since lower level code will retry if error
+                        self._controller.files.write_file(full_path, value)
+                        server_value = self._controller.files.read_file(full_path).decode()
+                        if value == server_value:
+                            break
+                        i += 1
+                        if i == 10:
+                            logging.warning('unable to verify sequence update; retrying...')
+                        gevent.sleep(0.5)
+            if settings.enable_local_sequence_storage:
+                self.store_local_sequence_value(sequence_name, value)
 
     # update multiple sequences; timestamp must be UTC (or None)
     # values should be a dictionary of sequence values by path (relative or absolute)
     def update_multiple(self, values, timestamp=None, use_message=True):
         if not timestamp:
             timestamp = datetime.datetime.utcnow()
+        self._update_counter.inc(len(values))
 
-        # make sure all paths are absolute and all values are strings
+        # make sure all paths are absolute and all values are strings (unless sending packed samples)
+        packed = use_message and self._controller.settings.mqtt_packed_samples
         controller_path = self._controller.path_on_server()
         send_values = {}
         for name, value in values.items():
             if not name.startswith('/'):
                 name = controller_path + '/' + name
-            send_values[name] = str(value)
+            send_values[name] = value if packed else str(value)
+
+        # send a packed MQTT message per folder
+        if packed:
+            all_paths = sorted(list(send_values.keys()))
+            for folder, paths in groupby(all_paths, lambda path: path.rsplit('/', 1)[0]):
+                samples = [(path.rsplit('/', 1)[1], timestamp, send_values[path]) for path in paths]
+                self._controller.messages.send_simple(folder, packing.pack_samples(samples))
 
         # send a new-style multi-sequence update message, one message per folder
-        if use_message:
+        elif use_message:
             all_paths = sorted(list(send_values.keys()))
             for folder, paths in groupby(all_paths, lambda path: path.rsplit('/', 1)[0]):
                 params = {'$t': timestamp.isoformat() + ' Z'}
@@ -119,8 +248,43 @@ class SequenceClient(object):
             }
             self._controller.files.send_request_to_server('PUT', '/api/v1/resources', params)
 
+    # add a sample to the buffer of values to be sent as a packed MQTT message for the given folder;
+    # the buffer is sent once it is full or after the configured packing interval
+    def queue_packed_sample(self, folder, name, timestamp, value):
+        settings = self._controller.settings
+        samples = self._pending_samples.setdefault(folder, [])
+        samples.append((name, timestamp, value))
+        if len(samples) >= settings.mqtt_pack_max_samples:
+            self.flush_packed_samples(folder)
+        elif not self._flush_greenlet:
+            self._flush_greenlet = gevent.spawn_later(settings.mqtt_pack_interval, self.flush_packed_samples)
+
+    # send buffered samples for the given folder (or all folders) as packed MQTT messages
+    def flush_packed_samples(self, folder=None):
+        if folder is None:
+            self._flush_greenlet = None
+            folders = list(self._pending_samples.keys())
+        else:
+            folders = [folder]
+        for folder in folders:
+            samples = self._pending_samples.pop(folder, None)
+            if samples:
+                self._controller.messages.send_simple(folder, packing.pack_samples(samples))
+
     # stores a sequence value in a local log file (an alternative to sending the value to the server)
     def store_local_sequence_value(self, sequence_name, value):
         if sequence_name not in self._local_seq_files:
-            self._local_seq_files[sequence_name] = open('log/%s.csv', sequence_name, 'a')
-        self._local_seq_files[sequence_name].write('%.3f,%.3f\n' % (time.time(), value))  # fix(soon): better timestamps, decimal places
+            file_name = 'logs/%s.csv' % sequence_name.lstrip('/')
+            if not os.path.isdir(os.path.dirname(file_name)):
+                os.makedirs(os.path.dirname(file_name))
+            self._local_seq_files[sequence_name] = open(file_name, 'a')
+        self._local_seq_files[sequence_name].write('%.3f,%s\n' % (time.time(), value))  # fix(soon): better timestamps, decimal places
+
+    # send any buffered packed samples and close local sequence files
+    def close(self):
+        if self._flush_greenlet:
+            self._flush_greenlet.kill(block=False)
+        self.flush_packed_samples()
+        for seq_file in self._local_seq_files.values():
+            seq_file.close()
+        self._local_seq_files = {}
@@ -0,0 +1,184 @@
+import time
+from collections import deque, OrderedDict
+
+
+# message classes, which are also the names of the outgoing priority lanes (highest priority first); message types are
+# mapped to classes in messages.py; callers can also send messages in the bulk class (e.g. backfilled data)
+CONTROL = 'control'
+ALERTS = 'alerts'
+TELEMETRY = 'telemetry'
+BULK = 'bulk'
+LANES = (CONTROL, ALERTS, TELEMETRY, BULK)
+
+
+# a token bucket rate limiter: allows rate operations per second on average, with bursts of up to burst operations;
+# a rate of 0 means no limit
+class TokenBucket(object):
+
+    def __init__(self, rate=0, burst=None):
+        self.set_rate(rate, burst)
+
+    def set_rate(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst or max(rate, 1)
+        self._tokens = self.burst
+        self._update_time = time.time()
+
+    def refill(self):
+        now = time.time()
+        self._tokens = min(self.burst, self._tokens + (now - self._update_time) * self.rate)
+        self._update_time = now
+
+    # get the number of operations allowed now (None if there is no limit)
+    def available(self):
+        if not self.rate:
+            return None
+        self.refill()
+        return max(int(self._tokens), 0)
+
+    # get the number of seconds until count operations are allowed
+    def wait_time(self, count=1):
+        if not self.rate:
+            return 0.0
+        self.refill()
+        return max(count - self._tokens, 0) / float(self.rate)
+
+    # use tokens for count operations; this can leave the bucket in debt (e.g. for control messages, which aren't held back)
+    def consume(self, count=1):
+        if self.rate:
+            self.refill()
+            self._tokens -= count
+
+
+# a first-in first-out queue of messages in one priority class, with throughput and queue wait statistics
+class Lane(object):
+
+    def __init__(self, name):
+        self.name = name
+        self.entries = deque()  # (queued time, item) tuples
+        self.sent_count = 0
+        self.sent_bytes = 0
+        self.discard_count = 0  # messages removed without being sent (e.g. stale messages)
+        self.total_wait = 0.0  # seconds spent in the queue by sent messages
+        self.max_wait = 0.0
+
+    def stats(self):
+        return {
+            'queued': len(self.entries),
+            'sent': self.sent_count,
+            'sent_bytes': self.sent_bytes,
+            'discarded': self.discard_count,
+            'mean_wait': self.total_wait / self.sent_count if self.sent_count else 0.0,
+            'max_wait': self.max_wait,
+        }
+
+
+# outgoing messages in priority lanes (see LANES); messages are taken from the highest priority lane that has any,
+# so control messages (pings, subscriptions) and alerts aren't delayed by a backlog of telemetry, and bulk messages are
+# only sent when nothing else is waiting; all lanes share a token bucket (e.g. to stay within a server's message rate
+# limit), but control messages are never held back by it (they still use tokens); the bulk lane can also have its own
+# lower rate; items are taken with take() and removed (once sent) with remove()
+class OutgoingLanes(object):
+
+    def __init__(self, rate=0, burst=None, bulk_rate=0, metrics=None):
+        self.lanes = OrderedDict((name, Lane(name)) for name in LANES)
+        self.bucket = TokenBucket(rate, burst)
+        self.bulk_bucket = TokenBucket(bulk_rate)
+        self._length = 0
+        if metrics:
+            for lane in self.lanes.values():
+                self.add_metrics(metrics, lane)
+
+    # register metrics for a lane (read from the lane's statistics when collected)
+    def add_metrics(self, metrics, lane):
+        prefix = 'rhizo_lane_%s_' % lane.name
+        metrics.counter(prefix + 'messages_total', '%s messages sent' % lane.name, lambda: lane.sent_count)
+        metrics.counter(prefix + 'bytes_total', '%s message bytes sent' % lane.name, lambda: lane.sent_bytes)
+        metrics.counter(prefix + 'wait_seconds_total', 'time spent queued by sent %s messages' % lane.name, lambda: lane.total_wait)
+        metrics.gauge(prefix + 'queue_length', '%s messages waiting to be sent' % lane.name, lambda: len(lane.entries))
+
+    def set_rates(self, rate=0, burst=None, bulk_rate=0):
+        self.bucket.set_rate(rate, burst)
+        self.bulk_bucket.set_rate(bulk_rate)
+
+    def __len__(self):
+        return self._length
+
+    # add an item to a lane (telemetry if the lane name isn't recognized); if prepend is True, it goes at the front of the lane
+    def put(self, item, lane_name=TELEMETRY, prepend=False):
+        lane = self.lanes.get(lane_name) or self.lanes[TELEMETRY]
+        if prepend:
+            lane.entries.appendleft((time.time(), item))
+        else:
+            lane.entries.append((time.time(), item))
+        self._length += 1
+
+    # returns True if a message in the given lane could be sent now (assuming nothing ahead of it)
+    def ready(self, lane_name):
+        if lane_name == CONTROL:
+            return True
+        if lane_name == BULK and self.bulk_bucket.available() == 0:
+            return False
+        return self.bucket.available() != 0
+
+    # get the number of seconds until the next queued message can be sent (0 if it can be sent now or nothing is queued)
+    def wait_time(self):
+        for lane in self.lanes.values():
+            if lane.entries:
+                if lane.name == CONTROL:
+                    return 0.0
+                wait_time = self.bucket.wait_time()
+                if lane.name == BULK:
+                    wait_time = max(wait_time, self.bulk_bucket.wait_time())
+                return wait_time
+        return 0.0
+
+    # get up to max_count queued (lane, queued time, item) entries, in the order they should be sent, that are allowed
+    # by the rate limits; the entries stay queued until passed to remove()
+    def take(self, max_count=None):
+        entries = []
+        allowed = self.bucket.available()  # None if there is no limit
+        bulk_allowed = self.bulk_bucket.available()
+        for lane in self.lanes.values():
+            for (queued_time, item) in lane.entries:
+                if max_count is not None and len(entries) >= max_count:
+                    return entries
+                if lane.name != CONTROL:
+                    if allowed == 0 or (lane.name == BULK and bulk_allowed == 0):
+                        return entries  # the lower priority lanes share the limit
+                    if allowed is not None:
+                        allowed -= 1
+                    if lane.name == BULK and bulk_allowed is not None:
+                        bulk_allowed -= 1
+                entries.append((lane, queued_time, item))
+        return entries
+
+    # remove entries (from take()) after sending them; sizes gives the number of bytes sent for each entry
+    # (None for entries that were discarded rather than sent); updates the lane statistics and rate limits
+    def remove(self, entries, sizes):
+        for ((lane, queued_time, item), size) in zip(entries, sizes):
+            entry = (queued_time, item)
+            if lane.entries and lane.entries[0] == entry:
+                lane.entries.popleft()
+            else:  # e.g. if something was prepended to the lane while sending
+                lane.entries.remove(entry)
+            self._length -= 1
+            if size is None:
+                lane.discard_count += 1
+            else:
+                self.record(lane.name, size, time.time() - queued_time)
+
+    # update statistics and rate limits for a message that has been sent (used directly for messages that weren't queued)
+    def record(self, lane_name, size, wait=0.0):
+        lane = self.lanes.get(lane_name) or self.lanes[TELEMETRY]
+        lane.sent_count += 1
+        lane.sent_bytes += size
+        lane.total_wait += wait
+        lane.max_wait = max(lane.max_wait, wait)
+        self.bucket.consume()
+        if lane.name == BULK:
+            self.bulk_bucket.consume()
+
+    # get a dictionary of statistics for each lane
+    def stats(self):
+        return dict((name, lane.stats()) for (name, lane) in self.lanes.items())
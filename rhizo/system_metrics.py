@@ -0,0 +1,121 @@
+import gc
+import time
+import logging
+from greenlet import greenlet
+
+
+# metric groups that can be listed in the system_metrics config entry
+ALL_GROUPS = ('cpu', 'cores', 'memory', 'swap', 'network', 'disk', 'disk_io', 'process', 'greenlets')
+DEFAULT_GROUPS = ('cpu', 'disk')
+
+
+# compute min/mean/max/p95 (nearest rank) for a list of values
+def summarize(values):
+    values = sorted(values)
+    count = len(values)
+    return {
+        'min': values[0],
+        'mean': sum(values) / float(count),
+        'max': values[-1],
+        'p95': values[int(0.95 * (count - 1) + 0.5)],
+    }
+
+
+# samples system metrics (using psutil) at a high rate and publishes aggregates to the controller's status folder
+# once per window; each metric is published as <name>_min, <name>_mean, <name>_max and <name>_p95 sequences
+# (processor_usage and disk_usage are also published as plain means, as sent by earlier versions)
+class SystemMonitor(object):
+
+    def __init__(self, controller):
+        import psutil  # imported here to keep startup fast
+        self._psutil = psutil
+        self._controller = controller
+        config = controller.config
+        self.groups = config.get('system_metrics', DEFAULT_GROUPS)
+        self.sample_interval = config.get('system_metrics_sample_interval', 10)
+        self.publish_interval = config.get('system_metrics_publish_interval', 30 * 60)
+        self._samples = {}  # list of sampled values by metric name
+        self._last_counters = {}  # previous cumulative counter values (used to compute rates)
+        self._last_sample_time = None
+        self._process = psutil.Process()
+        psutil.cpu_percent(percpu='cores' in self.groups)  # first call primes the CPU usage measurement
+
+    # schedule sampling and publishing using the controller's scheduler; the first sample is taken shortly after startup;
+    # the first publish comes after the first sample plus a random offset of up to one publish interval, so that a fleet
+    # of controllers doesn't publish in sync
+    def start(self):
+        self._controller.schedule(self.sample_and_record, self.sample_interval, delay=15, name='system_metrics_sample')
+        self._controller.schedule(self.publish, self.publish_interval, jitter=1.0, delay=15, name='system_metrics_publish')
+
+    def sample_and_record(self):
+        self.record(self.sample())
+
+    # add a set of sampled values
+    def record(self, values):
+        for name, value in values.items():
+            self._samples.setdefault(name, []).append(value)
+
+    # get a dictionary of current metric values
+    def sample(self):
+        psutil = self._psutil
+        groups = self.groups
+        now = time.time()
+        values = {}
+        if 'cores' in groups:
+            core_usage = psutil.cpu_percent(percpu=True)
+            for i, usage in enumerate(core_usage):
+                values['processor_usage_%d' % i] = usage
+            if 'cpu' in groups:
+                values['processor_usage'] = sum(core_usage) / len(core_usage)
+        elif 'cpu' in groups:
+            values['processor_usage'] = psutil.cpu_percent()
+        if 'memory' in groups:
+            values['memory_usage'] = psutil.virtual_memory().percent
+        if 'swap' in groups:
+            values['swap_usage'] = psutil.swap_memory().percent
+        if 'disk' in groups:
+            values['disk_usage'] = psutil.disk_usage('/').percent
+        counters = {}
+        if 'network' in groups:
+            net_io = psutil.net_io_counters()
+            counters['network_sent_rate'] = net_io.bytes_sent
+            counters['network_received_rate'] = net_io.bytes_recv
+        if 'disk_io' in groups:
+            disk_io = psutil.disk_io_counters()
+            if disk_io:  # may be None if there are no disks (e.g. in some containers)
+                counters['disk_read_rate'] = disk_io.read_bytes
+                counters['disk_write_rate'] = disk_io.write_bytes
+        if counters:
+            if self._last_sample_time:
+                elapsed = now - self._last_sample_time
+                for name, counter in counters.items():
+                    if name in self._last_counters and elapsed > 0:
+                        values[name] = (counter - self._last_counters[name]) / elapsed  # bytes per second
+            self._last_counters = counters
+        if 'process' in groups:
+            values['process_memory'] = self._process.memory_info().rss
+            if hasattr(self._process, 'num_fds'):  # not available on Windows
+                values['process_open_files'] = self._process.num_fds()
+        if 'greenlets' in groups:  # note: this scans all objects, so avoid using it with very short sample intervals
+            values['greenlet_count'] = sum(1 for obj in gc.get_objects() if isinstance(obj, greenlet))
+        self._last_sample_time = now
+        return values
+
+    # send aggregates of the values sampled since the last call
+    def publish(self):
+        if not self._samples:
+            return
+        status_folder = self._controller.path_on_server() + '/status'
+        seq_values = {}
+        for name, values in self._samples.items():
+            summary = summarize(values)
+            for stat, value in summary.items():
+                seq_values['%s/%s_%s' % (status_folder, name, stat)] = value
+            if name in ('processor_usage', 'disk_usage'):
+                seq_values[status_folder + '/' + name] = summary['mean']
+        self._samples = {}
+        self._controller.sequences.update_multiple(seq_values)
+        processor_usage = seq_values.get(status_folder + '/processor_usage', 0)
+        disk_usage = seq_values.get(status_folder + '/disk_usage', 0)
+        if processor_usage > 80 or disk_usage > 80:
+            logging.info('processor usage: %.1f%%, disk usage: %.1f%%' % (processor_usage, disk_usage))
@@ -0,0 +1,105 @@
+import json
+import time
+import weakref
+import itertools
+from collections import deque
+import gevent
+
+
+# a span being timed by a Tracer (used as a context manager)
+class Span(object):
+
+    def __init__(self, tracer, name, category, args):
+        self._tracer = tracer
+        self.name = name
+        self.category = category
+        self.args = args
+        self.start_time = None
+
+    def __enter__(self):
+        self.start_time = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type:
+            self.args['error'] = exc_type.__name__
+        self._tracer.record(self.name, self.start_time, time.time(), self.category, self.args)
+        return False
+
+
+# a span that does nothing; returned by a disabled tracer
+class NullSpan(object):
+
+    # a new dictionary each time, so that callers can set span args (e.g. span.args['count'] = n) without sharing state
+    @property
+    def args(self):
+        return {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+NULL_SPAN = NullSpan()
+
+
+# records timed spans (e.g. a sequence update, the time a message spends in the outgoing queue, or the connect/TLS/transfer
+# phases of an HTTP request) in a fixed-size ring buffer; the buffer can be saved as a Chrome trace file
+# (viewable with chrome://tracing or https://ui.perfetto.dev); if not enabled, span() returns a no-op span
+class Tracer(object):
+
+    def __init__(self, enabled=True, capacity=10000):
+        self.enabled = enabled
+        self._spans = deque(maxlen=capacity)  # (name, category, start time, end time, greenlet ID, args) tuples
+        self._greenlet_ids = weakref.WeakKeyDictionary()  # small integer IDs for greenlets (used as Chrome trace thread IDs); entries are dropped when greenlets are freed
+        self._next_greenlet_id = itertools.count(1)
+
+    # create a span to be used as a context manager, e.g. "with tracer.span('send'):"; args are stored with the span
+    def span(self, name, category='client', **args):
+        if not self.enabled:
+            return NULL_SPAN
+        return Span(self, name, category, args)
+
+    # record a span with known start and end times (in seconds since the epoch)
+    def record(self, name, start_time, end_time, category='client', args=None):
+        if self.enabled:
+            greenlet = gevent.getcurrent()
+            greenlet_id = self._greenlet_ids.get(greenlet)
+            if greenlet_id is None:
+                greenlet_id = self._greenlet_ids[greenlet] = next(self._next_greenlet_id)
+            self._spans.append((name, category, start_time, end_time, greenlet_id, args))
+
+    # get a list of recorded spans as dictionaries
+    def spans(self):
+        return [{'name': name, 'category': category, 'start': start_time, 'duration': end_time - start_time, 'greenlet': greenlet_id, 'args': args or {}}
+                for (name, category, start_time, end_time, greenlet_id, args) in self._spans]
+
+    def clear(self):
+        self._spans.clear()
+
+    # get the recorded spans in the Chrome trace event format
+    def chrome_trace(self):
+        events = []
+        for (name, category, start_time, end_time, greenlet_id, args) in self._spans:
+            events.append({
+                'name': name,
+                'cat': category,
+                'ph': 'X',  # complete event
+                'ts': int(start_time * 1000000),  # microseconds
+                'dur': int((end_time - start_time) * 1000000),
+                'pid': 1,
+                'tid': greenlet_id,
+                'args': args or {},
+            })
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    # save the recorded spans as a Chrome trace file
+    def dump(self, file_name):
+        with open(file_name, 'w') as output_file:
+            json.dump(self.chrome_trace(), output_file, default=str)
+
+
+# a tracer for clients that aren't part of a controller
+NULL_TRACER = Tracer(enabled=False, capacity=1)
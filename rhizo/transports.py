@@ -0,0 +1,193 @@
+import ssl
+import socket
+import select
+import urllib
+try:
+    from httplib import HTTPConnection, HTTPSConnection, HTTPException
+except ImportError:
+    from http.client import HTTPConnection, HTTPSConnection, HTTPException
+from .tracing import NULL_TRACER
+
+
+# MQTT client error codes (same values as paho-mqtt)
+MQTT_ERR_SUCCESS = 0
+MQTT_ERR_NO_CONN = 4
+
+
+# a transport creates the connections used by the client: HTTP requests for the resource API (used by FileClient)
+# and websocket connections and MQTT clients (used by MessageClient); the NetworkTransport connects to a real server,
+# while a LoopbackTransport (see loopback.py) connects to an in-process stand-in server
+class NetworkTransport(object):
+
+    # if max_idle_connections is greater than zero, HTTP connections are kept open and reused between requests
+    # (up to that many idle connections per server); a transport can be shared by multiple controllers (see pool.py);
+    # if a tracer is specified, the connect, TLS handshake and transfer phases of HTTP requests are recorded as spans
+    def __init__(self, max_idle_connections=0, tracer=None):
+        self.tracer = tracer or NULL_TRACER
+        self.connection_pool = ConnectionPool(max_idle_connections, self.tracer) if max_idle_connections else None
+
+    # send an HTTP request to a server; returns response tuple: (response status, response reason, response data)
+    def send_request(self, server, method, path, params, secure=True, accept_type='text/plain', basic_auth=None, ssl_skip_verify=False):
+        if self.connection_pool:
+            return self.connection_pool.send_request(server, method, path, params, secure, accept_type, basic_auth, ssl_skip_verify)
+        return send_request(server, method, path, params, secure, accept_type, basic_auth, ssl_skip_verify, self.tracer)
+
+    # create a websocket client (not yet connected); headers is a list of (name, value) tuples
+    def web_socket(self, url, headers=None):
+        from .wsclient import MonitoredWebSocketClient
+        return MonitoredWebSocketClient(url, protocols=['http-only'], headers=headers)
+
+    # create an MQTT client (with the paho-mqtt version 1 callback API)
+    def mqtt_client(self):
+        import paho.mqtt.client as mqtt
+        if hasattr(mqtt, 'CallbackAPIVersion'):  # paho-mqtt 2.x
+            return mqtt.Client(mqtt.CallbackAPIVersion.VERSION1, transport='websockets')
+        else:
+            return mqtt.Client(transport='websockets')
+
+
+# HTTP methods that can safely be sent twice (e.g. retried on another connection if we can't tell whether the server received them)
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS')
+
+
+# a set of keep-alive HTTP connections that are reused between requests
+class ConnectionPool(object):
+
+    def __init__(self, max_idle=10, tracer=None):
+        self.max_idle = max_idle  # maximum number of idle connections kept per server
+        self.tracer = tracer or NULL_TRACER
+        self.created_count = 0
+        self.reused_count = 0
+        self._idle = {}  # list of idle connections by (server, secure, ssl_skip_verify)
+
+    # send an HTTP request using an idle connection (or a new one if none are available);
+    # returns response tuple: (response status, response reason, response data);
+    # the server may have closed idle connections; idempotent requests that fail on an idle connection are retried on
+    # another connection, while other requests (e.g. POST) are only sent on idle connections that are still open and are
+    # not retried (since the server may have received the request before the failure)
+    def send_request(self, server, method, path, params, secure=True, accept_type='text/plain', basic_auth=None, ssl_skip_verify=False):
+        key = (server, secure, ssl_skip_verify)
+        (body, headers) = encode_request(params, accept_type, basic_auth)
+        idempotent = method.upper() in IDEMPOTENT_METHODS
+        idle = self._idle.get(key)
+        while idle:  # try idle connections first
+            conn = idle.pop()
+            if not idempotent and connection_closed(conn):
+                conn.close()
+                continue
+            try:
+                response = self.request(conn, key, method, path, body, headers)
+                self.reused_count += 1
+                return response
+            except (HTTPException, socket.error):
+                conn.close()
+                if not idempotent:
+                    raise
+        conn = open_connection(server, secure, ssl_skip_verify, self.tracer)
+        self.created_count += 1
+        try:
+            return self.request(conn, key, method, path, body, headers)
+        except:
+            conn.close()
+            raise
+
+    # send a request on the given connection, then return the connection to the idle list if it can be reused
+    def request(self, conn, key, method, path, body, headers):
+        (response, data) = transfer(conn, method, path, body, headers, self.tracer)
+        idle = self._idle.setdefault(key, [])
+        if response.will_close or len(idle) >= self.max_idle:
+            conn.close()
+        else:
+            idle.append(conn)
+        return (response.status, response.reason, data)
+
+    # close all idle connections
+    def close(self):
+        for idle in self._idle.values():
+            for conn in idle:
+                conn.close()
+        self._idle = {}
+
+
+# returns True if an idle keep-alive connection can't be used (e.g. closed by the server); an idle connection
+# shouldn't have anything to read, so if its socket is readable, the server has closed it (or sent something unexpected)
+def connection_closed(conn):
+    if conn.sock is None:
+        return True
+    try:
+        return bool(select.select([conn.sock], [], [], 0)[0])
+    except (ValueError, socket.error):  # e.g. socket already closed
+        return True
+
+
+# an HTTP connection that records its connect phase as a tracing span
+class TracedHTTPConnection(HTTPConnection):
+    tracer = NULL_TRACER
+
+    def connect(self):
+        with self.tracer.span('http.connect', 'http', host=self.host):
+            HTTPConnection.connect(self)
+
+
+# an HTTPS connection that records its connect and TLS handshake phases as separate tracing spans
+class TracedHTTPSConnection(HTTPSConnection):
+    tracer = NULL_TRACER
+
+    def connect(self):
+        with self.tracer.span('http.connect', 'http', host=self.host):
+            HTTPConnection.connect(self)  # TCP connection (and proxy tunnel, if any)
+        with self.tracer.span('http.tls', 'http', host=self.host):
+            self.sock = self._context.wrap_socket(self.sock, server_hostname=self._tunnel_host or self.host)
+
+
+# open an HTTP or HTTPS connection to a server; if a tracer is enabled, the connection records tracing spans
+def open_connection(server, secure=True, ssl_skip_verify=False, tracer=None):
+    traced = tracer is not None and tracer.enabled
+    if secure:
+        connection_class = TracedHTTPSConnection if traced else HTTPSConnection
+        if ssl_skip_verify:
+            conn = connection_class(server, context=ssl._create_unverified_context())
+        else:
+            conn = connection_class(server)
+    else:
+        conn = (TracedHTTPConnection if traced else HTTPConnection)(server)
+    if traced:
+        conn.tracer = tracer
+    return conn
+
+
+# send a request on an open connection and read the response; returns (response, response data);
+# the send, wait (for the response headers) and read phases are recorded as tracing spans
+def transfer(conn, method, path, body, headers, tracer=NULL_TRACER):
+    with tracer.span('http.send', 'http', method=method, path=path):
+        conn.request(method, path, body, headers)
+    with tracer.span('http.wait', 'http'):
+        response = conn.getresponse()
+    with tracer.span('http.read', 'http'):
+        data = response.read()
+    return (response, data)
+
+
+# get the encoded body and headers for a resource API request
+def encode_request(params, accept_type='text/plain', basic_auth=None):
+    headers = {
+        'Content-type': 'application/x-www-form-urlencoded',
+        'Accept': accept_type,
+    }
+    if basic_auth:
+        headers['Authorization'] = 'Basic %s' % basic_auth
+    try:
+        body = urllib.urlencode(params)
+    except:  # python 3
+        body = urllib.parse.urlencode(params)
+    return (body, headers)
+
+
+# send an HTTP request to a server;
+# returns response tuple: (response status, response reason, response data)
+def send_request(server, method, path, params, secure = True, accept_type = 'text/plain', basic_auth = None, ssl_skip_verify = False, tracer = NULL_TRACER):
+    (params, headers) = encode_request(params, accept_type, basic_auth)
+    conn = open_connection(server, secure, ssl_skip_verify, tracer)
+    (response, data) = transfer(conn, method, path, params, headers, tracer)
+    conn.close()
+    return (response.status, response.reason, data)
@@ -0,0 +1,65 @@
+import time
+import logging
+from collections import deque
+import gevent
+from gevent import events
+
+
+# detects greenlets that run for longer than a threshold without yielding to the gevent hub (e.g. a CPU-heavy
+# message handler), which delays everything else (pings, message sending, other handlers); uses gevent's monitoring
+# thread, which reports blocking greenlets (with their stacks) via EventLoopBlocked events; the reports are collected
+# in the monitoring thread and logged (and counted in the controller's metrics) by a greenlet once the hub is free again
+class BlockingWatchdog(object):
+
+    def __init__(self, controller, threshold=0.1):
+        self.threshold = threshold  # seconds
+        self.block_count = 0
+        self.last_report = None  # list of report lines (including the stack of the blocking greenlet)
+        self._reports = deque(maxlen=100)  # appended to in the monitoring thread
+        self._counter = controller.metrics.counter('rhizo_hub_blocked_total', 'times a greenlet blocked the event loop for longer than the watchdog threshold')
+        self._greenlet = None
+        self._previous_config = None  # gevent config values replaced by start() (restored by stop())
+        self._started_monitor_thread = False
+
+    # start monitoring; must be called from the thread running the hub (normally the main thread)
+    def start(self):
+        hub = gevent.get_hub()
+        self._previous_config = (gevent.config.monitor_thread, gevent.config.max_blocking_time, gevent.config.print_blocking_reports)
+        self._started_monitor_thread = hub.periodic_monitoring_thread is None
+        gevent.config.monitor_thread = True
+        gevent.config.max_blocking_time = self.threshold
+        gevent.config.print_blocking_reports = False  # we'll log the reports ourselves
+        events.subscribers.append(self.event_received)
+        hub.start_periodic_monitoring_thread()
+        self._greenlet = gevent.spawn(self.reporter)
+
+    # stop monitoring; restores the previous gevent monitoring settings and stops the monitoring thread if we started it
+    def stop(self):
+        if self.event_received in events.subscribers:
+            events.subscribers.remove(self.event_received)
+        if self._greenlet:
+            self._greenlet.kill(block=False)
+            self._greenlet = None
+        if self._previous_config:
+            (gevent.config.monitor_thread, gevent.config.max_blocking_time, gevent.config.print_blocking_reports) = self._previous_config
+            self._previous_config = None
+            hub = gevent.get_hub()
+            if self._started_monitor_thread and hub.periodic_monitoring_thread is not None:
+                hub.periodic_monitoring_thread.kill()
+                hub.periodic_monitoring_thread = None
+
+    # called in gevent's monitoring thread (not in the hub), so this just queues the report
+    def event_received(self, event):
+        if isinstance(event, events.EventLoopBlocked):
+            self._reports.append((time.time(), list(event.info)))
+
+    # runs as a greenlet that logs and counts blocking reports
+    def reporter(self):
+        while True:
+            gevent.sleep(1)
+            while self._reports:
+                (report_time, report) = self._reports.popleft()
+                self.block_count += 1
+                self._counter.inc()
+                self.last_report = report
+                logging.warning('event loop blocked for more than %.3f seconds:\n%s' % (self.threshold, '\n'.join(report)))
@@ -0,0 +1,115 @@
+import io
+import json
+
+
+# codecs convert message structures to/from the bytes/strings sent over websocket and MQTT connections;
+# text codecs produce strings (sent as text frames, multiple messages per frame separated by newlines);
+# binary codecs produce bytes (sent as binary frames, multiple messages per frame concatenated, since the formats are self-delimiting);
+# decode_all splits a frame into its messages
+
+
+# the standard library JSON codec (the default)
+class JsonCodec(object):
+    name = 'json'
+    binary = False
+
+    def encode(self, message_struct):
+        return json.dumps(message_struct, separators=(',', ':'))
+
+    def decode(self, data):
+        if isinstance(data, bytes):
+            data = data.decode()
+        return json.loads(data)
+
+    def decode_all(self, data):
+        if isinstance(data, bytes):
+            data = data.decode()
+        return [json.loads(line) for line in data.split('\n') if line]
+
+
+# a faster JSON codec using the orjson package; produces the same messages as JsonCodec
+class OrjsonCodec(object):
+    name = 'orjson'
+    binary = False
+
+    def __init__(self):
+        import orjson
+        self._orjson = orjson
+
+    def encode(self, message_struct):
+        return self._orjson.dumps(message_struct).decode()
+
+    def decode(self, data):
+        return self._orjson.loads(data)
+
+    def decode_all(self, data):
+        if isinstance(data, str):
+            data = data.encode()
+        return [self._orjson.loads(line) for line in data.split(b'\n') if line]
+
+
+# a binary codec using the msgpack package
+class MsgpackCodec(object):
+    name = 'msgpack'
+    binary = True
+
+    def __init__(self):
+        import msgpack
+        self._msgpack = msgpack
+
+    def encode(self, message_struct):
+        return self._msgpack.packb(message_struct, use_bin_type=True)
+
+    def decode(self, data):
+        return self._msgpack.unpackb(data, raw=False)
+
+    def decode_all(self, data):
+        unpacker = self._msgpack.Unpacker(raw=False)
+        unpacker.feed(data)
+        return list(unpacker)
+
+
+# a binary codec using the cbor2 package
+class CborCodec(object):
+    name = 'cbor'
+    binary = True
+
+    def __init__(self):
+        import cbor2
+        self._cbor2 = cbor2
+
+    def encode(self, message_struct):
+        return self._cbor2.dumps(message_struct)
+
+    def decode(self, data):
+        return self._cbor2.loads(data)
+
+    def decode_all(self, data):
+        stream = io.BytesIO(data)
+        decoder = self._cbor2.CBORDecoder(stream)
+        message_structs = []
+        while stream.tell() < len(data):
+            message_structs.append(decoder.decode())
+        return message_structs
+
+
+codecs = {
+    'json': JsonCodec,
+    'orjson': OrjsonCodec,
+    'msgpack': MsgpackCodec,
+    'cbor': CborCodec,
+}
+
+
+# get a codec instance by name; raises ValueError for unknown codecs and ImportError if the codec's package is not installed;
+# 'fast_json' selects orjson if it is installed and otherwise falls back to the standard library
+def get_codec(name):
+    if name == 'fast_json':
+        try:
+            return OrjsonCodec()
+        except ImportError:
+            return JsonCodec()
+    if name not in codecs:
+        raise ValueError('unknown message codec: %s' % name)
+    return codecs[name]()
+
@@ -0,0 +1,10 @@
+from ws4py.client.geventclient import WebSocketClient
+
+
+# a websocket client that passes pong control frames to a LinkMonitor
+class MonitoredWebSocketClient(WebSocketClient):
+    link_monitor = None
+
+    def ponged(self, pong):
+        if self.link_monitor:
+            self.link_monitor.pong_received(pong.data)
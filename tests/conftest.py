@@ -0,0 +1,93 @@
+import sys
+
+import pytest
+
+from rhizo.config import Config, make_settings
+from rhizo.controller import Controller
+from rhizo.loopback import LoopbackServer, LoopbackTransport
+from rhizo.metrics import Registry
+from rhizo.scheduler import Scheduler
+from rhizo.tracing import Tracer
+
+
+# records sequence updates instead of sending them
+class FakeSequences(object):
+
+    def __init__(self):
+        self.updates = []
+
+    def update_multiple(self, values, timestamp=None, use_message=True):
+        self.updates.append(values)
+
+
+# records simple (MQTT) messages instead of sending them
+class FakeMessages(object):
+
+    def __init__(self):
+        self.sent = []
+
+    def send_simple(self, path, message):
+        self.sent.append((path, message))
+
+
+# a minimal stand-in for a Controller, with no server connection; tests can replace sequences or messages
+# with real clients (e.g. SequenceClient(controller)) to test them in isolation
+class FakeController(object):
+    VERSION = 'test'
+    BUILD = 'test'
+
+    def __init__(self, config):
+        self.config = Config(config)
+        self.settings = make_settings(self.config)
+        self.metrics = Registry(enabled=self.config.get('enable_metrics', False))
+        self.tracer = Tracer(enabled=False)
+        self.scheduler = Scheduler()
+        self.sequences = FakeSequences()
+        self.messages = FakeMessages()
+
+    def path_on_server(self):
+        return '/test/controller'
+
+    def schedule(self, function, interval, jitter=0.0, delay=None, name=None):
+        return self.scheduler.schedule(function, interval, jitter=jitter, delay=delay, name=name)
+
+
+@pytest.fixture
+def server():
+    return LoopbackServer()
+
+
+# creates controllers connected to the loopback server (or via a gateway if gateway_socket is given);
+# the controllers are closed after the test
+@pytest.fixture
+def controller_factory(server, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)  # controller writes logs to current directory
+    monkeypatch.setattr(sys, 'argv', ['test'])
+    controllers = []
+
+    def make_controller(**config):
+        config.setdefault('server_name', 'loopback')
+        config.setdefault('secret_key', server.secret_key)
+        transport = None if config.get('gateway_socket') else LoopbackTransport(server)
+        controller = Controller(config, transport=transport)
+        controllers.append(controller)
+        return controller
+
+    yield make_controller
+    for controller in controllers:
+        controller.close(timeout=1)
+
+
+# creates FakeControllers with the given config; their schedulers are stopped after the test
+@pytest.fixture
+def fake_controller():
+    controllers = []
+
+    def make_controller(**config):
+        controller = FakeController(config)
+        controllers.append(controller)
+        return controller
+
+    yield make_controller
+    for controller in controllers:
+        controller.scheduler.stop()
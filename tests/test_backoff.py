@@ -0,0 +1,29 @@
+import random
+
+from rhizo.backoff import Backoff
+
+
+def test_growth_and_cap():
+    backoff = Backoff(base_delay=1, max_delay=10, factor=2, jitter=0)
+    assert [backoff.next_delay() for i in range(6)] == [1, 2, 4, 8, 10, 10]
+
+
+def test_jitter():
+    random.seed(1234)
+    backoff = Backoff(base_delay=1, max_delay=10, factor=2, jitter=1.0)
+    delays = [backoff.next_delay() for i in range(6)]
+    random.seed(1234)
+    expected = [min(2 ** i, 10) * (1.0 - random.random()) for i in range(6)]
+    assert delays == expected
+    assert all(0 <= delay <= min(2 ** i, 10) for (i, delay) in enumerate(delays))
+    assert len(set(delays)) == len(delays)
+
+
+def test_reset():
+    backoff = Backoff(base_delay=1, max_delay=10, factor=2, jitter=0)
+    for i in range(3):
+        backoff.next_delay()
+    assert backoff.attempts == 3
+    backoff.reset()
+    assert backoff.attempts == 0
+    assert backoff.next_delay() == 1
@@ -1,7 +1,7 @@
 import os
 from pathlib import Path
 
-from rhizo.config import load_config
+from rhizo.config import load_config, diff_config, make_settings
 
 
 def check_config(config):
@@ -55,3 +55,22 @@ def test_config_update():
     assert config.output_path == '/foo/test'
     assert config.sub_config.a == 'test'
     assert config.sub_config.b == 3
+
+
+def test_diff_config():
+    old_config = _load_test_config('sample_config.yaml')
+    new_config = _load_test_config('sample_config.yaml')
+    assert diff_config(old_config, new_config) == {}
+    new_config.update(_load_test_config('update.yaml'))
+    new_config['added'] = 1
+    del new_config['output_path']
+    changes = diff_config(old_config, new_config)
+    assert changes == {'sub_config': new_config.sub_config, 'added': 1, 'output_path': None}
+
+
+def test_settings():
+    settings = make_settings({'mqtt_packed_samples': True, 'mqtt_pack_interval': 5})
+    assert settings.enable_server is True
+    assert settings.mqtt_packed_samples is False  # requires mqtt_host
+    assert settings.mqtt_pack_interval == 5
+    assert make_settings({'mqtt_host': 'test', 'mqtt_packed_samples': True}).mqtt_packed_samples is True
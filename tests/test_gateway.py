@@ -0,0 +1,91 @@
+import gevent
+import pytest
+
+from rhizo.gateway import GatewayServer, GatewayTransport
+from rhizo.loopback import LoopbackTransport
+
+
+@pytest.fixture
+def gateway(server, tmp_path):
+    gateway = GatewayServer(str(tmp_path / 'gateway.sock'), transport=LoopbackTransport(server), cache_ttl=60)
+    gateway.start()
+    yield gateway
+    gateway.stop()
+
+
+# overrides the controller_factory fixture (in conftest.py) to connect via the gateway; requesting the gateway first
+# means the controllers are closed before the gateway is stopped
+@pytest.fixture
+def controller_factory(gateway, controller_factory):
+
+    def make_controller(**config):
+        config['gateway_socket'] = gateway.socket_path
+        return controller_factory(**config)
+
+    return make_controller
+
+
+def test_gateway_requests(server, gateway, controller_factory):
+    c = controller_factory(enable_server=False)
+    c.files.write('/loopback/controller/test.txt', 'hello')
+    request_count = server.request_count
+    for i in range(3):
+        assert c.files.read('/loopback/controller/test.txt') == b'hello'
+    assert server.request_count == request_count + 1  # the repeated reads are served from the gateway's cache
+    c.files.write('/loopback/controller/test.txt', 'goodbye')  # writes invalidate the cache
+    assert c.files.read('/loopback/controller/test.txt') == b'goodbye'
+
+
+def test_gateway_shared_web_socket(server, gateway, controller_factory):
+    c1 = controller_factory()
+    c2 = controller_factory()
+    assert gateway.stats()['upstream_connections'] == 1
+    assert gateway.stats()['web_sockets'] == 2
+    received = []
+    c1.messages.add_handler(lambda message_type, parameters: received.append((1, message_type)), types=['hello'])
+    c2.messages.add_handler(lambda message_type, parameters: received.append((2, message_type)), types=['hello'])
+    c1.sequences.update('temperature', 21.5)
+    c2.sequences.update('humidity', 40)
+    gevent.sleep(0.3)
+    assert server.sequence_value('/loopback/controller/temperature') == 21.5
+    assert server.sequence_value('/loopback/controller/humidity') == 40
+    server.send_message('/loopback/controller', 'hello', {})
+    gevent.sleep(0.2)
+    assert sorted(received) == [(1, 'hello'), (2, 'hello')]
+
+
+def test_gateway_pings(server, gateway, controller_factory):
+    c = controller_factory(keepalive_min_interval=0.1, keepalive_max_interval=0.2, keepalive_timeout=0.5)
+    gevent.sleep(1.5)
+    link = c.messages.web_socket_link.stats()
+    assert link['pongs'] > 0 and link['timeouts'] == 0  # pings are answered via the upstream connection
+    upstream = list(gateway._upstreams.values())[0]
+    assert not upstream._forwarded_pings
+    upstream._ws.ping = lambda payload: None  # the upstream link stops answering pings
+    gevent.sleep(1.5)
+    assert c.messages.web_socket_link.stats()['timeouts'] > 0  # so the controller sees a dead link
+
+
+def test_gateway_frame_size_limit(server, gateway, controller_factory):
+    gateway.max_frame_size = 200
+    c = controller_factory()
+    upstream = list(gateway._upstreams.values())[0]
+    sent_frames = []
+    send = upstream._ws.send
+
+    def record_send(payload, binary=False):
+        sent_frames.append(payload)
+        send(payload, binary)
+
+    upstream._ws.send = record_send
+    for i in range(20):
+        upstream.queue_frame('{"type": "update", "parameters": {"index": %d}}\n' % i, False)
+    gevent.sleep(0.2)
+    assert len(sent_frames) > 1 and all(len(frame) <= 200 for frame in sent_frames)
+    assert sum(frame.count('\n') for frame in sent_frames) == 20
+
+
+def test_gateway_mqtt_client():
+    pytest.importorskip('paho.mqtt.client')
+    client = GatewayTransport('/nonexistent.sock').mqtt_client()  # MQTT connects directly, not via the gateway
+    assert hasattr(client, 'publish')
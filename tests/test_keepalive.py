@@ -0,0 +1,41 @@
+from rhizo.keepalive import LinkMonitor
+
+
+def test_round_trip_times():
+    link = LinkMonitor(min_interval=5, max_interval=20, timeout=10)
+    payload = link.ping_sent(now=100.0)
+    assert link.ping_time() == 100.0
+    assert link.pong_received(payload.encode(), now=100.2) == 100.2 - 100.0
+    assert link.pong_received(payload, now=100.3) is None  # already answered
+    assert link.pong_received('unknown', now=100.3) is None
+    link.ping_sent(now=110.0)
+    link.pong_received('%.6f' % 110.0, now=110.4)
+    stats = link.stats()
+    assert stats['pings'] == 2 and stats['pongs'] == 2
+    assert abs(stats['min_rtt'] - 0.2) < 1e-6 and abs(stats['max_rtt'] - 0.4) < 1e-6
+    assert abs(stats['jitter'] - 0.2 / 16) < 1e-6
+
+
+def test_adaptive_interval():
+    link = LinkMonitor(min_interval=5, max_interval=20, timeout=10)
+    for i in range(3):
+        link.record_rtt(0.1)
+    assert link.interval == 20  # backs off while the link is healthy
+    link.record_rtt(1.0)
+    assert link.interval == 5  # back to the minimum when the RTT jumps
+    link.reset()
+    assert link.interval == 5
+
+
+def test_timeouts_counted_once():
+    link = LinkMonitor(min_interval=5, max_interval=20, timeout=10)
+    link.ping_sent(now=100.0)
+    assert not link.is_dead(now=105.0)
+    for i in range(5):
+        assert link.is_dead(now=111.0 + i)  # called repeatedly (e.g. by the once-per-second ping task)
+    assert link.stats()['timeouts'] == 1
+    link.ping_sent(now=120.0)
+    assert link.is_dead(now=131.0)
+    assert link.stats()['timeouts'] == 2
+    link.reset()
+    assert not link.is_dead(now=200.0)
@@ -0,0 +1,62 @@
+import os
+import gzip
+import logging
+from rhizo.logfiles import QueuedFileHandler
+
+
+def make_record(message):
+    return logging.LogRecord('test', logging.INFO, __file__, 0, message, None, None)
+
+
+def test_write_and_close(tmp_path):
+    file_name = str(tmp_path / 'log.txt')
+    handler = QueuedFileHandler(file_name, fsync='batch')
+    for i in range(100):
+        handler.emit(make_record('line %d' % i))
+    handler.close()
+    with open(file_name) as input_file:
+        lines = input_file.read().splitlines()
+    assert lines == ['line %d' % i for i in range(100)]
+    assert handler.pending() == 0
+
+
+def test_compressed_rotation(tmp_path):
+    file_name = str(tmp_path / 'log.txt')
+    handler = QueuedFileHandler(file_name, max_bytes=100, backup_count=3)
+    for i in range(20):
+        handler.emit(make_record('x' * 50))
+    handler.close()
+    assert os.path.exists(file_name + '.1.gz')
+    with gzip.open(file_name + '.1.gz', 'rb') as input_file:
+        assert input_file.read().startswith(b'x' * 50)
+    assert not os.path.exists(file_name + '.1')
+
+
+def test_write_errors(tmp_path, capsys):
+    import time
+    file_name = str(tmp_path / 'log.txt')
+    handler = QueuedFileHandler(file_name, fsync='5', flush_interval=0.01)  # numeric settings from config files are strings
+    assert handler.fsync == 5.0
+    handler.emit(make_record('first'))
+    time.sleep(0.1)
+    handler._file.close()  # the next write fails (as if the disk were full or rotation failed)
+    handler.emit(make_record('lost'))
+    time.sleep(0.1)
+    handler.emit(make_record('after error'))  # the writer keeps going (with the file reopened)
+    handler.close()
+    assert handler.error_count == 1
+    assert 'error writing log file' in capsys.readouterr().err
+    with open(file_name) as input_file:
+        assert input_file.read().splitlines() == ['first', 'after error']
+
+
+def test_queue_limit(tmp_path):
+    import time
+    file_name = str(tmp_path / 'log.txt')
+    handler = QueuedFileHandler(file_name, flush_interval=1, max_queued_lines=5)
+    time.sleep(0.05)  # let the writer thread find the queue empty and wait
+    for i in range(8):
+        handler.emit(make_record('line %d' % i))
+    assert handler.pending() == 5
+    assert handler.drop_count == 3
+    handler.close()
@@ -0,0 +1,298 @@
+import sys
+
+import gevent
+import pytest
+
+from rhizo.controller import Controller
+from rhizo.loopback import LoopbackTransport
+
+
+def test_files(server, controller_factory):
+    c = controller_factory(enable_server=False)
+    assert c.path_on_server() == '/loopback/controller'
+    c.files.write('/loopback/controller/test.txt', 'hello')
+    assert c.files.exists('/loopback/controller/test.txt')
+    assert c.files.read('/loopback/controller/test.txt') == b'hello'
+    assert 'test.txt' in [f['name'] for f in c.files.list('/loopback/controller')]
+
+
+def test_web_socket_messages(server, controller_factory):
+    c = controller_factory()
+    received = []
+    c.messages.add_handler(lambda message_type, parameters: received.append((message_type, parameters)), types=['hello'])
+    c.sequences.update('temperature', 21.5)
+    c.sequences.update_multiple({'humidity': 40})
+    gevent.sleep(0.5)
+    assert server.sequence_value('/loopback/controller/temperature') == 21.5
+    assert server.sequence_value('/loopback/controller/humidity') == '40'
+    server.send_message('/loopback/controller', 'hello', {'a': 1})
+    gevent.sleep(0.2)
+    assert received == [('hello', {'a': 1})]
+
+
+def test_mqtt_packed_samples(server, controller_factory):
+    c = controller_factory(enable_ws=False, mqtt_host='loopback', mqtt_packed_samples=True, mqtt_pack_interval=0.1)
+    for i in range(10):
+        c.sequences.update('counter', i)
+    gevent.sleep(0.3)
+    assert [value for (timestamp, value) in server.sequence_values['/loopback/controller/counter']] == list(range(10))
+
+
+def test_request(server, controller_factory):
+    from rhizo.messages import RequestTimeout
+    c = controller_factory()
+    server.add_responder('add', lambda parameters: ('sum', {'sum': parameters['a'] + parameters['b']}))
+    results = [c.messages.request('add', {'a': i, 'b': 1}) for i in range(5)]
+    timers = [timer for (result, timer) in c.messages._pending_requests.values()]
+    assert [result.get(timeout=2)['sum'] for result in results] == [1, 2, 3, 4, 5]
+    assert not c.messages._pending_requests
+    assert all(greenlet.dead for greenlet in timers)  # timeout greenlets are killed when the response arrives
+    with pytest.raises(RequestTimeout):
+        c.messages.request('unknown', {}, timeout=0.1).get(timeout=2)
+
+
+def test_server_log_batching(server, controller_factory):
+    import logging
+    c = controller_factory(server_log_interval=0.1, server_log_rate=200)  # up to 20 lines per batch
+    gevent.sleep(0.3)  # let startup log lines be sent
+    for i in range(10):
+        logging.info('repeated line')
+    for i in range(10):
+        logging.info('line %d' % i)
+    gevent.sleep(0.3)
+    log_values = [value for (timestamp, value) in server.sequence_values['/loopback/controller/log']]
+    assert log_values[-1].startswith('INFO: repeated line (repeated 10 times)\nINFO: line 0\nINFO: line 1')
+    for i in range(25):
+        logging.info('line %d' % i)
+    gevent.sleep(0.3)
+    log_values = [value for (timestamp, value) in server.sequence_values['/loopback/controller/log']]
+    assert log_values[-1].endswith('INFO: line 19\n(5 log lines dropped)')
+
+
+def test_controller_pool(server, tmp_path, monkeypatch):
+    from rhizo.pool import ControllerPool
+    monkeypatch.chdir(tmp_path)
+    pool = ControllerPool({'server_name': 'loopback'}, transport=LoopbackTransport(server))
+    for i in range(3):
+        server.add_controller('/loopback/pool/c%d' % i, 'key-%d' % i)
+        pool.add({'secret_key': 'key-%d' % i})
+    assert pool.wait_ready(timeout=5) == 3
+    for c in pool.controllers:
+        c.sequences.update('value', c.path_on_server())
+    gevent.sleep(0.3)
+    for i in range(3):
+        path = '/loopback/pool/c%d' % i
+        assert server.sequence_value(path + '/value') == path
+
+
+def test_keep_alive_connections(server):
+    from gevent.pywsgi import WSGIServer
+    from rhizo.loopback import make_wsgi_app
+    from rhizo.transports import NetworkTransport
+    import base64
+    http_server = WSGIServer(('localhost', 0), make_wsgi_app(server), log=None)
+    http_server.start()
+    try:
+        transport = NetworkTransport(max_idle_connections=2)
+        basic_auth = base64.b64encode(b'key:' + server.secret_key.encode()).decode()
+        address = 'localhost:%d' % http_server.server_port
+        for i in range(3):
+            (status, reason, data) = transport.send_request(address, 'GET', '/api/v1/resources/loopback/controller', {}, secure=False, basic_auth=basic_auth)
+            assert status == 200
+        assert transport.connection_pool.created_count == 1
+        assert transport.connection_pool.reused_count == 2
+    finally:
+        http_server.stop()
+
+
+def test_remote_profiling(server, controller_factory):
+    c = controller_factory()
+    server.send_message('/loopback/controller', 'profile_start', {'duration': 0.2})
+    server.send_message('/loopback/controller', 'heap_snapshot', {'duration': 0.1})
+    for i in range(100):
+        c.sequences.update('counter', i)
+    gevent.sleep(0.6)
+    results = [params for (folder, message_type, params) in server.message_log if message_type == 'profile_result']
+    assert sorted(result['kind'] for result in results) == ['cpu', 'heap']
+    for result in results:
+        assert server.resources[result['path']]['data']
+    cpu_result = [result for result in results if result['kind'] == 'cpu'][0]
+    assert cpu_result['path'].replace('.txt', '.prof') in server.resources
+
+
+
+def test_profiling_messages_without_parameters(server, controller_factory):
+    c = controller_factory()
+    server.send_message('/loopback/controller', 'profile_start', None)  # defaults are used
+    server.send_message('/loopback/controller', 'get_config', 'not a dict')
+    gevent.sleep(0.1)
+    server.send_message('/loopback/controller', 'profile_stop', [])
+    gevent.sleep(0.3)
+    results = [params for (folder, message_type, params) in server.message_log if message_type == 'profile_result']
+    assert [result['kind'] for result in results] == ['cpu']
+    assert 'CPU profile' in server.resources[results[0]['path']]['data'].decode()
+
+def test_error_notifications(server, controller_factory):
+    c = controller_factory(error_recipients=['someone@example.com', 5550100], error_notification_interval=0.3, error_handler_timeout=0.1)
+    handled = []
+
+    def slow_handler(message, exception):
+        gevent.sleep(1)
+        handled.append(message)
+
+    c.add_error_handler(slow_handler)
+    for i in range(5):
+        c.error('sensor failed', exception=ValueError('bad reading'))
+    c.error('disk full')
+    gevent.sleep(0.1)
+    emails = [params for (folder, message_type, params) in server.message_log if message_type == 'send_email']
+    texts = [params for (folder, message_type, params) in server.message_log if message_type == 'send_text_message']
+    assert len(emails) == 1 and len(texts) == 1  # errors reported together are combined
+    assert emails[0]['subject'] == 'system error (6 errors)'
+    assert '(5 times' in emails[0]['body'] and 'disk full' in emails[0]['body']
+    c.error('disk still full')
+    gevent.sleep(0.1)
+    assert len([1 for (folder, message_type, params) in server.message_log if message_type == 'send_email']) == 1  # waits for the interval
+    gevent.sleep(0.3)
+    emails = [params for (folder, message_type, params) in server.message_log if message_type == 'send_email']
+    assert len(emails) == 2
+    assert emails[1]['body'] == 'disk still full'
+    gevent.sleep(1)
+    assert handled == []  # the slow handler timed out
+
+
+def test_close(server, controller_factory):
+    c = controller_factory(enable_ws=False, mqtt_host='loopback', mqtt_packed_samples=True, mqtt_pack_interval=60)
+    for i in range(5):
+        c.sequences.update('counter', i)  # buffered for the pack interval
+    report = c.close(timeout=2)
+    assert report == {'messages': 0, 'publishes': 0, 'log_lines': 0}
+    assert [value for (timestamp, value) in server.sequence_values['/loopback/controller/counter']] == list(range(5))
+    assert c.close() is report
+
+
+def test_config_reload(server, tmp_path, monkeypatch):
+    import os
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(sys, 'argv', ['test'])
+    config_text = 'server_name: loopback\nsecret_key: %s\nconfig_reload_interval: 0.1\n' % server.secret_key
+    (tmp_path / 'config.yaml').write_text(config_text + 'mqtt_pack_interval: 1.0\n')
+    c = Controller(transport=LoopbackTransport(server))
+    assert c.settings.mqtt_pack_interval == 1.0
+    old_settings = c.settings
+    (tmp_path / 'config.yaml').write_text(config_text + 'mqtt_pack_interval: 2.5\nserver_log_level: error\nenable_ws: false\n')
+    os.utime(str(tmp_path / 'config.yaml'), (0, 0))  # make sure the modification time changes
+    gevent.sleep(0.3)
+    assert c.settings.mqtt_pack_interval == 2.5
+    assert old_settings.mqtt_pack_interval == 1.0  # snapshots aren't modified
+    assert c.config.server_log_level == 'error'
+    assert 'enable_ws' not in c.config  # requires a restart
+    assert c.messages.connected()
+    c.close()
+
+
+def test_config_reload_after_parse_error(server, tmp_path, monkeypatch):
+    import os
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(sys, 'argv', ['test'])
+    config_text = 'server_name: loopback\nsecret_key: %s\nconfig_reload_interval: 0.1\nenable_server: false\n' % server.secret_key
+    (tmp_path / 'config.yaml').write_text(config_text + 'mqtt_pack_interval: 1.0\n')
+    c = Controller(transport=LoopbackTransport(server))
+    (tmp_path / 'config.yaml').write_text(config_text + 'mqtt_pack_interval: [2.5\n')  # partly written
+    os.utime(str(tmp_path / 'config.yaml'), (1, 1))
+    gevent.sleep(0.3)
+    assert c.settings.mqtt_pack_interval == 1.0
+    (tmp_path / 'config.yaml').write_text(config_text + 'mqtt_pack_interval: 2.5\n')  # finished, with the same modification time
+    os.utime(str(tmp_path / 'config.yaml'), (1, 1))
+    gevent.sleep(0.3)
+    assert c.settings.mqtt_pack_interval == 2.5
+    c.close()
+
+
+@pytest.mark.parametrize('mqtt', [False, True])
+def test_sequence_subscriptions(server, controller_factory, mqtt):
+    server.add_controller('/loopback/other', 'other-key')
+    options = {'enable_ws': False, 'mqtt_host': 'loopback'} if mqtt else {}
+    c = controller_factory(**options)
+    other = controller_factory(secret_key='other-key', **options)
+    c.sequences.subscribe(['/loopback/other/temperature', 'humidity'], history=2)
+    gevent.sleep(0.2)
+    for i in range(3):
+        other.sequences.update('temperature', 20 + i)
+    c.sequences.update('humidity', 50)
+    gevent.sleep(0.3)
+    assert str(c.sequences.value('/loopback/other/temperature')) == '22'
+    assert [str(value) for (timestamp, value) in c.sequences.history('/loopback/other/temperature')] == ['21', '22']
+    assert c.sequences.timestamp('/loopback/other/temperature') is not None
+    assert str(c.sequences.value('humidity')) == '50'
+    assert c.sequences.value('/loopback/other/pressure') is None  # not subscribed
+    c.sequences.receive_message('s', 'temperature,2021-01-01T00:00:00 Z,5', '/loopback/other')
+    assert c.sequences.value('/loopback/other/temperature') == '5'
+    assert c.sequences.timestamp('/loopback/other/temperature').year == 2021
+    c.sequences.receive_message('update', {'$t': '2021-01-01T00:00:01 Z', 'temperature': 6, 'pressure': 1000}, '/loopback/other')
+    assert c.sequences.value('/loopback/other/temperature') == 6
+    assert c.sequences.value('/loopback/other/pressure') is None
+
+
+def test_fast_start(server, tmp_path, monkeypatch):
+    import time
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(sys, 'argv', ['test'])
+    transport = LoopbackTransport(server, latency=0.5)  # slow websocket connection
+    start_time = time.time()
+    c = Controller({'server_name': 'loopback', 'secret_key': server.secret_key, 'fast_start': True}, transport=transport)
+    assert time.time() - start_time < 0.4  # doesn't wait for the connection
+    assert not c.ready.is_set()
+    c.sequences.update('temperature', 21.5)  # queued until connected
+    assert c.ready.wait(3)
+    assert c.messages.connected()
+    gevent.sleep(0.2)
+    assert server.sequence_value('/loopback/controller/temperature') == 21.5
+    c.close()
+
+
+def test_ready_without_fast_start(server, controller_factory):
+    c = controller_factory()
+    assert c.ready.is_set() and c.messages.connected()
+    assert controller_factory(enable_server=False).ready.is_set()
+
+
+def test_mqtt_rate_limit_with_web_socket(server, controller_factory):
+    c = controller_factory(mqtt_host='loopback', message_rate=2, message_burst=1)  # websocket left enabled
+    assert c.messages.connected()
+    for i in range(3):
+        c.sequences.update('counter', i)
+    gevent.sleep(0.2)
+    assert len(server.sequence_values.get('/loopback/controller/counter', [])) < 3  # held back by the rate limit
+    gevent.sleep(1.3)
+    assert [int(value) for (timestamp, value) in server.sequence_values['/loopback/controller/counter']] == [0, 1, 2]
+    assert c.messages.lane_stats()['telemetry']['sent'] >= 3
+
+
+@pytest.mark.parametrize('mqtt', [False, True])
+def test_subscription_messages_not_dispatched(server, controller_factory, mqtt):
+    server.add_controller('/loopback/other', 'other-key')
+    options = {'enable_ws': False, 'mqtt_host': 'loopback'} if mqtt else {}
+    c = controller_factory(**options)
+    other = controller_factory(secret_key='other-key', **options)
+    received = []
+    c.messages.add_handler(lambda message_type, parameters: received.append(message_type))
+    c.sequences.subscribe(['/loopback/other/temperature'])
+    gevent.sleep(0.2)
+    server.send_message('/loopback/other', 'reboot', {})  # intended for the other controller
+    server.send_message('/loopback/controller', 'hello', {})
+    other.sequences.update('temperature', 20)
+    gevent.sleep(0.3)
+    assert received == ['hello']
+    assert str(c.sequences.value('/loopback/other/temperature')) == '20'
+
+    # unsubscribing discards the local copy and (for MQTT) the folder subscription
+    c.sequences.unsubscribe('/loopback/other/temperature')
+    assert c.sequences.value('/loopback/other/temperature') is None
+    assert c.sequences.subscribed_folders() == []
+    other.sequences.update('temperature', 21)
+    gevent.sleep(0.3)
+    assert c.sequences.value('/loopback/other/temperature') is None
+    if mqtt:
+        assert c.messages._client.subscribed('/loopback/controller')
+        assert not c.messages._client.subscribed('/loopback/other')
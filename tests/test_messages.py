@@ -0,0 +1,187 @@
+import json
+
+from rhizo.messages import MessageClient
+
+
+def test_build_frame_packs_messages(fake_controller):
+    messages = MessageClient(fake_controller())
+    for i in range(3):
+        messages.send('test', {'index': i})
+    (frame, entries, sizes) = messages.build_frame()
+    assert len(entries) == 3
+    lines = frame.split('\n')
+    assert lines[-1] == ''
+    assert [json.loads(line)['parameters']['index'] for line in lines[:-1]] == [0, 1, 2]
+
+
+def test_build_frame_size_limit(fake_controller):
+    messages = MessageClient(fake_controller(ws_max_frame_size=0))
+    messages.send('test', {'index': 0})
+    messages.send('test', {'index': 1})
+    (frame, entries, sizes) = messages.build_frame()
+    assert len(entries) == 1
+    assert json.loads(frame)['parameters']['index'] == 0
+
+
+
+def test_build_frame_size_in_bytes(fake_controller):
+    import pytest
+    pytest.importorskip('orjson')  # the standard library codec escapes non-ASCII characters
+    message_size = len(('{"type":"test","parameters":{"text":"%s"}}\n' % ('\u00e9' * 10)).encode('utf-8'))
+    messages = MessageClient(fake_controller(message_codec='orjson', ws_max_frame_size=message_size * 2 - 5))
+    for i in range(3):
+        messages.send('test', {'text': '\u00e9' * 10})
+    (frame, entries, sizes) = messages.build_frame()
+    assert len(entries) == 1  # a second message would exceed the limit in bytes, though not in characters
+    assert len(frame.encode('utf-8')) <= messages._controller.settings.ws_max_frame_size
+
+def test_build_frame_skips_stale_messages(fake_controller):
+    messages = MessageClient(fake_controller())
+    messages.send('test', {'index': 0})
+    messages.send('test', {'index': 1})
+    lane = messages._outgoing.lanes['telemetry']
+    (queued_time, message_struct) = lane.entries[0]
+    lane.entries[0] = (queued_time - 10 * 60, message_struct)
+    (frame, entries, sizes) = messages.build_frame()
+    assert len(entries) == 2 and sizes[0] is None
+    assert json.loads(frame)['parameters']['index'] == 1
+
+
+def test_handler_routing(fake_controller):
+    messages = MessageClient(fake_controller())
+    received = []
+    messages.add_handler(lambda message_type, parameters: received.append(('all', message_type)))
+    messages.add_handler(lambda message_type, parameters: received.append(('foo', message_type)), types=['foo'])
+    messages.process_incoming_message('{"type": "foo", "parameters": {}}')
+    messages.process_incoming_message('{"type": "bar", "parameters": {}}')
+    assert received == [('foo', 'foo'), ('all', 'foo'), ('all', 'bar')]
+
+
+def test_handler_worker_pool(fake_controller):
+    import gevent
+    messages = MessageClient(fake_controller())
+    received = []
+
+    def slow_handler(message_type, parameters):
+        gevent.sleep(0.01)
+        received.append(parameters['index'])
+
+    runner = messages.add_handler(slow_handler, types=['foo'], workers=1, queue_size=2, overflow='drop_oldest')
+    for i in range(4):
+        messages.process_incoming_message('{"foo": {"index": %d}}' % i)
+    assert received == []  # handled asynchronously
+    gevent.sleep(0.1)
+    assert received == [2, 3]  # oldest messages dropped when queue is full
+    stats = messages.handler_stats()['slow_handler']
+    assert stats['calls'] == 2
+    assert stats['dropped'] == 2
+    assert runner.queue_depth() == 0
+
+
+class FakeMessageInfo(object):
+    def __init__(self, rc, mid):
+        self.rc = rc
+        self.mid = mid
+
+
+class FakeMqttClient(object):
+    """Records publishes; each publish gets a new message ID."""
+
+    def __init__(self, rc=0):
+        self.rc = rc
+        self.published = []
+
+    def publish(self, topic, payload, qos=0):
+        self.published.append((topic, payload, qos))
+        return FakeMessageInfo(self.rc, len(self.published))
+
+
+def test_mqtt_publish_tracking(fake_controller):
+    messages = MessageClient(fake_controller())
+    messages._client = FakeMqttClient()
+    messages._mqtt_qos = {'alerts': 1}
+    result = messages.send_email('someone@example.com', 'test', 'body')
+    assert messages._client.published[0][0] == 'test/controller'
+    assert messages._client.published[0][2] == 1
+    assert not result.ready()
+    messages.publish_complete(1)
+    assert result.get(timeout=0)
+    messages.publish_complete(2)  # completes before the result is registered
+    result = messages.send('update', {'foo': 1})
+    assert messages._client.published[1][2] == 0
+    assert result.get(timeout=0)
+    stats = messages.publish_stats()
+    assert stats['published'] == 2
+    assert stats['completed'] == 2
+    assert stats['in_flight'] == 0
+
+
+def test_mqtt_publish_error(fake_controller):
+    from rhizo.messages import PublishError
+    import pytest
+    messages = MessageClient(fake_controller())
+    messages._client = FakeMqttClient(rc=4)  # MQTT_ERR_NO_CONN
+    result = messages.send_simple('/test/controller', 's,foo,2021-01-01T00:00:00 Z,1')
+    with pytest.raises(PublishError):
+        result.get(timeout=0)
+    assert messages.publish_stats()['errors'] == 1
+
+
+def test_priority_lanes(fake_controller):
+    messages = MessageClient(fake_controller())
+    for i in range(3):
+        messages.send('update', {'index': i})
+    messages.send('bulk_update', {'index': 3}, message_class='bulk')
+    messages.send_email('someone@example.com', 'test', 'body')
+    messages.send('ping', {})
+    (frame, entries, sizes) = messages.build_frame()
+    assert [json.loads(line)['type'] for line in frame.split('\n')[:-1]] == ['ping', 'send_email', 'update', 'update', 'update', 'bulk_update']
+
+
+def test_mqtt_rate_limit(fake_controller):
+    import gevent
+    messages = MessageClient(fake_controller(message_rate=20, message_burst=1))
+    messages._client = FakeMqttClient()
+    messages._greenlets = [gevent.spawn(messages.mqtt_sender)]
+    messages.send('update', {'index': 0})
+    messages.send('update', {'index': 1})
+    messages.send('ping', {})
+    assert len(messages._client.published) == 1  # the first message is sent right away
+    gevent.sleep(0.01)
+    assert len(messages._client.published) == 2  # then the control message (not rate limited)
+    assert 'ping' in messages._client.published[1][1]
+    gevent.sleep(0.1)
+    assert len(messages._client.published) == 3
+    gevent.killall(messages._greenlets)
+    assert messages.lane_stats()['telemetry']['sent'] == 2
+
+
+def test_handler_stats_names(fake_controller):
+    messages = MessageClient(fake_controller())
+    messages.add_handler(lambda message_type, parameters: None)
+    messages.add_handler(lambda message_type, parameters: None, types=['foo'])
+    messages.process_incoming_message('{"type": "foo", "parameters": {}}')
+    stats = messages.handler_stats()
+    assert sorted(stats) == ['<lambda>', '<lambda>#2']  # lambdas don't share an entry
+    assert stats['<lambda>']['calls'] == stats['<lambda>#2']['calls'] == 1
+
+
+def test_binary_frame_with_several_messages(fake_controller):
+    import pytest
+    msgpack = pytest.importorskip('msgpack')
+    messages = MessageClient(fake_controller(message_codec='msgpack'))
+    received = []
+    messages.add_handler(lambda message_type, parameters: received.append((message_type, parameters['index'])))
+    frame = b''.join(msgpack.packb({'type': 'foo', 'parameters': {'index': i}}) for i in range(3))
+    messages.process_incoming_message(frame)
+    assert received == [('foo', 0), ('foo', 1), ('foo', 2)]
+
+
+def test_controller_without_metrics(fake_controller):
+    from rhizo.sequences import SequenceClient
+    controller = fake_controller()
+    del controller.metrics, controller.tracer  # a controller-like object without metrics or tracer attributes
+    controller.messages = MessageClient(controller)
+    controller.sequences = SequenceClient(controller)
+    controller.messages.send('test', {'index': 0})
+    assert len(controller.messages.build_frame()[1]) == 1
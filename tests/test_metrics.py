@@ -0,0 +1,51 @@
+import sys
+
+import gevent
+
+from rhizo.metrics import Registry, NULL_METRIC
+
+
+def test_render():
+    registry = Registry()
+    registry.counter('requests_total', 'requests').inc(3)
+    registry.gauge('queue_length', function=lambda: 7)
+    histogram = registry.histogram('request_seconds', buckets=(0.1, 1.0))
+    histogram.observe(0.05)
+    histogram.observe(0.5)
+    histogram.observe(5)
+    lines = registry.render().splitlines()
+    assert '# HELP requests_total requests' in lines
+    assert '# TYPE requests_total counter' in lines
+    assert 'requests_total 3' in lines
+    assert 'queue_length 7' in lines
+    assert 'request_seconds_bucket{le="0.1"} 1' in lines
+    assert 'request_seconds_bucket{le="1.0"} 2' in lines
+    assert 'request_seconds_bucket{le="+Inf"} 3' in lines
+    assert 'request_seconds_count 3' in lines
+    assert registry.snapshot()['request_seconds_sum'] == 5.55
+
+
+def test_disabled():
+    registry = Registry(enabled=False)
+    counter = registry.counter('requests_total')
+    counter.inc()
+    assert counter is NULL_METRIC
+    assert registry.render() == '\n'
+
+
+def test_controller_metrics(tmp_path, monkeypatch):
+    from rhizo.controller import Controller
+    from rhizo.loopback import LoopbackServer, LoopbackTransport
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(sys, 'argv', ['test'])
+    server = LoopbackServer()
+    c = Controller({'server_name': 'loopback', 'secret_key': server.secret_key, 'enable_metrics': True}, transport=LoopbackTransport(server))
+    c.sequences.update('temperature', 21.5)
+    c.sequences.update_multiple({'a': 1, 'b': 2})
+    gevent.sleep(0.3)
+    values = c.metrics.snapshot()
+    assert values['rhizo_sequence_updates_total'] == 3
+    assert values['rhizo_http_requests_total'] >= 1
+    assert values['rhizo_ws_connections_total'] == 1
+    assert values['rhizo_ws_messages_sent_total'] >= 3
+    assert values['rhizo_ws_queue_length'] == 0
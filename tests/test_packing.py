@@ -0,0 +1,63 @@
+import datetime
+
+from rhizo import packing
+
+
+def test_pack_round_trip():
+    start = datetime.datetime(2021, 6, 1, 12, 30, 0, 250000)
+    samples = [
+        ('temperature', start, 21.5),
+        ('humidity', start, 40),
+        ('temperature', start + datetime.timedelta(seconds=1), 21.123456789),
+        ('status', start + datetime.timedelta(milliseconds=1500), 'ok'),
+        ('offset', start - datetime.timedelta(seconds=2), -3),
+    ]
+    data = packing.pack_samples(samples)
+    assert packing.is_packed(data)
+    assert packing.unpack_samples(data) == samples
+
+
+def test_pack_size():
+    start = datetime.datetime(2021, 6, 1, 12, 30, 0)
+    names = ['sensor_%d' % i for i in range(10)]
+    samples = []
+    text_size = 0
+    for i in range(100):
+        timestamp = start + datetime.timedelta(seconds=i)
+        for name in names:
+            samples.append((name, timestamp, 20.5 + i))
+            text_size += len('s,%s,%s Z,%s' % (name, timestamp.isoformat(), 20.5 + i))
+    data = packing.pack_samples(samples)
+    assert len(data) * 5 < text_size
+    assert packing.unpack_samples(data) == samples
+
+
+def test_not_packed():
+    assert not packing.is_packed(b'{"update": {}}')
+    assert not packing.is_packed('s,foo,2021-01-01T00:00:00 Z,1')
+
+
+def test_packed_update(fake_controller):
+    from rhizo.sequences import SequenceClient
+    controller = fake_controller(mqtt_host='test', mqtt_packed_samples=True, mqtt_pack_max_samples=3)
+    controller.sequences = SequenceClient(controller)
+    for i in range(3):
+        controller.sequences.update('counter', i)
+    assert len(controller.messages.sent) == 1  # sent once mqtt_pack_max_samples values are buffered
+    (path, data) = controller.messages.sent[0]
+    assert path == '/test/controller'
+    assert [(name, value) for (name, timestamp, value) in packing.unpack_samples(data)] == [('counter', 0), ('counter', 1), ('counter', 2)]
+
+
+def test_pack_special_values():
+    import math
+    start = datetime.datetime(1960, 6, 1, 12, 30, 0)  # before the epoch (e.g. a device with an unset clock)
+    samples = [
+        ('big', start, 1e300),
+        ('small', start, -1e300),
+        ('inf', start, float('inf')),
+        ('nan', start + datetime.timedelta(seconds=1), float('nan')),
+    ]
+    unpacked = packing.unpack_samples(packing.pack_samples(samples))
+    assert unpacked[:3] == samples[:3]
+    assert unpacked[3][:2] == samples[3][:2] and math.isnan(unpacked[3][2])
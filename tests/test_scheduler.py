@@ -0,0 +1,59 @@
+import time
+
+import gevent
+
+from rhizo.scheduler import Scheduler
+
+
+def test_fixed_timetable():
+    scheduler = Scheduler()
+    run_times = []
+
+    def task():
+        run_times.append(time.time())
+        gevent.sleep(0.04)  # the time taken by the task doesn't delay later runs
+
+    start_time = time.time()
+    scheduler.schedule(task, 0.1)
+    gevent.sleep(0.65)
+    scheduler.stop()
+    assert 5 <= len(run_times) <= 6  # (allowing for a slow test machine)
+    for (i, run_time) in enumerate(run_times):
+        assert -0.01 < run_time - (start_time + 0.1 * (i + 1)) < 0.05  # runs would be 0.04 seconds later each time if they drifted
+    assert scheduler.stats()['task']['runs'] >= len(run_times) - 1  # the last run may be stopped before it finishes
+
+
+def test_overrun_and_errors():
+    errors = []
+    scheduler = Scheduler(error_handler=lambda message, exception: errors.append(message))
+
+    def slow_task():
+        gevent.sleep(0.12)
+
+    def failing_task():
+        raise ValueError('test')
+
+    slow = scheduler.schedule(slow_task, 0.05, delay=0)
+    scheduler.schedule(failing_task, 0.05, name='failing')
+    gevent.sleep(0.22)
+    scheduler.stop()
+    assert slow.skip_count >= 2  # runs due while the previous run was still going are skipped
+    assert slow.overrun_count >= 1
+    stats = scheduler.stats()
+    assert stats['failing']['errors'] == len(errors) > 0
+    assert errors[0] == 'error in scheduled task failing'
+
+
+def test_jitter_and_cancel():
+    scheduler = Scheduler()
+    tasks = [scheduler.schedule(lambda: None, 10, jitter=1.0) for i in range(20)]
+    offsets = [task.next_time - time.time() for task in tasks]
+    assert min(offsets) > 9 and max(offsets) <= 20
+    assert len(set(round(offset, 3) for offset in offsets)) > 1  # first runs are spread out
+    run_count = []
+    task = scheduler.schedule(lambda: run_count.append(1), 0.05, delay=0)
+    gevent.sleep(0.07)
+    task.cancel()
+    gevent.sleep(0.1)
+    assert len(run_count) == 2
+    scheduler.stop()
@@ -0,0 +1,48 @@
+import time
+
+from rhizo.shaping import TokenBucket, OutgoingLanes, CONTROL, ALERTS, TELEMETRY, BULK
+
+
+def test_token_bucket():
+    bucket = TokenBucket(100, burst=5)
+    assert bucket.available() == 5
+    bucket.consume(5)
+    assert bucket.available() == 0
+    assert 0 < bucket.wait_time() <= 0.01
+    time.sleep(0.02)
+    assert bucket.available() >= 1
+    assert TokenBucket(0).available() is None  # no limit
+    assert TokenBucket(0).wait_time() == 0
+
+
+def test_lane_priority():
+    lanes = OutgoingLanes()
+    lanes.put('bulk 1', BULK)
+    lanes.put('telemetry 1', TELEMETRY)
+    lanes.put('alert 1', ALERTS)
+    lanes.put('telemetry 2', TELEMETRY)
+    lanes.put('ping', CONTROL)
+    lanes.put('other', 'unknown class')
+    assert len(lanes) == 6
+    entries = lanes.take()
+    assert [item for (lane, queued_time, item) in entries] == ['ping', 'alert 1', 'telemetry 1', 'telemetry 2', 'other', 'bulk 1']
+    lanes.remove(entries[:2], [10, 20])
+    assert len(lanes) == 4
+    stats = lanes.stats()
+    assert stats[CONTROL]['sent'] == 1 and stats[ALERTS]['sent_bytes'] == 20
+    assert stats[TELEMETRY]['queued'] == 3
+
+
+def test_rate_limit():
+    lanes = OutgoingLanes(rate=10, burst=2, bulk_rate=1)
+    for i in range(3):
+        lanes.put(i, TELEMETRY)
+    lanes.put('bulk', BULK)
+    entries = lanes.take()
+    assert [item for (lane, queued_time, item) in entries] == [0, 1]
+    lanes.remove(entries, [1, 1])
+    assert lanes.take() == []
+    assert 0.05 < lanes.wait_time() <= 0.1
+    lanes.put('ping', CONTROL)  # control messages aren't held back
+    assert lanes.wait_time() == 0
+    assert [item for (lane, queued_time, item) in lanes.take()] == ['ping']
@@ -0,0 +1,36 @@
+import pytest
+from rhizo.system_metrics import summarize, SystemMonitor, ALL_GROUPS
+
+
+psutil = pytest.importorskip('psutil')
+
+
+def test_summarize():
+    summary = summarize(list(range(1, 101)))
+    assert summary['min'] == 1
+    assert summary['max'] == 100
+    assert summary['mean'] == 50.5
+    assert summary['p95'] == 95
+
+
+def test_sample_and_publish(fake_controller):
+    controller = fake_controller(system_metrics=list(ALL_GROUPS))
+    monitor = SystemMonitor(controller)
+    for i in range(3):
+        monitor.record(monitor.sample())
+    monitor.publish()
+    values = controller.sequences.updates[0]
+    for name in ('processor_usage', 'memory_usage', 'disk_usage', 'network_sent_rate', 'process_memory', 'greenlet_count'):
+        for stat in ('min', 'mean', 'max', 'p95'):
+            assert '/test/controller/status/%s_%s' % (name, stat) in values
+    assert '/test/controller/status/processor_usage' in values
+    assert '/test/controller/status/processor_usage_0_max' in values
+
+
+def test_first_publish_time(fake_controller):
+    import time
+    controller = fake_controller(system_metrics_publish_interval=1800)
+    SystemMonitor(controller).start()
+    publish_task = [task for task in controller.scheduler.tasks if task.name == 'system_metrics_publish'][0]
+    offset = publish_task.next_time - time.time()
+    assert 14 < offset <= 15 + 1800  # after the first sample, within one publish interval (not delayed by an extra interval)
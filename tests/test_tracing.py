@@ -0,0 +1,89 @@
+import sys
+import json
+
+import gevent
+
+from rhizo.tracing import Tracer, NULL_SPAN
+
+
+def test_spans():
+    tracer = Tracer(capacity=3)
+    for i in range(5):
+        with tracer.span('step', index=i):
+            pass
+    spans = tracer.spans()
+    assert [span['args']['index'] for span in spans] == [2, 3, 4]  # oldest spans are discarded
+    assert all(span['duration'] >= 0 for span in spans)
+    assert Tracer(enabled=False).span('step') is NULL_SPAN
+
+
+def test_span_error():
+    tracer = Tracer()
+    try:
+        with tracer.span('fail'):
+            raise ValueError()
+    except ValueError:
+        pass
+    assert tracer.spans()[0]['args']['error'] == 'ValueError'
+
+
+def test_controller_trace(tmp_path, monkeypatch):
+    from rhizo.controller import Controller
+    from rhizo.loopback import LoopbackServer, LoopbackTransport
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(sys, 'argv', ['test'])
+    server = LoopbackServer()
+    c = Controller({'server_name': 'loopback', 'secret_key': server.secret_key, 'enable_tracing': True}, transport=LoopbackTransport(server))
+    c.messages.add_handler(lambda message_type, parameters: None, types=['hello'])
+    c.sequences.update('temperature', 21.5)
+    server.send_message('/loopback/controller', 'hello', {})
+    gevent.sleep(0.3)
+    names = set(span['name'] for span in c.tracer.spans())
+    assert {'http.request', 'ws.connect', 'sequence.update', 'ws.encode', 'ws.send', 'ws.queued', 'handler'} <= names
+    c.tracer.dump('trace.json')
+    with open('trace.json') as trace_file:
+        events = json.load(trace_file)['traceEvents']
+    assert events[0]['ph'] == 'X'
+
+
+def test_http_phases():
+    import base64
+    from gevent.pywsgi import WSGIServer
+    from rhizo.loopback import LoopbackServer, make_wsgi_app
+    from rhizo.transports import NetworkTransport
+    server = LoopbackServer()
+    http_server = WSGIServer(('localhost', 0), make_wsgi_app(server), log=None)
+    http_server.start()
+    try:
+        tracer = Tracer()
+        transport = NetworkTransport(tracer=tracer)
+        basic_auth = base64.b64encode(b'key:' + server.secret_key.encode()).decode()
+        (status, reason, data) = transport.send_request('localhost:%d' % http_server.server_port, 'GET', '/api/v1/resources/loopback/controller', {}, secure=False, basic_auth=basic_auth)
+        assert status == 200
+        assert [span['name'] for span in tracer.spans()] == ['http.connect', 'http.send', 'http.wait', 'http.read']
+    finally:
+        http_server.stop()
+
+
+def test_null_span_args():
+    with NULL_SPAN as span:
+        span.args['count'] = 1
+    assert NULL_SPAN.args == {}  # not shared between callers
+
+
+def test_greenlet_ids():
+    import gc
+    tracer = Tracer()
+
+    def task():
+        tracer.record('task', 0, 1)
+
+    greenlets = [gevent.spawn(task) for i in range(20)]
+    gevent.joinall(greenlets)
+    assert len(set(span['greenlet'] for span in tracer.spans())) == 20
+    del greenlets
+    gevent.sleep(0)
+    gc.collect()
+    assert len(tracer._greenlet_ids) <= 1  # finished greenlets aren't kept
+    gevent.spawn(task).join()
+    assert tracer.spans()[-1]['greenlet'] == 21  # IDs aren't reused
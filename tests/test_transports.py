@@ -0,0 +1,84 @@
+import socket
+
+import pytest
+
+from rhizo import transports
+from rhizo.transports import ConnectionPool
+
+
+class FakeResponse(object):
+    status = 200
+    reason = 'OK'
+    will_close = False
+
+
+class FakeConnection(object):
+    """Fails requests if stale; otherwise records them."""
+
+    def __init__(self, stale=False):
+        self.stale = stale
+        self.requests = []
+        self.closed = False
+        self.sock = 'socket'
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    def transfer(conn, method, path, body, headers, tracer):
+        if conn.stale:
+            raise socket.error('connection reset')
+        conn.requests.append(method)
+        return (FakeResponse(), b'ok')
+
+    new_connections = []
+
+    def open_connection(server, secure, ssl_skip_verify, tracer):
+        new_connections.append(FakeConnection())
+        return new_connections[-1]
+
+    monkeypatch.setattr(transports, 'transfer', transfer)
+    monkeypatch.setattr(transports, 'open_connection', open_connection)
+    monkeypatch.setattr(transports, 'connection_closed', lambda conn: conn.sock is None)
+    pool = ConnectionPool()
+    pool.new_connections = new_connections
+    return pool
+
+
+def test_idempotent_retry(pool):
+    stale = FakeConnection(stale=True)
+    pool._idle[('server', True, False)] = [stale]
+    assert pool.send_request('server', 'GET', '/api', {}) == (200, 'OK', b'ok')
+    assert stale.closed
+    assert pool.new_connections[0].requests == ['GET']  # retried on a new connection
+
+
+def test_no_retry_for_post(pool):
+    stale = FakeConnection(stale=True)
+    pool._idle[('server', True, False)] = [stale]
+    with pytest.raises(socket.error):
+        pool.send_request('server', 'POST', '/api', {})  # the server may have received it, so it isn't sent again
+    assert stale.closed and not pool.new_connections
+
+
+def test_post_skips_closed_connections(pool):
+    closed = FakeConnection()
+    closed.sock = None  # known to be closed before sending
+    pool._idle[('server', True, False)] = [closed]
+    assert pool.send_request('server', 'POST', '/api', {}) == (200, 'OK', b'ok')
+    assert closed.closed and not closed.requests
+    assert pool.new_connections[0].requests == ['POST']
+
+
+def test_connection_closed():
+    (a, b) = socket.socketpair()
+
+    class Connection(object):
+        sock = a
+
+    assert not transports.connection_closed(Connection())
+    b.close()  # the other end closes the connection
+    assert transports.connection_closed(Connection())
+    a.close()
@@ -0,0 +1,25 @@
+import gevent
+from gevent import monkey
+
+from rhizo.watchdog import BlockingWatchdog
+
+
+def blocking_handler():
+    monkey.get_original('time', 'sleep')(0.5)  # blocks the hub
+
+
+def test_blocking_detected(fake_controller):
+    previous_config = (gevent.config.monitor_thread, gevent.config.max_blocking_time)
+    controller = fake_controller(enable_metrics=True)
+    watchdog = BlockingWatchdog(controller, threshold=0.1)
+    watchdog.start()
+    try:
+        gevent.spawn(blocking_handler).join()
+        gevent.sleep(1.5)
+        assert watchdog.block_count >= 1
+        assert any('blocking_handler' in line for line in watchdog.last_report)
+        assert controller.metrics.snapshot()['rhizo_hub_blocked_total'] == watchdog.block_count
+    finally:
+        watchdog.stop()
+    assert (gevent.config.monitor_thread, gevent.config.max_blocking_time) == previous_config
+    assert gevent.get_hub().periodic_monitoring_thread is None  # monitoring doesn't leak into other tests
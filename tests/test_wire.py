@@ -0,0 +1,40 @@
+import pytest
+
+from rhizo import wire
+
+
+sample_message = {
+    'type': 'update',
+    'parameters': {'$t': '2021-01-01T00:00:00.123456 Z', 'temperature': '21.5', 'humidity': '40'},
+    'folder': '/lab/controller',
+}
+
+
+@pytest.mark.parametrize('name', ['json', 'fast_json', 'orjson', 'msgpack', 'cbor'])
+def test_round_trip(name):
+    try:
+        codec = wire.get_codec(name)
+    except ImportError:
+        pytest.skip('%s codec not installed' % name)
+    data = codec.encode(sample_message)
+    assert isinstance(data, bytes) == codec.binary
+    assert codec.decode(data) == sample_message
+
+
+@pytest.mark.parametrize('name', ['json', 'orjson', 'msgpack', 'cbor'])
+def test_decode_all(name):
+    try:
+        codec = wire.get_codec(name)
+    except ImportError:
+        pytest.skip('%s codec not installed' % name)
+    messages = [sample_message, {'ping': {}}, sample_message]
+    if codec.binary:
+        frame = b''.join(codec.encode(message) for message in messages)
+    else:
+        frame = ''.join(codec.encode(message) + '\n' for message in messages)
+    assert codec.decode_all(frame) == messages
+
+
+def test_unknown_codec():
+    with pytest.raises(ValueError):
+        wire.get_codec('xml')
@@ -1,4 +1,5 @@
 import os
+import sys
 import json
 import base64
 import subprocess
@@ -6,7 +7,7 @@ import gevent
 from rhizo.main import c
 
 
-controller_count = 20
+controller_count = int(sys.argv[1]) if len(sys.argv) > 1 else 20  # optionally specify controller count on command line
 
 
 # initialize controllers
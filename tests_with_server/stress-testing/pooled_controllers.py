@@ -0,0 +1,37 @@
+import sys
+import yaml
+import gevent
+from rhizo.pool import ControllerPool
+
+
+# runs the controllers provisioned by many_controllers.py (in ctrl-NNNN folders) in this process using a ControllerPool
+controller_count = int(sys.argv[1]) if len(sys.argv) > 1 else 20  # optionally specify controller count on command line
+
+
+# load each controller's config and add it to the pool
+pool = None
+for i in range(controller_count):
+    name = 'ctrl-%04d' % i
+    with open(name + '/config.yaml') as config_file:
+        config = yaml.safe_load(config_file)
+    if not pool:
+        pool = ControllerPool({'server_name': config['server_name']})
+    pool.add({'secret_key': config['secret_key']})
+print('connected: %d of %d' % (pool.wait_ready(timeout=60), controller_count))
+
+
+# each controller sends a message every second
+def send_messages(c):
+    name = c.path_on_server().rsplit('/', 1)[1]
+    message_index = 0
+    while True:
+        c.send_message('msg-%s-%d' % (name, message_index), {})
+        gevent.sleep(1)
+        message_index += 1
+
+
+for c in pool.controllers:
+    gevent.spawn(send_messages, c)
+while True:
+    gevent.sleep(10)
+    print(pool.stats())
@@ -0,0 +1,34 @@
+# simulate many controllers reconnecting after a server restart and print the number of connection attempts per second;
+# compares the old fixed 10 second retry with exponential backoff plus jitter (as used by MessageClient);
+# usage: python reconnect_curve.py [controller count] [server downtime in seconds]
+import sys
+from rhizo.backoff import Backoff
+
+
+controller_count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+downtime = float(sys.argv[2]) if len(sys.argv) > 2 else 30
+duration = 120
+
+
+# returns a list of attempt counts per second for controllers that all disconnect at time zero
+def simulate(next_delay):
+    attempts = [0] * duration
+    for i in range(controller_count):
+        t = next_delay(i)
+        while t < duration:
+            attempts[int(t)] += 1
+            if t >= downtime:  # server is back up; connected
+                break
+            t += next_delay(i)
+    return attempts
+
+
+backoffs = [Backoff() for i in range(controller_count)]
+fixed = simulate(lambda i: 10.0)
+jittered = simulate(lambda i: backoffs[i].next_delay())
+print('%d controllers, server down for %.0f seconds' % (controller_count, downtime))
+print('%6s %8s %8s' % ('second', 'fixed', 'jitter'))
+for second in range(duration):
+    if fixed[second] or jittered[second]:
+        print('%6d %8d %8d' % (second, fixed[second], jittered[second]))
+print('peak attempts per second: fixed: %d, jitter: %d' % (max(fixed), max(jittered)))